@@ -1,14 +1,7 @@
-import ast
-from datetime import datetime
-
 import streamlit as st
 
-from median.database import (
-    select_all_unique_flashcard_names,
-    select_flashcard_by_name,
-    update_flashcard_data,
-)
-from median.spaced_repetition import recall_prediction, update_model
+from median.database import select_all_unique_flashcard_names
+from median.spaced_repetition import ReviewSession
 
 st.set_page_config(
     page_title="Flashcard - Median",
@@ -27,21 +20,16 @@ with col1:
     )
 
 with col2:
+    if not option and "review_session" in st.session_state:
+        st.session_state.pop("review_session").close()
     if option:
         st.markdown(f"## {option}")
-        flashcard_data = select_flashcard_by_name(option)
-
-        database = []
-        for q in flashcard_data:
-            try:
-                model = ast.literal_eval(q[4])
-                database.append(dict(factID=q[0], model=model, lastTest=q[5]))
-            except SyntaxError:
-                print(f"Invalid literal: {q[4]}")
-
-        recall_list = recall_prediction(database)
-        factID = recall_list[0]["factID"]
-        if quizz := next((q for q in flashcard_data if q[0] == factID), None):
+        session = st.session_state.get("review_session")
+        if session is None or session.flashcard_name != option:
+            if session is not None:
+                session.close()
+            session = st.session_state["review_session"] = ReviewSession(option)
+        if quizz := session.current():
             st.divider()
             st.write(quizz[2])
             with st.status("Show Answer"):
@@ -65,20 +53,5 @@ with col2:
 
                 if result is not None:
                     st.write(quizz)
-                    new_model = update_model(
-                        model=ast.literal_eval(quizz[4]),
-                        result=result,
-                        total=quizz[6] + 1,
-                        last_test=quizz[5],
-                    )
-
-                    update_flashcard_data(
-                        id_=quizz[0],
-                        question=quizz[1],
-                        answer=quizz[2],
-                        model=new_model,
-                        last_test=datetime.now(),
-                        total=quizz[6] + 1,
-                        flashcard_name=option,
-                    )
+                    session.answer(result)
                     st.rerun()
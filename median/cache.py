@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from median.utils import median_logger
+
+CACHE_DIR_ENV_VAR = "MEDIAN_CACHE_DIR"
+CACHE_DIR = os.environ.get(CACHE_DIR_ENV_VAR) or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "median_cache"
+)
+
+
+class DiskCache:
+    """
+    A persistent key-value cache stored in SQLite, with age- and size-based eviction.
+
+    Entries older than max_age seconds are dropped, then the least recently used
+    entries are dropped until the stored values fit in max_bytes.
+    """
+
+    def __init__(self, name: str, max_bytes: int, max_age: float):
+        """
+        Opens or creates the cache database.
+
+        Args:
+            name (str): The name of the cache, used as its file name in CACHE_DIR.
+            max_bytes (int): The maximum total size of the stored values, in bytes.
+            max_age (float): The maximum age of an entry, in seconds.
+        """
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.db")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        with self._connection() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache
+                                 (key TEXT PRIMARY KEY,
+                                  value TEXT,
+                                  size INTEGER,
+                                  created_at REAL,
+                                  accessed_at REAL)"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache(accessed_at)"
+            )
+
+    @contextmanager
+    def _connection(self):
+        """
+        Context manager yielding a connection that commits on success.
+
+        Yields:
+            Connection: A connection to the cache database.
+        """
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the value stored under a key and marks it as recently used.
+
+        Args:
+            key (str): The key to look up.
+
+        Returns:
+            Optional[str]: The stored value, or None if the key is missing or expired.
+        """
+
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: str):
+        """
+        Stores a value under a key, then evicts expired and least recently used entries.
+
+        Args:
+            key (str): The key to store the value under.
+            value (str): The value to store.
+
+        Returns:
+            None
+        """
+
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache(key, value, size, created_at, accessed_at) VALUES (?,?,?,?,?)",
+                (key, value, len(value.encode()), now, now),
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Removes expired entries and the least recently used entries beyond max_bytes.
+
+        Returns:
+            int: The number of removed entries.
+        """
+
+        with self._connection() as conn:
+            removed = conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[
+                0
+            ] - self.max_bytes
+            if excess > 0:
+                for key, size in conn.execute(
+                    "SELECT key, size FROM cache ORDER BY accessed_at"
+                ).fetchall():
+                    if excess <= 0:
+                        break
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    excess -= size
+                    removed += 1
+        if removed:
+            median_logger.info(f"Evicted {removed} entries from {self.path}")
+        return removed
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+
+        Returns:
+            None
+        """
+
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache")
@@ -0,0 +1,239 @@
+from typing import List, Optional
+
+# The QuizCollection JSON layout, one step per literal or string value.
+# FIRST_ITEM and NEXT_ITEM branch between opening another quiz and closing the collection.
+STRING = "STRING"
+FIRST_ITEM = "FIRST_ITEM"
+NEXT_ITEM = "NEXT_ITEM"
+AFTER_COMMA = "AFTER_COMMA"
+DONE = "DONE"
+PROGRAM = [
+    "{",
+    '"collection"',
+    ":",
+    "[",
+    FIRST_ITEM,
+    AFTER_COMMA,
+    '"question"',
+    ":",
+    STRING,
+    ",",
+    '"answer"',
+    ":",
+    STRING,
+    "}",
+    NEXT_ITEM,
+    "}",
+    DONE,
+]
+QUESTION_STEP = PROGRAM.index('"question"')
+CLOSE_STEP = len(PROGRAM) - 2
+BRANCHES = {
+    FIRST_ITEM: {"{": QUESTION_STEP, "]": CLOSE_STEP},
+    AFTER_COMMA: {"{": QUESTION_STEP},
+    NEXT_ITEM: {",": PROGRAM.index(AFTER_COMMA), "]": CLOSE_STEP},
+}
+WHITESPACE = " \t\n\r"
+HEX_DIGITS = "0123456789abcdefABCDEF"
+ESCAPES = '"\\/bfnrtu'
+# Longest whitespace run between tokens: enough for pretty-printed output, short enough
+# to stop a model stuck emitting blank lines
+MAX_WHITESPACE = 64
+
+# String sub-states: before the opening quote, inside, after a backslash, then 4..1 hex digits
+# left (offsets 6..3), then 1..3 UTF-8 continuation bytes left (offsets 7..9)
+STRING_START, STRING_BODY, STRING_ESCAPE = 0, 1, 2
+UTF8_CONTINUATION = 6
+# Byte-fallback tokens above 0x7F are carried as lone surrogates, as with the "surrogateescape" codec
+BYTE_ESCAPE = 0xDC00
+
+
+class QuizJSONConstraint:
+    """
+    An incremental validator for text that must serialize a QuizCollection.
+
+    It mirrors the schema in median.validator: an object with a "collection" array of
+    objects holding a "question" and an "answer" string, in that order. The state is
+    an immutable tuple so candidate tokens can be tried without copying the validator.
+    """
+
+    def __init__(self):
+        self.state = (0, 0, 0)
+
+    @staticmethod
+    def step(state: tuple, char: str) -> Optional[tuple]:
+        """
+        Advances a state by one character.
+
+        Args:
+            state (tuple): The current step index, offset inside the step and whitespace run length.
+            char (str): The next character.
+
+        Returns:
+            Optional[tuple]: The next state, or None if the character is not allowed.
+        """
+
+        index, offset, whitespace = state
+        expected = PROGRAM[index]
+        at_boundary = offset == 0 and expected != DONE
+
+        if expected == STRING and offset != STRING_START:
+            byte = ord(char) - BYTE_ESCAPE
+            if offset > UTF8_CONTINUATION:
+                if not 0x80 <= byte <= 0xBF:
+                    return None
+                pending = offset - UTF8_CONTINUATION - 1
+                return index, UTF8_CONTINUATION + pending if pending else STRING_BODY, 0
+            if offset == STRING_BODY and 0x80 <= byte <= 0xFF:
+                # A raw byte must start a UTF-8 sequence: 0xC2-0xDF, 0xE0-0xEF or 0xF0-0xF4
+                if not 0xC2 <= byte <= 0xF4:
+                    return None
+                pending = 1 if byte <= 0xDF else 2 if byte <= 0xEF else 3
+                return index, UTF8_CONTINUATION + pending, 0
+            if offset == STRING_BODY:
+                if char == '"':
+                    return index + 1, 0, 0
+                if char == "\\":
+                    return index, STRING_ESCAPE, 0
+                return (index, STRING_BODY, 0) if ord(char) >= 0x20 else None
+            if offset == STRING_ESCAPE:
+                if char not in ESCAPES:
+                    return None
+                return (index, 6, 0) if char == "u" else (index, STRING_BODY, 0)
+            if char not in HEX_DIGITS:
+                return None
+            return (index, STRING_BODY if offset == 3 else offset - 1, 0)
+
+        if at_boundary and char in WHITESPACE:
+            return (index, 0, whitespace + 1) if whitespace < MAX_WHITESPACE else None
+        if expected == DONE:
+            return None
+        if expected == STRING:
+            return (index, STRING_BODY, 0) if char == '"' else None
+        if expected in BRANCHES:
+            target = BRANCHES[expected].get(char)
+            return None if target is None else (target, 0, 0)
+        if expected[offset] != char:
+            return None
+        if offset + 1 == len(expected):
+            return index + 1, 0, 0
+        return index, offset + 1, 0
+
+    @classmethod
+    def advance_text(cls, state: tuple, text: str) -> Optional[tuple]:
+        """
+        Advances a state by a piece of text.
+
+        Args:
+            state (tuple): The current state.
+            text (str): The text to consume.
+
+        Returns:
+            Optional[tuple]: The state after the text, or None if any character is not allowed.
+        """
+
+        for char in text:
+            state = cls.step(state, char)
+            if state is None:
+                return None
+        return state
+
+    def allows(self, text: str) -> bool:
+        """
+        Checks whether a piece of text can follow what has been accepted so far.
+
+        Args:
+            text (str): The candidate text.
+
+        Returns:
+            bool: True if the text keeps the output a valid QuizCollection prefix.
+        """
+
+        return bool(text) and self.advance_text(self.state, text) is not None
+
+    def accept(self, text: str):
+        """
+        Consumes a piece of text that was checked with allows().
+
+        Args:
+            text (str): The accepted text.
+
+        Returns:
+            None
+        """
+
+        self.state = self.advance_text(self.state, text)
+
+    @staticmethod
+    def is_complete(state: tuple) -> bool:
+        """
+        Checks whether a state is past the closing brace of the collection.
+
+        Args:
+            state (tuple): The state to check.
+
+        Returns:
+            bool: True if the text leading to the state is a complete QuizCollection.
+        """
+
+        return PROGRAM[state[0]] == DONE
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether the closing brace of the collection has been produced.
+
+        Returns:
+            bool: True once the output is a complete QuizCollection.
+        """
+
+        return self.is_complete(self.state)
+
+
+def token_pieces(tokenizer) -> List[Optional[str]]:
+    """
+    Maps every token id of a HuggingFace tokenizer to the text it contributes to the output.
+
+    Special tokens map to None, so they are never allowed under a constraint. Byte-fallback
+    tokens above 0x7F map to a lone surrogate, which the constraint only accepts as part of a
+    complete UTF-8 sequence inside a string; join_pieces() turns them back into text.
+
+    Args:
+        tokenizer: The HuggingFace tokenizer.
+
+    Returns:
+        List[Optional[str]]: The text of each token id.
+    """
+
+    special = set(tokenizer.all_special_ids)
+    pieces = []
+    for token_id, token in enumerate(tokenizer.convert_ids_to_tokens(range(len(tokenizer)))):
+        if token is None or token_id in special:
+            pieces.append(None)
+        elif token.startswith("<0x") and token.endswith(">") and len(token) == 6:
+            byte = int(token[3:5], 16)
+            pieces.append(chr(byte) if byte < 0x80 else chr(BYTE_ESCAPE + byte))
+        elif "▁" in token:
+            pieces.append(token.replace("▁", " "))
+        else:
+            pieces.append(tokenizer.convert_tokens_to_string([token]) or None)
+    return pieces
+
+
+def join_pieces(pieces: List[str]) -> str:
+    """
+    Joins the pieces of generated tokens, decoding the UTF-8 sequences of byte-fallback tokens.
+
+    Args:
+        pieces (List[str]): The pieces of the generated tokens, see token_pieces().
+
+    Returns:
+        str: The generated text; a sequence cut short by max_tokens becomes U+FFFD.
+    """
+
+    return (
+        "".join(pieces)
+        .encode("utf-8", "surrogateescape")
+        .decode("utf-8", "replace")
+        .strip()
+    )
@@ -1,4 +1,7 @@
+import ast
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 from sqlite3 import Error
@@ -6,12 +9,43 @@ from sqlite3 import Error
 from median.utils import median_logger
 
 DB_NAME = "flashcards.db"
+POOL_SIZE = 8
+CACHE_SIZE_KIB = 20000
+
+_POOLS = {}
+_POOL_LOCK = threading.Lock()
+_INITIALIZED = set()
+
+SCHEMA_VERSION = 4
+# Ebisu (alpha, beta, t) model of a card that was never reviewed
+DEFAULT_MODEL = (4.0, 4.0, 24.0)
+FLASHCARD_COLUMNS = "f.id, d.name, f.question, f.answer, f.alpha, f.beta, f.t, f.lastTest, f.total"
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Opens a new connection configured for concurrent readers and a single writer.
+
+    Returns:
+        Connection: A connection to the database.
+    """
+
+    conn = sqlite3.connect(DB_NAME, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    median_logger.info(f"Connected to {DB_NAME}")
+    return conn
 
 
 @contextmanager
 def get_db_connection():
     """
-    Context manager to establish a connection to the database.
+    Context manager to borrow a pooled connection to the database.
+
+    Connections stay open between calls and are shared by every Streamlit session of the
+    process. The schema is migrated the first time a database is used.
 
     Yields:
         Connection: A connection to the database.
@@ -19,51 +53,289 @@ def get_db_connection():
     Raises:
         Error: If there is a database error.
     """
-    conn = None
+
+    with _POOL_LOCK:
+        pool = _POOLS.setdefault(DB_NAME, queue.LifoQueue(maxsize=POOL_SIZE))
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
     try:
-        conn = sqlite3.connect(DB_NAME)
-        median_logger.info(f"Connected to {DB_NAME}")
+        if DB_NAME not in _INITIALIZED:
+            with _POOL_LOCK:
+                if DB_NAME not in _INITIALIZED:
+                    migrate(conn)
+                    _INITIALIZED.add(DB_NAME)
         yield conn
     except Error as e:
         median_logger.error(f"Database error: {e}")
         raise
     finally:
-        if conn:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
             conn.close()
-            median_logger.info(f"Connection to {DB_NAME} closed")
+
+
+def _parse_legacy_date(value) -> float:
+    """
+    Converts a lastTest value of the version 0 schema to an epoch timestamp.
+
+    Args:
+        value: The stored value, a "%Y-%m-%d %H:%M:%S[.%f]" string or a number.
+
+    Returns:
+        float: The epoch timestamp, or the current time if the value cannot be parsed.
+    """
+
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        median_logger.error(f"Invalid lastTest {value!r}, using the current time")
+        return datetime.now().timestamp()
+
+
+def _parse_legacy_model(value) -> tuple:
+    """
+    Converts a stringified model tuple of the version 0 schema to (alpha, beta, t).
+
+    Args:
+        value: The stored value, such as "(4.0, 4.0, 24.0)".
+
+    Returns:
+        tuple: The (alpha, beta, t) model, or DEFAULT_MODEL if the value cannot be parsed.
+    """
+
+    try:
+        alpha, beta, t = ast.literal_eval(value)
+        return float(alpha), float(beta), float(t)
+    except (SyntaxError, TypeError, ValueError):
+        median_logger.error(f"Invalid model {value!r}, using the default model")
+        return DEFAULT_MODEL
+
+
+def _migrate_to_v1(conn: sqlite3.Connection):
+    """
+    Moves decks to their own table and stores the model and lastTest as numbers.
+
+    Rows of an existing version 0 'flashcards' table, in either of its historical column
+    orders, are copied with their IDs preserved.
+
+    Args:
+        conn (Connection): The connection to migrate, inside a transaction.
+
+    Returns:
+        None
+    """
+
+    legacy = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'flashcards'"
+    ).fetchone()
+    if legacy:
+        conn.execute("ALTER TABLE flashcards RENAME TO flashcards_v0")
+    conn.execute(
+        """CREATE TABLE decks
+                         (id INTEGER PRIMARY KEY,
+                          name TEXT NOT NULL UNIQUE)"""
+    )
+    conn.execute(
+        """CREATE TABLE flashcards
+                         (id INTEGER PRIMARY KEY,
+                          deck_id INTEGER NOT NULL REFERENCES decks(id),
+                          question TEXT,
+                          answer TEXT,
+                          alpha REAL,
+                          beta REAL,
+                          t REAL,
+                          lastTest REAL,
+                          total INTEGER)"""
+    )
+    conn.execute("CREATE INDEX idx_flashcards_deck_id ON flashcards(deck_id)")
+    if not legacy:
+        return
+
+    rows = conn.execute(
+        "SELECT id, COALESCE(flashcardName, ''), question, answer, model, lastTest, total FROM flashcards_v0 ORDER BY id"
+    ).fetchall()
+    # Decks are created in the order of their first card, as the old DISTINCT query listed them
+    conn.executemany(
+        "INSERT OR IGNORE INTO decks(name) VALUES (?)", dict.fromkeys((row[1],) for row in rows)
+    )
+    deck_ids = dict(conn.execute("SELECT name, id FROM decks"))
+    conn.executemany(
+        "INSERT INTO flashcards(id, deck_id, question, answer, alpha, beta, t, lastTest, total) VALUES (?,?,?,?,?,?,?,?,?)",
+        [
+            (
+                id_,
+                deck_ids[name],
+                question,
+                answer,
+                *_parse_legacy_model(model),
+                _parse_legacy_date(last_test),
+                total,
+            )
+            for id_, name, question, answer, model, last_test, total in rows
+        ],
+    )
+    conn.execute("DROP TABLE flashcards_v0")
+    median_logger.info(f"Migrated {len(rows)} flashcards to schema version 1")
+
+
+def _migrate_to_v2(conn: sqlite3.Connection):
+    """
+    Adds the 'due' column and the per-deck index the review scheduler reads cards from.
+
+    Args:
+        conn (Connection): The connection to migrate, inside a transaction.
+
+    Returns:
+        None
+    """
+
+    conn.execute("ALTER TABLE flashcards ADD COLUMN due REAL")
+    conn.execute("UPDATE flashcards SET due = lastTest + t * 3600")
+    conn.execute("CREATE INDEX idx_flashcards_deck_due ON flashcards(deck_id, due)")
+
+
+def _migrate_to_v3(conn: sqlite3.Connection):
+    """
+    Adds the 'jobs' table the background deck generation workers take their work from.
+
+    Args:
+        conn (Connection): The connection to migrate, inside a transaction.
+
+    Returns:
+        None
+    """
+
+    conn.execute(
+        """CREATE TABLE jobs
+                         (id INTEGER PRIMARY KEY,
+                          flashcard_name TEXT NOT NULL,
+                          status TEXT NOT NULL,
+                          file_path TEXT NOT NULL,
+                          file_type TEXT NOT NULL,
+                          use_cache INTEGER NOT NULL,
+                          chunks_done INTEGER NOT NULL DEFAULT 0,
+                          chunk_count INTEGER NOT NULL DEFAULT 0,
+                          topics TEXT,
+                          cards TEXT,
+                          error TEXT,
+                          worker_pid INTEGER,
+                          created REAL NOT NULL,
+                          updated REAL NOT NULL)"""
+    )
+    conn.execute("CREATE INDEX idx_jobs_status ON jobs(status, id)")
+
+
+def _migrate_to_v4(conn: sqlite3.Connection):
+    """
+    Adds the 'chunk_errors' column recording the chunks a job could not generate.
+
+    Args:
+        conn (Connection): The connection to migrate, inside a transaction.
+
+    Returns:
+        None
+    """
+
+    conn.execute("ALTER TABLE jobs ADD COLUMN chunk_errors TEXT")
+
+
+MIGRATIONS = [_migrate_to_v1, _migrate_to_v2, _migrate_to_v3, _migrate_to_v4]
+
+
+def migrate(conn: sqlite3.Connection):
+    """
+    Brings the database schema up to SCHEMA_VERSION, one transaction per version.
+
+    The version is read again under the write lock before each migration, so processes
+    migrating the same file concurrently skip the versions another one applied.
+
+    Args:
+        conn (Connection): The connection to migrate.
+
+    Returns:
+        None
+    """
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    for target, migration in enumerate(MIGRATIONS, start=1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        median_logger.info(f"Database schema migrated to version {target}")
 
 
 def create_table():
     """
-    Creates a table in the database.
+    Creates or migrates the tables in the database.
 
     Returns:
         None
     """
 
     with get_db_connection() as conn:
-        c = conn.cursor()
         try:
-            c.execute(
-                """CREATE TABLE IF NOT EXISTS flashcards
-                                 (id INTEGER PRIMARY KEY,
-                                  question TEXT, 
-                                  answer TEXT, 
-                                  model TEXT, 
-                                  lastTest TEXT,
-                                  total INTEGER,  
-                                  flashcardName TEXT)"""
-            )
-            median_logger.info("Table flashcards created")
+            migrate(conn)
         except Error as e:
             median_logger.error(f"Failed to create table: {e}")
             raise
 
 
+def due_timestamp(model: tuple, last_test: float) -> float:
+    """
+    Computes when a card's predicted recall falls to one half.
+
+    Ebisu rebalances updated models so that t is the half-life, which makes the due time
+    lastTest + t hours; ordering a deck by it needs no per-card recall computation.
+
+    Args:
+        model (tuple): The (alpha, beta, t) model of the card.
+        last_test (float): The epoch timestamp of the last test.
+
+    Returns:
+        float: The epoch timestamp at which the card is due.
+    """
+
+    return last_test + model[2] * 3600
+
+
+def _deck_id(conn: sqlite3.Connection, flashcard_name: str) -> int:
+    """
+    Returns the ID of a deck, creating the deck if needed.
+
+    Args:
+        conn (Connection): The connection to use.
+        flashcard_name (str): The name of the deck.
+
+    Returns:
+        int: The ID of the deck.
+    """
+
+    conn.execute("INSERT OR IGNORE INTO decks(name) VALUES (?)", (flashcard_name,))
+    return conn.execute(
+        "SELECT id FROM decks WHERE name = ?", (flashcard_name,)
+    ).fetchone()[0]
+
+
 def insert_flashcard_data(
     question: str,
     answer: str,
-    model: str,
+    model: tuple,
     last_test: datetime,
     total: int,
     flashcard_name: str,
@@ -74,7 +346,7 @@ def insert_flashcard_data(
     Args:
         question (str): The question for the flashcard.
         answer (str): The answer for the flashcard.
-        model (str): The model associated with the flashcard.
+        model (tuple): The (alpha, beta, t) model associated with the flashcard.
         last_test (datetime): The date of the last test for the flashcard.
         total (int): The total number of tests taken for the flashcard.
         flashcard_name (str): The name of the flashcard.
@@ -90,8 +362,16 @@ def insert_flashcard_data(
         c = conn.cursor()
         try:
             c.execute(
-                "INSERT INTO flashcards(question, answer, model, lastTest, total, flashcardName) VALUES (?,?,?,?,?,?)",
-                (question, answer, model, last_test, total, flashcard_name),
+                "INSERT INTO flashcards(deck_id, question, answer, alpha, beta, t, lastTest, total, due) VALUES (?,?,?,?,?,?,?,?,?)",
+                (
+                    _deck_id(conn, flashcard_name),
+                    question,
+                    answer,
+                    *model,
+                    last_test.timestamp(),
+                    total,
+                    due_timestamp(model, last_test.timestamp()),
+                ),
             )
             conn.commit()
             median_logger.info("Flashcard data inserted")
@@ -100,6 +380,62 @@ def insert_flashcard_data(
             raise
 
 
+def insert_flashcards_bulk(
+    flashcards: list[dict],
+    model: tuple,
+    last_test: datetime,
+    total: int,
+    flashcard_name: str,
+) -> list[int]:
+    """
+    Inserts a whole deck into the 'flashcards' table in a single transaction.
+
+    Args:
+        flashcards (list[dict]): The flashcards to insert, each with a 'question' and an 'answer'.
+        model (tuple): The (alpha, beta, t) model associated with every flashcard.
+        last_test (datetime): The date of the last test for every flashcard.
+        total (int): The total number of tests taken for every flashcard.
+        flashcard_name (str): The name of the flashcard deck.
+
+    Returns:
+        list[int]: The IDs of the inserted flashcards, in input order.
+
+    Raises:
+        Error: If there is an error inserting the flashcards; no flashcard is inserted then.
+    """
+
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        try:
+            # Hold the write lock so the new rows get consecutive IDs after the current maximum
+            c.execute("BEGIN IMMEDIATE")
+            deck_id = _deck_id(conn, flashcard_name)
+            first_id = c.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM flashcards").fetchone()[0]
+            c.executemany(
+                "INSERT INTO flashcards(id, deck_id, question, answer, alpha, beta, t, lastTest, total, due) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                [
+                    (
+                        first_id + index,
+                        deck_id,
+                        flashcard["question"],
+                        flashcard["answer"],
+                        *model,
+                        last_test.timestamp(),
+                        total,
+                        due_timestamp(model, last_test.timestamp()),
+                    )
+                    for index, flashcard in enumerate(flashcards)
+                ],
+            )
+            conn.commit()
+            median_logger.info(f"Inserted {len(flashcards)} flashcards into {flashcard_name}")
+            return list(range(first_id, first_id + len(flashcards)))
+        except Error as e:
+            conn.rollback()
+            median_logger.error(f"Failed to insert flashcards: {e}")
+            raise
+
+
 def select_flashcard_by_name(flashcard_name: str) -> list[tuple]:
     """
     Selects flashcard data from the 'flashcards' table in the database based on the flashcard name.
@@ -108,7 +444,7 @@ def select_flashcard_by_name(flashcard_name: str) -> list[tuple]:
         flashcard_name (str): The name of the flashcard to select.
 
     Returns:
-        list[tuple]: A list of tuples containing the selected flashcard data.
+        list[tuple]: A list of (id, flashcard name, question, answer, alpha, beta, t, lastTest epoch, total) tuples.
 
     Raises:
         None
@@ -118,20 +454,8 @@ def select_flashcard_by_name(flashcard_name: str) -> list[tuple]:
         c = conn.cursor()
         try:
             c.execute(
-                """
-        CREATE TABLE IF NOT EXISTS flashcards (
-            id INTEGER PRIMARY KEY,
-            flashcardName TEXT,
-            question TEXT,
-            answer TEXT,
-            model TEXT,
-            lastTest TEXT,
-            total INTEGER
-        )
-    """
-            )
-            c.execute(
-                "SELECT * FROM flashcards WHERE flashcardName = ?", (flashcard_name,)
+                f"SELECT {FLASHCARD_COLUMNS} FROM flashcards f JOIN decks d ON d.id = f.deck_id WHERE d.name = ?",
+                (flashcard_name,),
             )
             median_logger.info(f"Selected flashcard by name: {flashcard_name}")
             return c.fetchall()
@@ -142,7 +466,7 @@ def select_flashcard_by_name(flashcard_name: str) -> list[tuple]:
 
 def select_all_unique_flashcard_names() -> list[str]:
     """
-    Selects all unique flashcard names from the 'flashcards' table in the database.
+    Selects all unique flashcard names from the 'decks' table in the database.
 
     Returns:
         list[str]: A list of unique flashcard names.
@@ -154,20 +478,7 @@ def select_all_unique_flashcard_names() -> list[str]:
     with get_db_connection() as conn:
         c = conn.cursor()
         try:
-            c.execute(
-                """
-        CREATE TABLE IF NOT EXISTS flashcards (
-            id INTEGER PRIMARY KEY,
-            flashcardName TEXT,
-            question TEXT,
-            answer TEXT,
-            model TEXT,
-            lastTest TEXT,
-            total INTEGER
-        )
-    """
-            )
-            c.execute("SELECT DISTINCT flashcardName FROM flashcards")
+            c.execute("SELECT name FROM decks ORDER BY id")
             median_logger.info("Selected all unique flashcard names")
             return [i[0] for i in c.fetchall()]
         except Error as e:
@@ -179,7 +490,7 @@ def update_flashcard_data(
     id_: int,
     question: str,
     answer: str,
-    model: str,
+    model: tuple,
     last_test: datetime,
     total: int,
     flashcard_name: str,
@@ -191,7 +502,7 @@ def update_flashcard_data(
         id_ (int): The ID of the flashcard to update.
         question (str): The updated question for the flashcard.
         answer (str): The updated answer for the flashcard.
-        model (str): The updated model associated with the flashcard.
+        model (tuple): The updated (alpha, beta, t) model associated with the flashcard.
         last_test (datetime): The updated date of the last test for the flashcard.
         total (int): The updated total number of tests taken for the flashcard.
         flashcard_name (str): The updated name of the flashcard.
@@ -207,11 +518,125 @@ def update_flashcard_data(
         c = conn.cursor()
         try:
             c.execute(
-                "UPDATE flashcards SET question = ?, answer = ?, model = ?, lastTest = ?, total = ?, flashcardName = ? WHERE id = ?",
-                (question, answer, model, last_test, total, flashcard_name, id_),
+                "UPDATE flashcards SET deck_id = ?, question = ?, answer = ?, alpha = ?, beta = ?, t = ?, lastTest = ?, total = ?, due = ? WHERE id = ?",
+                (
+                    _deck_id(conn, flashcard_name),
+                    question,
+                    answer,
+                    *model,
+                    last_test.timestamp(),
+                    total,
+                    due_timestamp(model, last_test.timestamp()),
+                    id_,
+                ),
             )
             conn.commit()
             median_logger.info("Flashcard data updated")
         except Error as e:
             median_logger.error(f"Failed to update flashcard data: {e}")
             raise
+
+
+def select_next_due_flashcards(flashcard_name: str, limit: int = 1) -> list[tuple]:
+    """
+    Selects the flashcards of a deck that are due first, through the (deck_id, due) index.
+
+    Args:
+        flashcard_name (str): The name of the deck.
+        limit (int): The maximum number of flashcards to select (default is 1).
+
+    Returns:
+        list[tuple]: Rows shaped like select_flashcard_by_name(), earliest due first.
+
+    Raises:
+        None
+    """
+
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute(
+                f"SELECT {FLASHCARD_COLUMNS} FROM flashcards f JOIN decks d ON d.id = f.deck_id WHERE d.name = ? ORDER BY f.due LIMIT ?",
+                (flashcard_name, limit),
+            )
+            median_logger.info(f"Selected {limit} due flashcards of {flashcard_name}")
+            return c.fetchall()
+        except Error as e:
+            median_logger.error(f"Failed to select due flashcards: {e}")
+            return []
+
+
+def update_flashcard_review(id_: int, model: tuple, last_test: datetime, total: int):
+    """
+    Records the outcome of a review on a single flashcard and reschedules it.
+
+    Args:
+        id_ (int): The ID of the reviewed flashcard.
+        model (tuple): The updated (alpha, beta, t) model of the flashcard.
+        last_test (datetime): The date of the review.
+        total (int): The updated total number of tests taken for the flashcard.
+
+    Returns:
+        None
+
+    Raises:
+        Error: If there is an error updating the flashcard.
+    """
+
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute(
+                "UPDATE flashcards SET alpha = ?, beta = ?, t = ?, lastTest = ?, total = ?, due = ? WHERE id = ?",
+                (
+                    *model,
+                    last_test.timestamp(),
+                    total,
+                    due_timestamp(model, last_test.timestamp()),
+                    id_,
+                ),
+            )
+            conn.commit()
+            median_logger.info(f"Flashcard {id_} rescheduled")
+        except Error as e:
+            median_logger.error(f"Failed to update flashcard review: {e}")
+            raise
+
+
+
+def update_flashcard_reviews_bulk(reviews: list[tuple]):
+    """
+    Records the outcome of several reviews in a single transaction.
+
+    Args:
+        reviews (list[tuple]): (id, (alpha, beta, t) model, review datetime, total) tuples.
+
+    Returns:
+        None
+
+    Raises:
+        Error: If there is an error updating the flashcards; no review is recorded then.
+    """
+
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.executemany(
+                "UPDATE flashcards SET alpha = ?, beta = ?, t = ?, lastTest = ?, total = ?, due = ? WHERE id = ?",
+                [
+                    (
+                        *model,
+                        last_test.timestamp(),
+                        total,
+                        due_timestamp(model, last_test.timestamp()),
+                        id_,
+                    )
+                    for id_, model, last_test, total in reviews
+                ],
+            )
+            conn.commit()
+            median_logger.info(f"Recorded {len(reviews)} reviews")
+        except Error as e:
+            conn.rollback()
+            median_logger.error(f"Failed to record reviews: {e}")
+            raise
@@ -1,7 +1,10 @@
 import spacy.cli
-from mlx_lm import load
 
-model_name = "mlx-community/Mistral-7B-Instruct-v0.2-4bit"
-load(model_name, lazy=False)
+from median.llm_provider import warmup_model
+from median.utils import DEFAULT_SPACY_MODELS, preload_spacy_models
 
-spacy.cli.download("en_core_web_sm")
+warmup_model()
+
+for spacy_model in DEFAULT_SPACY_MODELS.split(","):
+    spacy.cli.download(spacy_model)
+preload_spacy_models()
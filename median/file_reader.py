@@ -1,10 +1,99 @@
-import io
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
 
 import pypdf
 from docx import Document
 
+from median.cache import DiskCache
 from median.utils import median_logger
 
+PARALLEL_MIN_PAGES = 32
+PAGES_PER_TASK = 16
+PAGE_TIMEOUT = 30
+PDF_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+TEXT_BLOCK_SIZE = 1024 * 1024
+# Bump whenever extraction changes so cached text is not reused
+EXTRACTION_VERSION = 1
+EXTRACTION_CACHE = DiskCache(
+    "extraction", max_bytes=512 * 1024 * 1024, max_age=90 * 24 * 60 * 60
+)
+
+_EXECUTOR = None
+
+
+@contextmanager
+def open_binary(file):
+    """
+    Context manager giving seekable binary access to a file without copying it into memory.
+
+    Paths are memory-mapped, so their pages are shared with the OS page cache instead of
+    being copied onto the heap. Uploaded buffers are rewound and used as they are.
+
+    Args:
+        file: The path to the file or a seekable file-like object.
+
+    Yields:
+        A seekable binary stream over the file.
+    """
+
+    if not isinstance(file, str):
+        file.seek(0)
+        yield file
+        return
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield f
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+@contextmanager
+def open_buffer(file):
+    """
+    Context manager exposing the bytes of a file as a memoryview without copying them.
+
+    Args:
+        file: The path to the file or a file-like object.
+
+    Yields:
+        memoryview: A read-only view of the file's bytes.
+    """
+
+    with open_binary(file) as stream:
+        if isinstance(stream, mmap.mmap):
+            buffer = stream
+        elif hasattr(stream, "getbuffer"):
+            buffer = stream.getbuffer()
+        else:
+            buffer = stream.read()
+        with memoryview(buffer) as view, view.toreadonly() as readonly:
+            yield readonly
+
+
+def read_text(text_file) -> str:
+    """
+    Reads the content of a UTF-8 text or Markdown file.
+
+    Args:
+        text_file: The path to the text file or a file-like object.
+
+    Returns:
+        str: The content of the file as a string.
+    """
+
+    with open_buffer(text_file) as view:
+        return str(view, "utf-8")
+
 
 def read_docx(docx_file):
     """
@@ -18,12 +107,165 @@ def read_docx(docx_file):
     """
 
     if isinstance(docx_file, str):
+        # python-docx needs a seekable file object, which an mmap is not
         doc = Document(docx_file)
     else:
-        doc = Document(io.BytesIO(docx_file.read()))
+        with open_binary(docx_file) as stream:
+            doc = Document(stream)
     return "\n".join([paragraph.text for paragraph in doc.paragraphs])
 
 
+class PageTimeoutError(Exception):
+    """
+    Raised when extracting the text of a single PDF page takes longer than allowed.
+    """
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeoutError()
+
+
+def _extract_page(page, page_timeout: float) -> Optional[str]:
+    """
+    Extracts the text of a PDF page, giving up after page_timeout seconds.
+
+    The timeout relies on SIGALRM, so it is only enforced in the main thread of a
+    process, which is where pool workers run their tasks.
+
+    Args:
+        page: The pypdf page.
+        page_timeout (float): The maximum extraction time, in seconds.
+
+    Returns:
+        Optional[str]: The text of the page, or None if extraction failed or timed out.
+    """
+
+    use_alarm = (
+        hasattr(signal, "SIGALRM")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_page_timeout)
+        signal.setitimer(signal.ITIMER_REAL, page_timeout)
+    try:
+        return page.extract_text()
+    except PageTimeoutError:
+        median_logger.error(f"Page extraction timed out after {page_timeout}s")
+        return None
+    except Exception as e:
+        median_logger.error(f"Error extracting PDF page: {e}")
+        return None
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_page_range(
+    path: str, start: int, end: int, page_timeout: float
+) -> list[Optional[str]]:
+    """
+    Extracts the text of a range of pages; runs in a worker process.
+
+    Args:
+        path (str): The path to the PDF file, memory-mapped by the worker.
+        start (int): The index of the first page.
+        end (int): The index after the last page.
+        page_timeout (float): The maximum extraction time of each page, in seconds.
+
+    Returns:
+        list[Optional[str]]: The text of each page in the range, in order, or None for a page that failed.
+    """
+
+    with open_binary(path) as stream:
+        pdf_reader = pypdf.PdfReader(stream)
+        return [
+            _extract_page(pdf_reader.pages[page], page_timeout)
+            for page in range(start, end)
+        ]
+
+
+@contextmanager
+def _as_path(file):
+    """
+    Context manager yielding a path to the file, spilling uploaded buffers to a temporary file.
+
+    Args:
+        file: The path to the file or a file-like object.
+
+    Yields:
+        str: A path that worker processes can open.
+    """
+
+    if isinstance(file, str):
+        yield file
+        return
+    with open_buffer(file) as view, tempfile.NamedTemporaryFile(
+        suffix=".pdf", delete=False
+    ) as tmp:
+        tmp.write(view)
+    try:
+        yield tmp.name
+    finally:
+        os.unlink(tmp.name)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by every PDF extraction of this process.
+
+    Returns:
+        ProcessPoolExecutor: The process pool.
+    """
+
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        # Spawned rather than forked: the parent holds threads and model runtimes
+        # that are not fork-safe
+        _EXECUTOR = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _EXECUTOR
+
+
+def read_pdf_pages(pdf_file) -> list[Optional[str]]:
+    """
+    Reads the text of each page of a PDF file.
+
+    Documents of at least PARALLEL_MIN_PAGES pages are split into ranges of PAGES_PER_TASK
+    pages that are extracted in a process pool; page order is preserved and a page that
+    takes longer than PAGE_TIMEOUT seconds is given up.
+
+    Args:
+        pdf_file: The path to the PDF file or a file-like object.
+
+    Returns:
+        list[Optional[str]]: The text of each page, in order, or None for a page that
+            failed or timed out.
+    """
+
+    with open_binary(pdf_file) as stream:
+        pdf_reader = pypdf.PdfReader(stream)
+        page_count = len(pdf_reader.pages)
+        if page_count < PARALLEL_MIN_PAGES:
+            return [_extract_page(page, PAGE_TIMEOUT) for page in pdf_reader.pages]
+
+    with _as_path(pdf_file) as path:
+        executor = _get_executor()
+        futures = [
+            executor.submit(
+                _extract_page_range,
+                path,
+                start,
+                min(start + PAGES_PER_TASK, page_count),
+                PAGE_TIMEOUT,
+            )
+            for start in range(0, page_count, PAGES_PER_TASK)
+        ]
+        median_logger.info(f"Extracting {page_count} pages in {len(futures)} tasks")
+        return [page for future in futures for page in future.result()]
+
+
 def read_pdf(pdf_file):
     """
     Reads the content of a PDF file.
@@ -36,29 +278,72 @@ def read_pdf(pdf_file):
     """
 
     try:
-        if isinstance(pdf_file, str):
-            with open(pdf_file, "rb") as f:
-                pdf_reader = pypdf.PdfReader(f)
-        else:
-            pdf_reader = pypdf.PdfReader(io.BytesIO(pdf_file.read()))
-
-        pages_text = [
-            pdf_reader.pages[page].extract_text()
-            for page in range(len(pdf_reader.pages))
-        ]
-        return "".join(pages_text)
+        return "".join(page or "" for page in read_pdf_pages(pdf_file))
     except Exception as e:  # Consider catching more specific exceptions
         median_logger.error(f"Error reading PDF file: {e}")
         return None
 
 
-def main(file, file_type):
+def file_hash(file) -> str:
+    """
+    Computes the SHA-256 of a file's content without copying it.
+
+    Args:
+        file: The path to the file or a file-like object.
+
+    Returns:
+        str: The hex digest of the file's content.
+    """
+
+    digest = hashlib.sha256()
+    with open_buffer(file) as view:
+        for offset in range(0, len(view), TEXT_BLOCK_SIZE):
+            digest.update(view[offset : offset + TEXT_BLOCK_SIZE])
+    return digest.hexdigest()
+
+
+def read_sections_cached(file, file_type: str, reader) -> list[str]:
+    """
+    Returns the extracted pages or sections of a file, reusing those cached for identical content.
+
+    An extraction with failed or timed-out pages is returned without those pages but not
+    cached, so a slow extraction under load does not blank them for later uploads.
+
+    Args:
+        file: The file to read.
+        file_type (str): The type of the file, part of the cache key.
+        reader: The function extracting the list of pages or sections on a cache miss, with
+            None for those that failed.
+
+    Returns:
+        list[str]: The text of each page or section.
+    """
+
+    key = f"{EXTRACTION_VERSION}:{file_type}:{file_hash(file)}"
+    if (cached := EXTRACTION_CACHE.get(key)) is not None:
+        median_logger.info("Reusing cached extracted text")
+        return json.loads(cached)
+    sections = reader(file)
+    if None in sections:
+        median_logger.warning(
+            f"Not caching the extraction: {sections.count(None)} pages failed"
+        )
+        return [section or "" for section in sections]
+    EXTRACTION_CACHE.set(key, json.dumps(sections))
+    return sections
+
+
+def main(file, file_type, use_cache: bool = True):
     """
     Main function to read the content of different file types based on the specified file type.
 
+    PDF and DOCX extraction results are cached on disk by content hash, so the same document
+    is only parsed once.
+
     Args:
         file: The file to read.
         file_type: The type of the file to determine the appropriate reader.
+        use_cache (bool): Whether to reuse text already extracted from identical content (default is True).
 
     Returns:
         str: The content of the file as a string.
@@ -67,13 +352,28 @@ def main(file, file_type):
     """
 
     file_readers = {
-        "text/markdown": lambda f: f.read().decode(),
+        "text/markdown": read_text,
         "application/pdf": read_pdf,
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document": read_docx,
-        "text/plain": lambda f: f.read().decode(),
+        "text/plain": read_text,
+    }
+    section_readers = {
+        "application/pdf": read_pdf_pages,
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document": lambda f: [
+            read_docx(f)
+        ],
     }
 
     if file_type not in file_readers:
         raise ValueError(f"Unsupported file type: {file_type}")
 
+    if use_cache and file_type in section_readers:
+        try:
+            return "".join(
+                read_sections_cached(file, file_type, section_readers[file_type])
+            )
+        except Exception as e:  # Consider catching more specific exceptions
+            median_logger.error(f"Error reading file: {e}")
+            return None
+
     return file_readers[file_type](file)
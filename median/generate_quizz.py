@@ -1,11 +1,70 @@
+import hashlib
+import json
+from typing import Union
+
 from langchain.docstore.document import Document as LangchainDocument
 
-from median.llm_provider import generation
-from median.utils import get_topics, language_detection, median_logger, split_documents
-from median.validator import validate_json_data
+from median.cache import DiskCache
+from median.llm_provider import (
+    MAX_BATCH_SIZE,
+    MODEL_CONFIG,
+    PROMPT_TEMPLATE_VERSION,
+    batch_generation,
+    chunk_token_budget,
+    generation,
+    resolve_model,
+    token_counter,
+)
+from median.topics import get_topics, get_topics_by_section
+from median.utils import (
+    language_detection,
+    median_logger,
+    remove_near_duplicates,
+    split_documents,
+    split_documents_by_length,
+)
+from median.validator import salvage_collection, validate_json_data
+
+FIXED_CHUNK_SIZE = 4000
+# Stands in for five extracted topics when sizing chunks before their topics are known
+TOPICS_BUDGET_PLACEHOLDER = " ,".join(["extracted key phrase"] * 5)
+GENERATION_FAILED = "Failed to generate valid quiz after 3 attempts."
+
+GENERATION_CACHE = DiskCache(
+    "generation", max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 60 * 60
+)
+
+
+def generation_cache_key(doc: str, lang: str, topics: list[str]) -> str:
+    """
+    Computes the cache key of a generation from everything that shapes its output.
+
+    Args:
+        doc (str): The document for which the quiz is generated.
+        lang (str): The language for the quiz.
+        topics (list[str]): The topics to include in the quiz.
+
+    Returns:
+        str: The SHA-256 hex digest identifying the generation.
+    """
+
+    payload = json.dumps(
+        {
+            "doc": doc,
+            "lang": lang,
+            "topics": " ,".join(topics),
+            "prompt_version": PROMPT_TEMPLATE_VERSION,
+            "model": resolve_model(),
+            "model_config": MODEL_CONFIG,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 
-def generate_quiz_for_doc(doc: str, lang: str, topics: list[str]):
+def generate_quiz_for_doc(
+    doc: str, lang: str, topics: list[str], use_cache: bool = True
+):
     """
     Generates a quiz based on a document, language, and topics.
 
@@ -13,6 +72,7 @@ def generate_quiz_for_doc(doc: str, lang: str, topics: list[str]):
         doc (str): The document for which the quiz is generated.
         lang (str): The language for the quiz.
         topics (list[str]): The topics to include in the quiz.
+        use_cache (bool): Whether to reuse a cached quiz; a new quiz is cached either way (default is True).
 
     Returns:
         dict: The generated quiz data in JSON format.
@@ -21,41 +81,211 @@ def generate_quiz_for_doc(doc: str, lang: str, topics: list[str]):
         ValueError: If a valid quiz cannot be generated after 3 attempts.
     """
 
+    cache_key = generation_cache_key(doc, lang, topics)
+    if use_cache and (cached := GENERATION_CACHE.get(cache_key)) is not None:
+        median_logger.info("Reusing cached quiz")
+        return json.loads(cached)
+
     median_logger.info(f"Generating quiz for: {doc}")
+    outputs = []
     for attempt in range(3):
         quiz_data = generation(doc, lang, " ,".join(topics))
         median_logger.info(f"Attempt {attempt + 1}, generated quiz: {quiz_data}")
         valid, quiz_json, error = validate_json_data(quiz_data)
         if valid:
+            GENERATION_CACHE.set(cache_key, json.dumps(quiz_json))
             return quiz_json
         median_logger.error(f"Validation failed: {error}")
-    raise ValueError("Failed to generate valid quiz after 3 attempts.")
+        outputs.append(quiz_data)
+    # Partial output is better than none, but is not cached so a later run can do better
+    if (salvaged := salvage_collection(outputs)) is not None:
+        return salvaged
+    raise ValueError(GENERATION_FAILED)
 
 
-def quiz(content: str):
+def generate_quizzes_for_docs(
+    docs: list[str],
+    lang: str,
+    topics: Union[list[str], list[list[str]]],
+    use_cache: bool = True,
+    strict: bool = True,
+):
     """
-    Generates quizzes based on the content provided.
+    Generates quizzes for several documents with batched inference.
+
+    Cached documents are served without inference, and documents whose output fails
+    validation are regenerated together in the next batch. A document that still fails
+    gets the valid cards salvaged from its outputs, which are not cached.
+
+    Args:
+        docs (list[str]): The documents for which the quizzes are generated.
+        lang (str): The language for the quizzes.
+        topics (Union[list[str], list[list[str]]]): The topics to include in the quizzes, shared by
+            every document or one list per document.
+        use_cache (bool): Whether to reuse cached quizzes; new quizzes are cached either way (default is True).
+        strict (bool): Whether a document without any valid card raises, rather than getting None (default is True).
+
+    Returns:
+        list[Optional[dict]]: The generated quiz data in JSON format, one per document and in input order.
+
+    Raises:
+        ValueError: If strict and no valid card can be generated for a document after 3 attempts.
+    """
+
+    doc_topics = topics if topics and isinstance(topics[0], list) else [topics] * len(docs)
+    results = [None] * len(docs)
+    cache_keys = [
+        generation_cache_key(doc, lang, themes) for doc, themes in zip(docs, doc_topics)
+    ]
+    pending = []
+    for index, cache_key in enumerate(cache_keys):
+        cached = GENERATION_CACHE.get(cache_key) if use_cache else None
+        if cached is None:
+            pending.append(index)
+        else:
+            results[index] = json.loads(cached)
+    median_logger.info(f"Reusing {len(docs) - len(pending)} cached quizzes")
+    if not pending:
+        return results
+
+    failed_outputs = {index: [] for index in pending}
+    for attempt in range(3):
+        outputs = batch_generation(
+            [docs[i] for i in pending],
+            lang,
+            [" ,".join(doc_topics[i]) for i in pending],
+        )
+        failed = []
+        for index, quiz_data in zip(pending, outputs):
+            median_logger.info(f"Attempt {attempt + 1}, generated quiz: {quiz_data}")
+            valid, quiz_json, error = validate_json_data(quiz_data)
+            if valid:
+                results[index] = quiz_json
+                GENERATION_CACHE.set(cache_keys[index], json.dumps(quiz_json))
+            else:
+                median_logger.error(f"Validation failed: {error}")
+                failed_outputs[index].append(quiz_data)
+                failed.append(index)
+        pending = failed
+        if not pending:
+            return results
+    for index in pending:
+        results[index] = salvage_collection(failed_outputs[index])
+        if results[index] is None and strict:
+            raise ValueError(GENERATION_FAILED)
+    return results
+
+
+def prepare_chunks(
+    content: str, chunk_mode: str = "context", topic_mode: str = "section"
+) -> tuple:
+    """
+    Detects the language of the content, splits it into chunks and extracts their topics.
 
     Args:
         content (str): The content for which quizzes are generated.
+        chunk_mode (str): "context" packs chunks to the generation model's context budget,
+            "fixed" splits into FIXED_CHUNK_SIZE embedding tokens (default is "context").
+        topic_mode (str): "section" extracts topics per chunk and merges them into the global topics,
+            "global" runs TopicRank once on the whole content (default is "section").
 
     Returns:
-        tuple: A tuple containing the list of generated quizzes and the topics extracted from the content.
+        tuple: The language, the chunks, the topics of the content and the topics of each chunk.
     """
 
     lang = language_detection(content)
     spacy_model = "fr_core_news_sm" if lang == "fr" else "en_core_web_sm"
-    topics = get_topics(content, lang, spacy_model)
+    if topic_mode == "global":
+        topics = get_topics(content, lang, spacy_model)
+        prompt_topics = " ,".join(topics)
+    else:
+        prompt_topics = TOPICS_BUDGET_PLACEHOLDER
 
     corpus = [LangchainDocument(page_content=content.replace("\n\n", " "))]
-    content_split = split_documents(4000, corpus)
-    content_formatted = [doc.page_content for doc in content_split]
+    if chunk_mode == "context":
+        content_split = split_documents_by_length(
+            chunk_token_budget(lang, prompt_topics), corpus, token_counter()
+        )
+    else:
+        content_split = split_documents(FIXED_CHUNK_SIZE, corpus)
+    content_split = remove_near_duplicates(content_split)
+    content_formatted = [doc.page_content for doc in content_split if doc.page_content]
 
-    generated_quizzes = [
-        generate_quiz_for_doc(doc, lang, topics) for doc in content_formatted if doc
-    ]
+    if topic_mode == "global":
+        chunk_topics = [topics] * len(content_formatted)
+    else:
+        topics, chunk_topics = get_topics_by_section(content_formatted, lang, spacy_model)
+    return lang, content_formatted, topics, chunk_topics
 
-    quiz_list = [
-        q for quiz_content in generated_quizzes for q in quiz_content["collection"]
-    ]
+
+def iter_quiz(
+    content: str,
+    use_cache: bool = True,
+    chunk_mode: str = "context",
+    topic_mode: str = "section",
+):
+    """
+    Generates quizzes based on the content provided, yielding each chunk's cards as soon as they validate.
+
+    The first chunk is generated on its own so that its cards arrive without waiting
+    for a full batch; the remaining chunks are generated in batches. A chunk without
+    any valid card is yielded with its error, so the other chunks are not lost.
+
+    Args:
+        content (str): The content for which quizzes are generated.
+        use_cache (bool): Whether to reuse quizzes cached for identical chunks (default is True).
+        chunk_mode (str): "context" or "fixed", see prepare_chunks() (default is "context").
+        topic_mode (str): "section" or "global", see prepare_chunks() (default is "section").
+
+    Yields:
+        tuple: The chunk index, the number of chunks, the chunk's quizzes, the topics extracted from the
+            content and the chunk's error message, or None if it was generated.
+    """
+
+    lang, content_formatted, topics, chunk_topics = prepare_chunks(
+        content, chunk_mode, topic_mode
+    )
+    total = len(content_formatted)
+    start = 0
+    while start < total:
+        end = min(total, start + (1 if start == 0 else MAX_BATCH_SIZE))
+        generated_quizzes = generate_quizzes_for_docs(
+            content_formatted[start:end], lang, chunk_topics[start:end], use_cache, strict=False
+        )
+        for offset, quiz_content in enumerate(generated_quizzes):
+            if quiz_content is None:
+                yield start + offset, total, [], topics, GENERATION_FAILED
+            else:
+                yield start + offset, total, quiz_content["collection"], topics, None
+        start = end
+
+
+def quiz(
+    content: str,
+    use_cache: bool = True,
+    chunk_mode: str = "context",
+    topic_mode: str = "section",
+):
+    """
+    Generates quizzes based on the content provided.
+
+    Args:
+        content (str): The content for which quizzes are generated.
+        use_cache (bool): Whether to reuse quizzes cached for identical chunks (default is True).
+        chunk_mode (str): "context" or "fixed", see iter_quiz() (default is "context").
+        topic_mode (str): "section" or "global", see iter_quiz() (default is "section").
+
+    Returns:
+        tuple: A tuple containing the list of generated quizzes and the topics extracted from the content.
+
+    Raises:
+        ValueError: If a chunk cannot be generated.
+    """
+
+    quiz_list = []
+    topics = []
+    for _, _, cards, topics, error in iter_quiz(content, use_cache, chunk_mode, topic_mode):
+        if error:
+            raise ValueError(error)
+        quiz_list.extend(cards)
     return quiz_list, topics
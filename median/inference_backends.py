@@ -0,0 +1,1174 @@
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Protocol, Tuple
+
+from median.constrained_decoding import QuizJSONConstraint, join_pieces, token_pieces
+from median.utils import get_tokenizer, median_logger
+from median.validator import json_schema
+
+try:
+    import mlx.core as mx
+    from mlx_lm import generate as mlx_generate
+    from mlx_lm import load as mlx_load
+except ImportError:
+    mx = None
+
+try:
+    from llama_cpp import Llama, LlamaGrammar
+except ImportError:
+    Llama = None
+
+try:
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+except ImportError:
+    LlamaPromptLookupDecoding = None
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+BACKEND_ENV_VAR = "MEDIAN_BACKEND"
+DEFAULT_BACKEND = "mlx"
+# An mlx draft model sharing the main model's tokenizer; any value enables prompt lookup with llama_cpp
+DRAFT_MODEL_ENV_VAR = "MEDIAN_DRAFT_MODEL"
+SPECULATIVE_TOKENS = 4
+PROMPT_LOOKUP_TOKENS = 10
+# Number of best-ranked tokens checked against a constraint before scanning the whole vocabulary
+CANDIDATE_WINDOW = 32
+# Additive attention mask value, finite in float16 so masked scores never become -inf
+MASK_VALUE = -1e4
+# Token texts of each tokenizer, dropped with the tokenizer
+TOKEN_PIECES = weakref.WeakKeyDictionary()
+
+# OpenAI-compatible inference server configuration
+API_BASE_ENV_VAR = "MEDIAN_API_BASE"
+API_KEY_ENV_VAR = "MEDIAN_API_KEY"
+MAX_IN_FLIGHT_ENV_VAR = "MEDIAN_MAX_IN_FLIGHT"
+API_BATCH_SIZE_ENV_VAR = "MEDIAN_API_BATCH_SIZE"
+# The request field carrying the JSON schema: "guided_json" for vLLM, "json_schema" for llama.cpp server
+GUIDED_FIELD_ENV_VAR = "MEDIAN_API_GUIDED_FIELD"
+# The request field carrying the repetition penalty: "repetition_penalty" for vLLM, "repeat_penalty" for llama.cpp server
+PENALTY_FIELD_ENV_VAR = "MEDIAN_API_PENALTY_FIELD"
+DEFAULT_API_BASE = "http://localhost:8000/v1"
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_API_BATCH_SIZE = 8
+DEFAULT_GUIDED_FIELD = "guided_json"
+DEFAULT_PENALTY_FIELD = "repetition_penalty"
+# Connect and read timeouts in seconds; when streaming, the read timeout applies between events
+API_TIMEOUT = (10, 600)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class InferenceBackend(Protocol):
+    """
+    The interface every inference backend implements behind median.llm_provider.
+    """
+
+    name: str
+    default_model_name: str
+    default_quantization: str
+    # Whether load() picks weights by quantization; other backends encode it in the model name
+    uses_quantization: bool
+    context_window: int
+    # How many generate() calls may run at the same time against one loaded model
+    max_concurrency: int
+
+    def load(self, model_name: str, quantization: str) -> tuple:
+        """Loads a model and its tokenizer."""
+
+    def count_tokens(self, tokenizer, text: str) -> int:
+        """Counts the tokens of a text with the model's own tokenizer."""
+
+    def generate(self, model, tokenizer, prompt: str, model_config: dict) -> str:
+        """Generates a completion for a single prompt."""
+
+    def generate_batch(
+        self, model, tokenizer, prompts: List[str], model_config: dict
+    ) -> List[str]:
+        """Generates completions for several prompts, in input order."""
+
+
+def _sample_batch(logits, temp: float):
+    """
+    Samples one token per row from a batch of logits.
+
+    Args:
+        logits: The logits of shape (batch, vocab).
+        temp (float): The sampling temperature; 0 selects greedily.
+
+    Returns:
+        mx.array: The sampled token ids of shape (batch,).
+    """
+
+    if temp == 0:
+        return mx.argmax(logits, axis=-1)
+    return mx.random.categorical(logits * (1 / temp))
+
+
+def _apply_repetition_penalty(logits, histories, penalty: float, context_size: int):
+    """
+    Applies a repetition penalty row by row to the recently generated tokens.
+
+    Args:
+        logits: The logits of shape (batch, vocab).
+        histories (list[list[int]]): The tokens generated so far for each row.
+        penalty (float): The repetition penalty.
+        context_size (int): The number of recent tokens the penalty applies to.
+
+    Returns:
+        mx.array: The penalized logits.
+    """
+
+    rows = []
+    for row, history in enumerate(histories):
+        row_logits = logits[row]
+        recent = history[-context_size:]
+        if recent:
+            indices = mx.array(recent)
+            selected = row_logits[indices]
+            selected = mx.where(selected < 0, selected * penalty, selected / penalty)
+            row_logits[indices] = selected
+        rows.append(row_logits)
+    return mx.stack(rows)
+
+
+def _constrained_sample(logits, temp: float, constraints, pieces, finished):
+    """
+    Samples one token per row among the tokens its constraint allows.
+
+    Rows are ranked with the Gumbel-max trick, so taking the best allowed token samples
+    exactly from the distribution renormalized over the allowed tokens while usually
+    only checking a handful of candidates.
+
+    Args:
+        logits: The logits of shape (batch, vocab).
+        temp (float): The sampling temperature; 0 selects greedily.
+        constraints (list[QuizJSONConstraint]): The constraint of each row.
+        pieces (list[Optional[str]]): The text of each token id.
+        finished (list[bool]): Whether each row has already stopped.
+
+    Returns:
+        list[Optional[int]]: The sampled token of each row, or None when nothing is allowed.
+    """
+
+    scores = logits if temp == 0 else logits * (1 / temp) + mx.random.gumbel(logits.shape)
+    order = mx.argsort(-scores, axis=-1)
+    tokens = []
+    for row, constraint in enumerate(constraints):
+        if finished[row]:
+            tokens.append(None)
+            continue
+        token = None
+        for candidates in (order[row, :CANDIDATE_WINDOW], order[row, CANDIDATE_WINDOW:]):
+            token = next(
+                (
+                    t
+                    for t in candidates.tolist()
+                    if pieces[t] is not None and constraint.allows(pieces[t])
+                ),
+                None,
+            )
+            if token is not None:
+                break
+        tokens.append(token)
+    return tokens
+
+
+def _token_pieces(tokenizer) -> List[Optional[str]]:
+    """
+    Returns the text of every token id, computed once per tokenizer.
+
+    Args:
+        tokenizer: The HuggingFace tokenizer.
+
+    Returns:
+        List[Optional[str]]: The text of each token id.
+    """
+
+    if tokenizer not in TOKEN_PIECES:
+        TOKEN_PIECES[tokenizer] = token_pieces(tokenizer)
+    return TOKEN_PIECES[tokenizer]
+
+
+def _sampling_options(model_config: dict) -> dict:
+    """
+    Drops the Median-specific options that mlx_lm.generate does not accept.
+
+    Args:
+        model_config (dict): Additional configuration for the model.
+
+    Returns:
+        dict: The options accepted by mlx_lm.generate.
+    """
+
+    return {
+        k: v for k, v in model_config.items() if k not in ("constrained", "prompt_prefix")
+    }
+
+
+def _batched_forward(model, inputs, mask, cache, all_positions: bool = False):
+    """
+    Runs the decoder layers of an mlx_lm model with an explicit attention mask.
+
+    The stock model call only builds a causal mask, so the layers are walked here to
+    also hide the left padding of shorter prompts. The cache is a new list of immutable
+    (keys, values) arrays, so a cache passed in can be reused by later calls.
+
+    Args:
+        model: The mlx_lm language model.
+        inputs: The token ids of shape (batch, length).
+        mask: The additive attention mask of shape (batch, 1, length, cache_length + length).
+        cache: The per-layer key/value cache, or None on the first step.
+        all_positions (bool): Whether to return the logits of every position rather than the last one.
+
+    Returns:
+        tuple: The logits of the last position, or of every position, and the updated cache.
+    """
+
+    h = model.model.embed_tokens(inputs)
+    cache = [None] * len(model.model.layers) if cache is None else list(cache)
+    for index, layer in enumerate(model.model.layers):
+        h, cache[index] = layer(h, mask.astype(h.dtype), cache[index])
+    if all_positions:
+        return model.lm_head(model.model.norm(h)), cache
+    logits = model.lm_head(model.model.norm(h[:, -1:, :]))
+    return logits[:, -1, :], cache
+
+
+def _causal_mask(length: int, offset: int):
+    """
+    Builds the additive causal mask of a single unpadded row.
+
+    Args:
+        length (int): The number of new tokens.
+        offset (int): The number of tokens already in the cache.
+
+    Returns:
+        mx.array: The mask of shape (1, 1, length, offset + length).
+    """
+
+    rows = mx.arange(length)[:, None] + offset
+    columns = mx.arange(offset + length)[None, :]
+    return mx.where(rows >= columns, 0.0, MASK_VALUE)[None, None, :, :]
+
+
+def _trim_cache(cache, length: int):
+    """
+    Keeps the first tokens of a key/value cache, discarding rejected speculative tokens.
+
+    Args:
+        cache: The per-layer (keys, values) cache.
+        length (int): The number of tokens to keep.
+
+    Returns:
+        list: The trimmed cache.
+    """
+
+    return [(keys[:, :, :length, :], values[:, :, :length, :]) for keys, values in cache]
+
+
+def _greedy_pick(logits_row, pieces, state, history=None, penalty=None, context_size=20):
+    """
+    Picks the most likely token of a row, among the tokens a constraint state allows.
+
+    Args:
+        logits_row: The logits of shape (vocab,).
+        pieces (Optional[list[Optional[str]]]): The text of each token id, or None when unconstrained.
+        state (Optional[tuple]): The QuizJSONConstraint state, or None when unconstrained.
+        history (Optional[list[int]]): The tokens generated before this one.
+        penalty (Optional[float]): The repetition penalty applied to the recent history, if any.
+        context_size (int): The number of recent tokens the penalty applies to (default is 20).
+
+    Returns:
+        tuple: The picked token, or None when nothing is allowed, and the state after it.
+    """
+
+    if penalty:
+        logits_row = _apply_repetition_penalty(logits_row[None], [history], penalty, context_size)[0]
+    if pieces is None:
+        return mx.argmax(logits_row).item(), state
+    order = mx.argsort(-logits_row)
+    for candidates in (order[:CANDIDATE_WINDOW], order[CANDIDATE_WINDOW:]):
+        for token in candidates.tolist():
+            if pieces[token] is not None:
+                next_state = QuizJSONConstraint.advance_text(state, pieces[token])
+                if next_state is not None:
+                    return token, next_state
+    return None, state
+
+
+def _speculative_decode(
+    model,
+    draft_model,
+    tokens: List[int],
+    max_tokens: int,
+    eos_id,
+    pieces=None,
+    cache=None,
+    penalty: Optional[float] = None,
+    context_size: int = 20,
+) -> List[int]:
+    """
+    Decodes greedily with a draft model proposing up to SPECULATIVE_TOKENS tokens per target step.
+
+    The target model checks all proposals in one forward pass and keeps the longest
+    prefix it agrees with, plus its own next token. Each position is penalized for the
+    tokens generated before it, exactly as in MLXBackend.generate_batch(), so the output
+    is the target model's greedy output. Rejected tokens are dropped by slicing the caches.
+
+    Args:
+        model: The target mlx_lm model.
+        draft_model: A smaller mlx_lm model sharing the target's tokenizer.
+        tokens (List[int]): The prompt token ids.
+        max_tokens (int): The maximum number of tokens to generate.
+        eos_id: The end of sequence token id.
+        pieces (Optional[list[Optional[str]]]): The text of each token id to decode under a
+            QuizJSONConstraint, or None to decode freely.
+        cache: A target cache already holding a prefix of the prompt, or None.
+        penalty (Optional[float]): The repetition penalty applied to generated tokens, if any.
+        context_size (int): The number of recent tokens the penalty applies to (default is 20).
+
+    Returns:
+        List[int]: The generated token ids, without the end of sequence token.
+    """
+
+    cached = 0 if cache is None else cache[0][0].shape[2]
+    if len(tokens) - 1 > cached:
+        _, cache = _batched_forward(
+            model,
+            mx.array([tokens[cached:-1]]),
+            _causal_mask(len(tokens) - 1 - cached, cached),
+            cache,
+        )
+    state = QuizJSONConstraint().state if pieces is not None else None
+    sequence = list(tokens)
+    draft_cache, drafted = None, 0
+    generated = []
+    finished = False
+    while not finished and len(generated) < max_tokens:
+        # Feed the draft every token it has not seen yet, then let it propose
+        pending = sequence[drafted:]
+        draft_logits, draft_cache = _batched_forward(
+            draft_model, mx.array([pending]), _causal_mask(len(pending), drafted), draft_cache
+        )
+        proposals, draft_state = [], state
+        while True:
+            token, draft_state = _greedy_pick(
+                draft_logits[0], pieces, draft_state, generated + proposals, penalty, context_size
+            )
+            if token is None:
+                break
+            proposals.append(token)
+            done = token == eos_id or (
+                pieces is not None and QuizJSONConstraint.is_complete(draft_state)
+            )
+            if done or len(proposals) == SPECULATIVE_TOKENS:
+                break
+            draft_logits, draft_cache = _batched_forward(
+                draft_model,
+                mx.array([[token]]),
+                _causal_mask(1, len(sequence) + len(proposals) - 1),
+                draft_cache,
+            )
+
+        base = len(sequence) - 1
+        inputs = [sequence[-1]] + proposals
+        logits, cache = _batched_forward(
+            model, mx.array([inputs]), _causal_mask(len(inputs), base), cache, True
+        )
+        new_tokens = []
+        for position in range(len(inputs)):
+            token, state = _greedy_pick(
+                logits[0, position], pieces, state, generated + new_tokens, penalty, context_size
+            )
+            if token is not None:
+                new_tokens.append(token)
+            finished = (
+                token is None
+                or token == eos_id
+                or (pieces is not None and QuizJSONConstraint.is_complete(state))
+                or len(generated) + len(new_tokens) >= max_tokens
+            )
+            if finished or position == len(proposals) or token != proposals[position]:
+                break
+        accepted = len(new_tokens) - 1 if new_tokens else 0
+
+        cache = _trim_cache(cache, base + 1 + accepted)
+        drafted = len(sequence) + min(accepted, max(len(proposals) - 1, 0))
+        draft_cache = _trim_cache(draft_cache, drafted)
+        sequence.extend(new_tokens)
+        generated.extend(new_tokens)
+    median_logger.debug(f"Speculative decoding generated {len(generated)} tokens")
+    return [t for t in generated if t != eos_id]
+
+
+class MLXBackend:
+    """
+    Runs the model on Apple Silicon through mlx_lm.
+    """
+
+    name = "mlx"
+    default_model_name = "mlx-community/Mistral-7B-Instruct-v0.2-4bit"
+    default_quantization = "4bit"
+    uses_quantization = False
+    context_window = 32768
+    max_concurrency = 1
+
+    def load(self, model_name: str, quantization: str) -> tuple:
+        """
+        Loads an mlx_lm model and tokenizer.
+
+        Args:
+            model_name (str): The name of the model to load.
+            quantization (str): The quantization of the model weights, encoded in the model name for mlx.
+
+        Returns:
+            tuple: A tuple containing the loaded language model and tokenizer.
+        """
+
+        if mx is None:
+            raise ImportError("The mlx backend requires the mlx-lm package")
+        return mlx_load(model_name, lazy=False)
+
+    def count_tokens(self, tokenizer, text: str) -> int:
+        """
+        Counts the tokens of a text with the model's HuggingFace tokenizer.
+
+        Args:
+            tokenizer: The tokenizer.
+            text (str): The text to measure.
+
+        Returns:
+            int: The number of tokens.
+        """
+
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def prefix_cache(self, model, tokenizer, tokens: List[List[int]], prefix: Optional[str]):
+        """
+        Returns the key/value cache of a prompt prefix shared by every prompt, computed once per model.
+
+        The cache holds immutable arrays, so every chunk and retry starting with the same
+        prefix extends it without recomputing it.
+
+        Args:
+            model: The language model.
+            tokenizer: The tokenizer.
+            tokens (List[List[int]]): The token ids of the prompts.
+            prefix (Optional[str]): The text every prompt starts with, such as llm_provider.PROMPT_PREFIX.
+
+        Returns:
+            tuple: The per-layer cache of the prefix for a batch of one, or None, and its length in tokens.
+        """
+
+        if not prefix:
+            return None, 0
+        cached = getattr(self, "_prefix_cache", None)
+        # A weak reference, since a model loaded after an eviction may reuse the old one's id
+        if cached is None or cached[0]() is not model or cached[1] != prefix:
+            prefix_ids = tokenizer.encode(prefix)
+            _, cache = _batched_forward(
+                model, mx.array([prefix_ids]), _causal_mask(len(prefix_ids), 0), None
+            )
+            mx.eval(cache)
+            # One prefix for one model: a new prefix or model replaces the previous one
+            cached = self._prefix_cache = (weakref.ref(model), prefix, prefix_ids, cache)
+            median_logger.info(f"Cached the KV state of a {len(prefix_ids)} token prompt prefix")
+        _, _, prefix_ids, cache = cached
+        length = len(prefix_ids)
+        # Tokens may merge across the boundary, in which case the prefix is not reused
+        if any(len(t) <= length or t[:length] != prefix_ids for t in tokens):
+            return None, 0
+        return cache, length
+
+    def release(self, model, tokenizer):
+        """
+        Drops the state cached for a model leaving the registry, so its memory is freed with it.
+
+        Args:
+            model: The evicted language model.
+            tokenizer: The evicted tokenizer.
+
+        Returns:
+            None
+        """
+
+        cached = getattr(self, "_prefix_cache", None)
+        if cached is not None and cached[0]() in (model, None):
+            self._prefix_cache = None
+        TOKEN_PIECES.pop(tokenizer, None)
+
+    def draft_model(self):
+        """
+        Returns the draft model named by MEDIAN_DRAFT_MODEL for speculative decoding, loaded once.
+
+        Returns:
+            The draft mlx_lm model, or None when speculative decoding is not configured.
+        """
+
+        name = os.environ.get(DRAFT_MODEL_ENV_VAR)
+        if not name:
+            return None
+        if getattr(self, "_draft", (None, None))[0] != name:
+            draft, _ = mlx_load(name, lazy=False)
+            self._draft = (name, draft)
+            median_logger.info(f"Loaded draft model: {name}")
+        return self._draft[1]
+
+    def generate(self, model, tokenizer, prompt: str, model_config: dict) -> str:
+        """
+        Generates a completion for a single prompt.
+
+        With a draft model configured and a temperature of 0, decoding is speculative.
+
+        Args:
+            model: The language model.
+            tokenizer: The tokenizer.
+            prompt (str): The prompt for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            str: The generated output.
+        """
+
+        batchable = hasattr(getattr(model, "model", None), "layers")
+        if batchable and model_config.get("temp", 0.0) == 0 and self.draft_model() is not None:
+            tokens = tokenizer.encode(prompt)
+            constrained = model_config.get("constrained")
+            pieces = _token_pieces(tokenizer) if constrained else None
+            cache, _ = self.prefix_cache(
+                model, tokenizer, [tokens], model_config.get("prompt_prefix")
+            )
+            generated = _speculative_decode(
+                model,
+                self.draft_model(),
+                tokens,
+                model_config.get("max_tokens", 100),
+                tokenizer.eos_token_id,
+                pieces,
+                cache,
+                model_config.get("repetition_penalty"),
+                model_config.get("repetition_context_size", 20),
+            )
+            if constrained:
+                return join_pieces([pieces[t] for t in generated])
+            return tokenizer.decode(generated)
+        if model_config.get("constrained"):
+            return self.generate_batch(model, tokenizer, [prompt], model_config)[0]
+        return mlx_generate(model, tokenizer, prompt=prompt, **_sampling_options(model_config))
+
+    def generate_batch(
+        self, model, tokenizer, prompts: List[str], model_config: dict
+    ) -> List[str]:
+        """
+        Generates completions for several prompts by decoding them as one left-padded batch.
+
+        With the "constrained" option every row may only emit tokens that keep its output a
+        valid QuizCollection prefix, and stops as soon as the collection is closed. With the
+        "prompt_prefix" option the cached prefix is shared by every row and only the rest of
+        each prompt is prefilled, as long as the rests have the same length: padding after the
+        prefix would shift the rotary positions of the rest, so padded batches prefill in full.
+
+        Args:
+            model: The language model.
+            tokenizer: The tokenizer.
+            prompts (List[str]): The prompts for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as the prompts.
+        """
+
+        if not prompts:
+            return []
+        batchable = hasattr(getattr(model, "model", None), "layers")
+        constrained = model_config.get("constrained") and batchable
+        if not batchable:
+            options = _sampling_options(model_config)
+            return [self.generate(model, tokenizer, p, options) for p in prompts]
+        speculative = model_config.get("temp", 0.0) == 0 and self.draft_model() is not None
+        if len(prompts) == 1 and (speculative or not constrained):
+            return [self.generate(model, tokenizer, prompts[0], model_config)]
+
+        temp = model_config.get("temp", 0.0)
+        max_tokens = model_config.get("max_tokens", 100)
+        penalty = model_config.get("repetition_penalty")
+        context_size = model_config.get("repetition_context_size", 20)
+
+        encoded = [tokenizer.encode(p) for p in prompts]
+        unpadded = len({len(tokens) for tokens in encoded}) == 1
+        prefix, prefix_length = self.prefix_cache(
+            model, tokenizer, encoded, model_config.get("prompt_prefix") if unpadded else None
+        )
+        encoded = [tokens[prefix_length:] for tokens in encoded]
+        length = max(len(tokens) for tokens in encoded)
+        pad_id = tokenizer.pad_token_id or tokenizer.eos_token_id or 0
+        inputs = mx.array([[pad_id] * (length - len(t)) + t for t in encoded])
+
+        # Additive mask: causal over the prompt, and never attending to left padding.
+        # Padding positions attend to themselves, so no row of the mask is fully masked
+        positions = mx.arange(length)
+        padding = mx.array([length - len(t) for t in encoded])
+        keep = positions[None, :] >= padding[:, None]
+        causal = positions[:, None] >= positions[None, :]
+        diagonal = positions[:, None] == positions[None, :]
+        allowed = causal[None, :, :] & (keep[:, None, :] | diagonal[None, :, :])
+        cache = None
+        if prefix is not None:
+            batch = len(prompts)
+            cache = [
+                (mx.repeat(keys, batch, axis=0), mx.repeat(values, batch, axis=0))
+                for keys, values in prefix
+            ]
+            keep = mx.concatenate([mx.ones((batch, prefix_length), dtype=mx.bool_), keep], axis=1)
+            allowed = mx.concatenate(
+                [mx.ones((batch, length, prefix_length), dtype=mx.bool_), allowed], axis=2
+            )
+        mask = mx.where(allowed, 0.0, MASK_VALUE)[:, None, :, :]
+
+        histories = [[] for _ in prompts]
+        finished = [False] * len(prompts)
+        constraints = [QuizJSONConstraint() for _ in prompts] if constrained else None
+        pieces = _token_pieces(tokenizer) if constrained else None
+        logits, cache = _batched_forward(model, inputs, mask, cache)
+        for _ in range(max_tokens):
+            if penalty:
+                logits = _apply_repetition_penalty(logits, histories, penalty, context_size)
+            if constrained:
+                tokens = _constrained_sample(logits, temp, constraints, pieces, finished)
+            else:
+                tokens = _sample_batch(logits, temp).tolist()
+            for row, token in enumerate(tokens):
+                if finished[row]:
+                    continue
+                if token is None or token == tokenizer.eos_token_id:
+                    finished[row] = True
+                    continue
+                histories[row].append(token)
+                if constrained:
+                    constraints[row].accept(pieces[token])
+                    finished[row] = constraints[row].complete
+            if all(finished):
+                break
+            keep = mx.concatenate([keep, mx.ones((len(prompts), 1), dtype=mx.bool_)], axis=1)
+            mask = mx.where(keep, 0.0, MASK_VALUE)[:, None, None, :]
+            tokens = [pad_id if token is None else token for token in tokens]
+            logits, cache = _batched_forward(model, mx.array(tokens)[:, None], mask, cache)
+
+        if constrained:
+            return [join_pieces([pieces[t] for t in history]) for history in histories]
+        return [tokenizer.decode(history) for history in histories]
+
+
+class LlamaCppBackend:
+    """
+    Runs a GGUF model on CPU through llama-cpp-python, for Linux hosts without MLX.
+
+    Llama keeps the KV cache of its last evaluation and only evaluates the tokens after
+    the longest prefix shared with it, so the prompt preamble is prefilled once as long
+    as chunks go through the same instance one after the other.
+    """
+
+    name = "llama_cpp"
+    default_model_name = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
+    default_quantization = "Q4_K_M"
+    uses_quantization = True
+    context_window = 16384
+    max_concurrency = 1
+
+    def load(self, model_name: str, quantization: str) -> tuple:
+        """
+        Loads a GGUF model from a local path or from the HuggingFace Hub.
+
+        Args:
+            model_name (str): A path to a GGUF file, or a HuggingFace repository containing GGUF files.
+            quantization (str): The quantization suffix used to pick the GGUF file in a repository.
+
+        Returns:
+            tuple: The Llama instance, used as both the model and the tokenizer.
+        """
+
+        if Llama is None:
+            raise ImportError("The llama_cpp backend requires the llama-cpp-python package")
+        options = {
+            "n_ctx": self.context_window,
+            "n_threads": os.cpu_count(),
+            "verbose": False,
+        }
+        if os.environ.get(DRAFT_MODEL_ENV_VAR):
+            if LlamaPromptLookupDecoding is None:
+                median_logger.warning(
+                    "This llama-cpp-python has no prompt lookup decoding, decoding without a draft"
+                )
+            else:
+                # Answers copy the corpus, so drafting from n-grams of the prompt is accepted often
+                options["draft_model"] = LlamaPromptLookupDecoding(
+                    num_pred_tokens=PROMPT_LOOKUP_TOKENS
+                )
+        if os.path.exists(model_name):
+            llm = Llama(model_path=model_name, **options)
+        else:
+            llm = Llama.from_pretrained(
+                repo_id=model_name, filename=f"*{quantization}.gguf", **options
+            )
+        return llm, llm
+
+    def count_tokens(self, tokenizer, text: str) -> int:
+        """
+        Counts the tokens of a text with the GGUF model's tokenizer.
+
+        Args:
+            tokenizer: The Llama instance.
+            text (str): The text to measure.
+
+        Returns:
+            int: The number of tokens.
+        """
+
+        return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def generate(self, model, tokenizer, prompt: str, model_config: dict) -> str:
+        """
+        Generates a completion for a single prompt.
+
+        Args:
+            model: The Llama instance.
+            tokenizer: Unused, the Llama instance tokenizes its own prompts.
+            prompt (str): The prompt for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            str: The generated output.
+        """
+
+        output = model(
+            prompt,
+            max_tokens=model_config.get("max_tokens", 100),
+            temperature=model_config.get("temp", 0.0),
+            repeat_penalty=model_config.get("repetition_penalty") or 1.0,
+            grammar=self.grammar() if model_config.get("constrained") else None,
+        )
+        return output["choices"][0]["text"]
+
+    def grammar(self):
+        """
+        Returns the GBNF grammar of the QuizCollection JSON schema, built once.
+
+        Returns:
+            LlamaGrammar: The grammar restricting generation to valid QuizCollection JSON.
+        """
+
+        if getattr(self, "_grammar", None) is None:
+            self._grammar = LlamaGrammar.from_json_schema(
+                json.dumps(json_schema), verbose=False
+            )
+        return self._grammar
+
+    def generate_batch(
+        self, model, tokenizer, prompts: List[str], model_config: dict
+    ) -> List[str]:
+        """
+        Generates completions for several prompts one after the other.
+
+        Args:
+            model: The Llama instance.
+            tokenizer: Unused, the Llama instance tokenizes its own prompts.
+            prompts (List[str]): The prompts for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as the prompts.
+        """
+
+        return [self.generate(model, tokenizer, p, model_config) for p in prompts]
+
+
+class CompletionsClient:
+    """
+    A pooled keep-alive client for the completions endpoint of an OpenAI-compatible server.
+
+    One session is shared by every thread of the process. Its connection pool holds as
+    many connections as there may be requests in flight, and a semaphore keeps the number
+    of in-flight requests at that bound. Failed connections and RETRY_STATUSES responses
+    are retried; a request that timed out while the server was reading it is not, since
+    the server may still be generating its completion.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model_name: str,
+        api_key: Optional[str] = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        guided_field: Optional[str] = DEFAULT_GUIDED_FIELD,
+        penalty_field: Optional[str] = DEFAULT_PENALTY_FIELD,
+    ):
+        """
+        Opens the session.
+
+        Args:
+            base_url (str): The base URL of the API, such as "http://localhost:8000/v1".
+            model_name (str): The name of the model served by the server.
+            api_key (Optional[str]): The bearer token sent with every request.
+            max_in_flight (int): The maximum number of concurrent requests (default is DEFAULT_MAX_IN_FLIGHT).
+            guided_field (Optional[str]): The request field carrying the JSON schema of constrained
+                requests, or None if the server does not support guided decoding.
+            penalty_field (Optional[str]): The request field carrying the repetition penalty, or None
+                if the server does not support one.
+        """
+
+        self.url = base_url.rstrip("/") + "/completions"
+        self.model_name = model_name
+        self.guided_field = guided_field
+        self.penalty_field = penalty_field
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.session = requests.Session()
+        retry = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def payload(self, prompts: List[str], options: dict, stream: bool) -> dict:
+        """
+        Builds the body of a completions request.
+
+        Args:
+            prompts (List[str]): The prompts, sent together as one batched request.
+            options (dict): The Median model configuration.
+            stream (bool): Whether the server should stream the completions.
+
+        Returns:
+            dict: The JSON body.
+        """
+
+        payload = {
+            "model": self.model_name,
+            "prompt": prompts,
+            "max_tokens": options.get("max_tokens", 100),
+            "temperature": options.get("temp", 0.0),
+            "stream": stream,
+        }
+        if options.get("repetition_penalty") and self.penalty_field:
+            payload[self.penalty_field] = options["repetition_penalty"]
+        if options.get("constrained") and self.guided_field:
+            payload[self.guided_field] = json_schema
+        return payload
+
+    def complete(self, prompts: List[str], options: dict) -> List[str]:
+        """
+        Completes several prompts with one request.
+
+        Args:
+            prompts (List[str]): The prompts.
+            options (dict): The Median model configuration.
+
+        Returns:
+            List[str]: The completions, in the same order as the prompts.
+        """
+
+        with self.in_flight:
+            response = self.session.post(
+                self.url, json=self.payload(prompts, options, False), timeout=API_TIMEOUT
+            )
+            response.raise_for_status()
+            choices = response.json()["choices"]
+        texts = [""] * len(prompts)
+        for choice in choices:
+            texts[choice.get("index", 0)] = choice["text"]
+        return texts
+
+    def stream(self, prompts: List[str], options: dict) -> Iterator[Tuple[int, str]]:
+        """
+        Completes several prompts with one streamed request, yielding text as the server sends it.
+
+        Args:
+            prompts (List[str]): The prompts.
+            options (dict): The Median model configuration.
+
+        Yields:
+            Tuple[int, str]: The index of the prompt and the next piece of its completion.
+        """
+
+        with self.in_flight, self.session.post(
+            self.url,
+            json=self.payload(prompts, options, True),
+            timeout=API_TIMEOUT,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # Server-sent events: "data: {json}" lines, ending with "data: [DONE]"
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:") :].strip()
+                if data == b"[DONE]":
+                    break
+                for choice in json.loads(data)["choices"]:
+                    yield choice.get("index", 0), choice["text"]
+
+    def stream_text(self, prompts: List[str], options: dict) -> List[str]:
+        """
+        Completes several prompts with one streamed request and collects the completions.
+
+        Args:
+            prompts (List[str]): The prompts.
+            options (dict): The Median model configuration.
+
+        Returns:
+            List[str]: The completions, in the same order as the prompts.
+        """
+
+        start = time.perf_counter()
+        pieces = [[] for _ in prompts]
+        for index, text in self.stream(prompts, options):
+            if not any(pieces):
+                median_logger.debug(f"First token after {time.perf_counter() - start:.2f}s")
+            pieces[index].append(text)
+        return ["".join(texts) for texts in pieces]
+
+
+class OpenAIBackend:
+    """
+    Sends prompts to an OpenAI-compatible completions endpoint, such as a vLLM or llama.cpp server.
+
+    The model runs on the server, so the web process only holds an HTTP client and, when
+    available, the model's tokenizer for sizing chunks.
+    """
+
+    name = "openai"
+    default_model_name = "mistralai/Mistral-7B-Instruct-v0.2"
+    default_quantization = "none"
+    uses_quantization = False
+    context_window = 32768
+
+    @property
+    def max_concurrency(self) -> int:
+        """
+        The number of requests that may be in flight, from MEDIAN_MAX_IN_FLIGHT.
+
+        Returns:
+            int: The maximum number of concurrent requests.
+        """
+
+        return max(1, int(os.environ.get(MAX_IN_FLIGHT_ENV_VAR, DEFAULT_MAX_IN_FLIGHT)))
+
+    def load(self, model_name: str, quantization: str) -> tuple:
+        """
+        Opens a client for the server named by MEDIAN_API_BASE and loads the model's tokenizer.
+
+        Args:
+            model_name (str): The name of the model served by the server, also used to find its tokenizer.
+            quantization (str): Ignored, the server decides how the model is loaded.
+
+        Returns:
+            tuple: The client, used as the model, and the tokenizer, or None if it cannot be loaded.
+        """
+
+        if requests is None:
+            raise ImportError("The openai backend requires the requests package")
+        client = CompletionsClient(
+            os.environ.get(API_BASE_ENV_VAR, DEFAULT_API_BASE),
+            model_name,
+            os.environ.get(API_KEY_ENV_VAR),
+            self.max_concurrency,
+            os.environ.get(GUIDED_FIELD_ENV_VAR, DEFAULT_GUIDED_FIELD) or None,
+            os.environ.get(PENALTY_FIELD_ENV_VAR, DEFAULT_PENALTY_FIELD) or None,
+        )
+        try:
+            tokenizer = get_tokenizer(model_name)
+        except (OSError, ValueError) as e:
+            median_logger.error(f"No tokenizer found for {model_name}, estimating token counts: {e}")
+            tokenizer = None
+        return client, tokenizer
+
+    def count_tokens(self, tokenizer, text: str) -> int:
+        """
+        Counts the tokens of a text with the model's tokenizer, or estimates them conservatively.
+
+        Args:
+            tokenizer: The tokenizer, or None.
+            text (str): The text to measure.
+
+        Returns:
+            int: The number of tokens.
+        """
+
+        if tokenizer is None:
+            return len(text) // 3 + 1
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def generate(self, model, tokenizer, prompt: str, model_config: dict) -> str:
+        """
+        Generates a completion for a single prompt.
+
+        Args:
+            model: The CompletionsClient.
+            tokenizer: Unused, the server tokenizes its own prompts.
+            prompt (str): The prompt for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            str: The generated output.
+        """
+
+        return self.generate_batch(model, tokenizer, [prompt], model_config)[0]
+
+    def generate_batch(
+        self, model, tokenizer, prompts: List[str], model_config: dict
+    ) -> List[str]:
+        """
+        Generates completions for several prompts, MEDIAN_API_BATCH_SIZE prompts per request.
+
+        Requests are sent concurrently up to max_concurrency and streamed unless the
+        "stream" option is False, so the read timeout only applies between events.
+
+        Args:
+            model: The CompletionsClient.
+            tokenizer: Unused, the server tokenizes its own prompts.
+            prompts (List[str]): The prompts for inference.
+            model_config (dict): Additional configuration for the model.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as the prompts.
+        """
+
+        batch_size = max(1, int(os.environ.get(API_BATCH_SIZE_ENV_VAR, DEFAULT_API_BATCH_SIZE)))
+        batches = [prompts[i : i + batch_size] for i in range(0, len(prompts), batch_size)]
+        request = model.stream_text if model_config.get("stream", True) else model.complete
+        if len(batches) == 1:
+            return request(batches[0], model_config)
+        with ThreadPoolExecutor(max_workers=min(len(batches), self.max_concurrency)) as executor:
+            results = executor.map(lambda batch: request(batch, model_config), batches)
+            return [text for texts in results for text in texts]
+
+
+class StubBackend:
+    """
+    Deterministic backend that builds quizzes from the corpus sentences without a model.
+
+    It lets the rest of the pipeline be exercised and benchmarked on any machine.
+    """
+
+    name = "stub"
+    default_model_name = "stub"
+    default_quantization = "none"
+    uses_quantization = False
+    context_window = 32768
+    max_concurrency = 8
+    max_cards = 3
+
+    def load(self, model_name: str, quantization: str) -> tuple:
+        """
+        Returns placeholders, the stub has no weights to load.
+
+        Args:
+            model_name (str): Ignored.
+            quantization (str): Ignored.
+
+        Returns:
+            tuple: A (None, None) model and tokenizer pair.
+        """
+
+        return None, None
+
+    def count_tokens(self, tokenizer, text: str) -> int:
+        """
+        Estimates the tokens of a text as one per four characters.
+
+        Args:
+            tokenizer: Ignored.
+            text (str): The text to measure.
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+
+        return len(text) // 4 + 1
+
+    def generate(self, model, tokenizer, prompt: str, model_config: dict) -> str:
+        """
+        Turns the first sentences of the prompt's corpus into question and answer pairs.
+
+        Args:
+            model: Ignored.
+            tokenizer: Ignored.
+            prompt (str): The prompt for inference.
+            model_config (dict): Ignored.
+
+        Returns:
+            str: A QuizCollection serialized as JSON.
+        """
+
+        match = re.search(r"<\|im_start\|>corpus\n(.*?)<\|im_end\|>", prompt, re.S)
+        corpus = match.group(1) if match else prompt
+        sentences = [
+            s.strip() for s in re.split(r"(?<=[.!?])\s+", corpus) if len(s.split()) > 3
+        ]
+        collection = [
+            {
+                "question": f"What does the text say about \"{' '.join(s.split()[:4])}\"?",
+                "answer": s,
+            }
+            for s in sentences[: self.max_cards]
+        ]
+        return json.dumps({"collection": collection}, ensure_ascii=False)
+
+    def generate_batch(
+        self, model, tokenizer, prompts: List[str], model_config: dict
+    ) -> List[str]:
+        """
+        Generates stub completions for several prompts.
+
+        Args:
+            model: Ignored.
+            tokenizer: Ignored.
+            prompts (List[str]): The prompts for inference.
+            model_config (dict): Ignored.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as the prompts.
+        """
+
+        return [self.generate(model, tokenizer, p, model_config) for p in prompts]
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (MLXBackend(), LlamaCppBackend(), OpenAIBackend(), StubBackend())
+}
+
+
+def get_backend(name: str = None) -> InferenceBackend:
+    """
+    Returns the inference backend selected by name or by the MEDIAN_BACKEND environment variable.
+
+    Args:
+        name (str): The name of the backend, or None to read it from the environment.
+
+    Returns:
+        InferenceBackend: The selected backend.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+
+    name = name or os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {name}")
+    return BACKENDS[name]
@@ -0,0 +1,469 @@
+import asyncio
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from sqlite3 import Error
+from typing import Optional
+
+from median.database import get_db_connection
+from median.file_reader import main as read_file
+from median.generate_quizz import iter_quiz
+from median.llm_provider import warmup_model
+from median.orchestrator import aiter_quiz, generation_concurrency
+from median.utils import median_logger, preload_spacy_models
+
+JOB_WORKERS_ENV_VAR = "MEDIAN_JOB_WORKERS"
+DEFAULT_JOB_WORKERS = 1
+JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "median_jobs")
+# Seconds an idle worker waits before looking for a queued job again
+WORKER_POLL_SECONDS = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+JOB_COLUMNS = "id, flashcard_name, status, file_path, file_type, use_cache, chunks_done, chunk_count, topics, cards, chunk_errors, error"
+
+_WORKERS = []
+_WORKERS_LOCK = threading.Lock()
+
+
+def _row_to_job(row: tuple) -> dict:
+    """
+    Converts a row of the 'jobs' table to a dictionary.
+
+    Args:
+        row (tuple): The row, with the columns of JOB_COLUMNS.
+
+    Returns:
+        dict: The job, with its topics, cards and chunk errors decoded.
+    """
+
+    job = dict(zip([column.strip() for column in JOB_COLUMNS.split(",")], row))
+    job["use_cache"] = bool(job["use_cache"])
+    job["topics"] = json.loads(job["topics"]) if job["topics"] else []
+    job["cards"] = json.loads(job["cards"]) if job["cards"] else []
+    job["chunk_errors"] = json.loads(job["chunk_errors"]) if job["chunk_errors"] else []
+    return job
+
+
+def submit_job(flashcard_name: str, file, file_type: str, use_cache: bool = True) -> int:
+    """
+    Queues the generation of a deck from an uploaded file.
+
+    The file is copied to JOBS_DIR so that a worker process can read it after the
+    Streamlit script that received it has moved on.
+
+    Args:
+        flashcard_name (str): The name of the flashcard deck.
+        file: The uploaded file-like object.
+        file_type (str): The MIME type of the file.
+        use_cache (bool): Whether the job may reuse cached generations (default is True).
+
+    Returns:
+        int: The ID of the queued job.
+    """
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    file_path = os.path.join(JOBS_DIR, uuid.uuid4().hex)
+    file.seek(0)
+    with open(file_path, "wb") as f:
+        while chunk := file.read(1 << 20):
+            f.write(chunk)
+
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO jobs(flashcard_name, status, file_path, file_type, use_cache, created, updated) VALUES (?,?,?,?,?,?,?)",
+            (flashcard_name, QUEUED, file_path, file_type, int(use_cache), now, now),
+        )
+        conn.commit()
+        median_logger.info(f"Queued job {cursor.lastrowid} for {flashcard_name}")
+        return cursor.lastrowid
+
+
+def get_job(job_id: int) -> Optional[dict]:
+    """
+    Reads the status, progress and results of a job.
+
+    Args:
+        job_id (int): The ID of the job.
+
+    Returns:
+        Optional[dict]: The job, or None if it does not exist.
+    """
+
+    with get_db_connection() as conn:
+        row = conn.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def _remove_upload(file_path: str):
+    """
+    Deletes the copy of a job's file once no worker will read it.
+
+    Args:
+        file_path (str): The path to the copy in JOBS_DIR.
+
+    Returns:
+        None
+    """
+
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def cancel_job(job_id: int):
+    """
+    Cancels a job; a running job stops after its current chunk.
+
+    The file of a queued job is deleted at once, since no worker will claim it; a
+    running job's worker deletes it when it stops.
+
+    Args:
+        job_id (int): The ID of the job.
+
+    Returns:
+        None
+    """
+
+    with get_db_connection() as conn:
+        try:
+            # Hold the write lock so no worker claims the job between the two statements
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT status, file_path FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            conn.execute(
+                f"UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status NOT IN ({','.join('?' * len(FINISHED_STATUSES))})",
+                (CANCELLED, time.time(), job_id, *FINISHED_STATUSES),
+            )
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+    if row and row[0] == QUEUED:
+        _remove_upload(row[1])
+    median_logger.info(f"Cancelled job {job_id}")
+
+
+def _claim_job() -> Optional[dict]:
+    """
+    Marks the oldest queued job as running for this process.
+
+    Returns:
+        Optional[dict]: The claimed job, or None if no job is queued.
+    """
+
+    with get_db_connection() as conn:
+        try:
+            # Hold the write lock so two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, updated = ? WHERE id = ?",
+                (RUNNING, os.getpid(), time.time(), row[0]),
+            )
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+    return _row_to_job(row)
+
+
+def _update_progress(job: dict) -> bool:
+    """
+    Stores the progress and results of a running job.
+
+    Args:
+        job (dict): The job, with its current chunk counts, topics, cards and chunk errors.
+
+    Returns:
+        bool: False if the job was cancelled in the meantime.
+    """
+
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET chunks_done = ?, chunk_count = ?, topics = ?, cards = ?, chunk_errors = ?, updated = ? WHERE id = ? AND status = ?",
+            (
+                job["chunks_done"],
+                job["chunk_count"],
+                json.dumps(job["topics"]),
+                json.dumps(job["cards"]),
+                json.dumps(job["chunk_errors"]),
+                time.time(),
+                job["id"],
+                RUNNING,
+            ),
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def _finish_job(job_id: int, status: str, error: str = None):
+    """
+    Records the final status of a running job.
+
+    Args:
+        job_id (int): The ID of the job.
+        status (str): DONE or FAILED.
+        error (str): The error message of a failed job.
+
+    Returns:
+        None
+    """
+
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND status = ?",
+            (status, error, time.time(), job_id, RUNNING),
+        )
+        conn.commit()
+
+
+def _record_chunk(
+    job: dict, index: int, chunk_count: int, cards: list, topics: list, error: Optional[str]
+) -> bool:
+    """
+    Adds the cards, or the error, of a finished chunk to a job and stores its progress.
+
+    Chunks may finish in any order; the job's cards and errors are kept in chunk order.
+
+    Args:
+        job (dict): The running job.
+        index (int): The index of the chunk.
+        chunk_count (int): The number of chunks of the job's file.
+        cards (list): The cards of the chunk.
+        topics (list): The topics extracted from the file.
+        error (Optional[str]): Why the chunk could not be generated, or None.
+
+    Returns:
+        bool: False if the job was cancelled in the meantime.
+    """
+
+    job["chunks_done"] += 1
+    job["chunk_count"] = chunk_count
+    job["topics"] = topics
+    chunk_cards = job.setdefault("chunk_cards", {})
+    chunk_cards[index] = cards
+    job["cards"] = [card for i in sorted(chunk_cards) for card in chunk_cards[i]]
+    if error:
+        median_logger.error(f"Job {job['id']} chunk {index} failed: {error}")
+        job["chunk_errors"].append({"chunk": index, "error": error})
+        job["chunk_errors"].sort(key=lambda chunk_error: chunk_error["chunk"])
+    return _update_progress(job)
+
+
+async def _run_job_concurrently(job: dict, content: str) -> bool:
+    """
+    Generates a job's chunks concurrently, stopping the pending ones if the job is cancelled.
+
+    Args:
+        job (dict): The running job.
+        content (str): The text of the job's file.
+
+    Returns:
+        bool: False if the job was cancelled.
+    """
+
+    chunks = aiter_quiz(content, use_cache=job["use_cache"])
+    try:
+        async for chunk in chunks:
+            if not await asyncio.to_thread(_record_chunk, job, *chunk):
+                return False
+    finally:
+        await chunks.aclose()
+    return True
+
+
+def run_job(job: dict):
+    """
+    Reads, splits, extracts the topics of and generates the cards of a job's file.
+
+    Progress is stored after every chunk, so the page can show cards as they arrive.
+    Backends that serve concurrent calls go through the async orchestrator, in-process
+    models through batched generation. A chunk that cannot be generated is recorded in
+    the job's chunk errors and the job goes on; it only fails if no chunk is generated,
+    or on an unexpected error, and keeps the cards generated until then either way.
+
+    Args:
+        job (dict): The claimed job.
+
+    Returns:
+        None
+    """
+
+    median_logger.info(f"Running job {job['id']} for {job['flashcard_name']}")
+    try:
+        # Extraction is deterministic, so its cache is used even when regenerating
+        content = read_file(job["file_path"], job["file_type"], use_cache=True)
+        if not content:
+            _finish_job(job["id"], FAILED, "No text could be read from the file")
+            return
+        if generation_concurrency() > 1:
+            completed = asyncio.run(_run_job_concurrently(job, content))
+        else:
+            completed = all(
+                _record_chunk(job, *chunk)
+                for chunk in iter_quiz(content, use_cache=job["use_cache"])
+            )
+        if not completed:
+            median_logger.info(f"Job {job['id']} was cancelled")
+            return
+        if job["chunk_errors"] and len(job["chunk_errors"]) == job["chunk_count"]:
+            _finish_job(job["id"], FAILED, job["chunk_errors"][0]["error"])
+            return
+        _finish_job(job["id"], DONE)
+        median_logger.info(f"Job {job['id']} generated {len(job['cards'])} cards")
+    except Exception as e:
+        median_logger.error(f"Job {job['id']} failed: {e}")
+        _finish_job(job["id"], FAILED, str(e))
+    finally:
+        _remove_upload(job["file_path"])
+
+
+def worker_loop(parent_pid: int):
+    """
+    Runs queued jobs one at a time until the parent process exits.
+
+    The model and the SpaCy pipelines are loaded once, before the first job. If they
+    cannot be loaded, the worker stays up and fails every queued job with the error,
+    rather than exiting and being started again on every page poll.
+
+    Args:
+        parent_pid (int): The ID of the process that started the worker.
+
+    Returns:
+        None
+    """
+
+    try:
+        warmup_model()
+        preload_spacy_models()
+        startup_error = None
+        median_logger.info(f"Job worker {os.getpid()} ready")
+    except Exception as e:
+        startup_error = f"The job worker could not start: {e}"
+        median_logger.error(startup_error)
+    while os.getppid() == parent_pid:
+        job = _claim_job()
+        if job is None:
+            time.sleep(WORKER_POLL_SECONDS)
+        elif startup_error:
+            _finish_job(job["id"], FAILED, startup_error)
+            _remove_upload(job["file_path"])
+        else:
+            run_job(job)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """
+    Checks whether a process is still running.
+
+    Args:
+        pid (Optional[int]): The ID of the process.
+
+    Returns:
+        bool: True if the process exists.
+    """
+
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Puts back in the queue the running jobs whose worker process has died.
+
+    A requeued job starts again from its first chunk and drops the cards it had, since
+    chunks finish out of order; the chunks already generated are served from the
+    generation cache when the job reuses cached cards.
+
+    Returns:
+        int: The number of requeued jobs.
+    """
+
+    with get_db_connection() as conn:
+        running = conn.execute(
+            "SELECT id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        stale = [(QUEUED, job_id) for job_id, pid in running if not _pid_alive(pid)]
+        conn.executemany(
+            "UPDATE jobs SET status = ?, worker_pid = NULL, chunks_done = 0, cards = NULL, chunk_errors = NULL WHERE id = ?",
+            stale,
+        )
+        conn.commit()
+    if stale:
+        median_logger.info(f"Requeued {len(stale)} stale jobs")
+    return len(stale)
+
+
+def start_workers(count: int = None) -> int:
+    """
+    Starts the worker processes of this process, if they are not already running.
+
+    The number of workers bounds how many decks are generated at the same time. Workers
+    are spawned rather than forked, since model runtimes are not fork-safe, and are not
+    daemons, so they can run their own process pools.
+
+    Args:
+        count (int): The number of workers (default is MEDIAN_JOB_WORKERS, or DEFAULT_JOB_WORKERS).
+
+    Returns:
+        int: The number of running workers.
+    """
+
+    count = count or int(os.environ.get(JOB_WORKERS_ENV_VAR, DEFAULT_JOB_WORKERS))
+    with _WORKERS_LOCK:
+        _WORKERS[:] = [worker for worker in _WORKERS if worker.is_alive()]
+        if len(_WORKERS) >= count:
+            return len(_WORKERS)
+        requeue_stale_jobs()
+        context = multiprocessing.get_context("spawn")
+        while len(_WORKERS) < count:
+            worker = context.Process(
+                target=worker_loop, args=(os.getpid(),), name="median-job-worker"
+            )
+            worker.start()
+            _WORKERS.append(worker)
+        median_logger.info(f"Started {count} job worker(s)")
+        return len(_WORKERS)
+
+
+@atexit.register
+def stop_workers():
+    """
+    Stops the worker processes of this process; their running jobs are requeued on the next start.
+
+    Returns:
+        None
+    """
+
+    with _WORKERS_LOCK:
+        for worker in _WORKERS:
+            worker.terminate()
+        for worker in _WORKERS:
+            worker.join(timeout=5)
+        _WORKERS.clear()
@@ -1,24 +1,168 @@
 import os
+import threading
+from typing import Callable, Union
 
-from mlx_lm import generate, load
-
+from median.inference_backends import get_backend
 from median.utils import median_logger
 
+MODEL_NAME_ENV_VAR = "MEDIAN_MODEL_NAME"
+QUANTIZATION_ENV_VAR = "MEDIAN_QUANTIZATION"
+# Sampling temperature; 0 decodes greedily, which speculative decoding requires
+TEMPERATURE_ENV_VAR = "MEDIAN_TEMPERATURE"
+DEFAULT_TEMPERATURE = 0.7
+MAX_BATCH_SIZE = 8
+# Share of the model's context window a prompt, its chunk and the reserved output may use
+CONTEXT_FRACTION = 0.5
+MIN_CHUNK_TOKENS = 256
+# Bump whenever build_prompt() changes so cached generations are not reused
+PROMPT_TEMPLATE_VERSION = 1
+# The part of every prompt before its themes, whose KV cache backends can compute once
+PROMPT_PREFIX = """
+     <BOS_TOKEN> <|START_OF_TURN_TOKEN|>
+<|SYSTEM_TOKEN|> # Safety Preamble
+The instructions in this section override those in the task description and style guide sections. Don't generate content that is harmful or immoral. Always base the information strictly on the provided corpus; never fabricate data, hallucinate information, or invent content not present in the corpus. If there is no relevant information in the corpus, you should return 'None'.
+
+# System Preamble
+## Basic Rules
+You are a powerful conversational AI trained to help people by generating a well-structured set of significant and relevant questions and answers strictly based on a provided corpus. Your job is to use the output of these tools to best help the user. Always base the information strictly on the provided corpus; never fabricate data, hallucinate information, or invent content not present in the corpus. If there is no relevant information in the corpus, you should return 'None'.
+
+# User Preamble
+## Task and Context
+You help people create flashcards by generating a set of questions and answers strictly based on a given corpus. You should prioritize the questions and answers according to their importance within the context of the corpus and the specified themes. The following themes have been identified:"""
+MODEL_CONFIG = {
+    "verbose": True,
+    "temp": float(os.environ.get(TEMPERATURE_ENV_VAR, DEFAULT_TEMPERATURE)),
+    "max_tokens": 4000,
+    "repetition_penalty": 1.1,
+    "constrained": True,
+}
+
+# Process-wide registry of loaded models, shared by every Streamlit session and rerun
+MODEL_REGISTRY = {}
+MODEL_STATS = {}
+_REGISTRY_LOCK = threading.Lock()
 
-def load_model():
+
+def resolve_model(model_name: str = None, quantization: str = None) -> tuple:
     """
-    Loads a language model and tokenizer.
+    Resolves the backend, model name and quantization to use, falling back to the configuration.
+
+    Args:
+        model_name (str): The name of the model, or None to use MEDIAN_MODEL_NAME or the backend default.
+        quantization (str): The quantization, or None to use MEDIAN_QUANTIZATION or the backend default.
+
+    Returns:
+        tuple: The backend name, model name and quantization.
+
+    Raises:
+        ValueError: If a quantization is requested from a backend that encodes it in the model name.
+    """
+
+    backend = get_backend()
+    model_name = model_name or os.environ.get(
+        MODEL_NAME_ENV_VAR, backend.default_model_name
+    )
+    quantization = quantization or os.environ.get(
+        QUANTIZATION_ENV_VAR, backend.default_quantization
+    )
+    if not backend.uses_quantization and quantization != backend.default_quantization:
+        # The weights would not change, so a second registry entry would hold the same model
+        raise ValueError(
+            f"The {backend.name} backend does not select weights by quantization; "
+            f"choose a model name with the wanted quantization instead of {quantization!r}"
+        )
+    return backend.name, model_name, quantization
+
+
+def load_model(model_name: str = None, quantization: str = None):
+    """
+    Loads a language model and tokenizer with the configured backend, reusing the instance already loaded by this process.
+
+    Args:
+        model_name (str): The name of the model to load (default is the configured model).
+        quantization (str): The quantization of the model weights (default is the configured quantization).
 
     Returns:
         tuple: A tuple containing the loaded language model and tokenizer.
     """
 
-    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    key = resolve_model(model_name, quantization)
+    with _REGISTRY_LOCK:
+        stats = MODEL_STATS.setdefault(key, {"loads": 0, "hits": 0})
+        if key in MODEL_REGISTRY:
+            stats["hits"] += 1
+            return MODEL_REGISTRY[key]
+
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        backend_name, model_name, quantization = key
+        model, tokenizer = get_backend(backend_name).load(model_name, quantization)
+        MODEL_REGISTRY[key] = (model, tokenizer)
+        stats["loads"] += 1
+        median_logger.info(
+            f"Loaded model and tokenizer: {model_name} ({quantization}) with {backend_name}"
+        )
+        return model, tokenizer
 
-    model_name = "mlx-community/Mistral-7B-Instruct-v0.2-4bit"
-    model, tokenizer = load(model_name, lazy=False)
-    median_logger.info("Loaded model and tokenizer")
-    return model, tokenizer
+
+def warmup_model(model_name: str = None, quantization: str = None):
+    """
+    Loads a model into the registry ahead of the first generation request.
+
+    Args:
+        model_name (str): The name of the model to load (default is the configured model).
+        quantization (str): The quantization of the model weights (default is the configured quantization).
+
+    Returns:
+        None
+    """
+
+    load_model(model_name, quantization)
+    median_logger.info(f"Warmed up model: {resolve_model(model_name, quantization)}")
+
+
+def evict_model(model_name: str = None, quantization: str = None) -> int:
+    """
+    Removes models from the registry so their weights can be released.
+
+    Backends that cache state per model, such as a prompt prefix's KV cache, drop it
+    through their release() method.
+
+    Args:
+        model_name (str): The name of the model to evict, or None to match every model.
+        quantization (str): The quantization to evict, or None to match every quantization.
+
+    Returns:
+        int: The number of evicted models.
+    """
+
+    with _REGISTRY_LOCK:
+        keys = [
+            key
+            for key in MODEL_REGISTRY
+            if model_name in (None, key[1]) and quantization in (None, key[2])
+        ]
+        for key in keys:
+            model, tokenizer = MODEL_REGISTRY.pop(key)
+            release = getattr(get_backend(key[0]), "release", None)
+            if release is not None:
+                release(model, tokenizer)
+    median_logger.info(f"Evicted {len(keys)} model(s) from the registry")
+    return len(keys)
+
+
+def model_cache_stats() -> dict:
+    """
+    Returns the load and reuse counts of every model requested by this process.
+
+    Returns:
+        dict: A mapping of "backend:model_name:quantization" to its load count, hit count and residency.
+    """
+
+    with _REGISTRY_LOCK:
+        return {
+            ":".join(key): {**stats, "loaded": key in MODEL_REGISTRY}
+            for key, stats in MODEL_STATS.items()
+        }
 
 
 def run_inference(model, tokenizer, prompt, model_config):
@@ -35,43 +179,42 @@ def run_inference(model, tokenizer, prompt, model_config):
         str: The generated output based on the model and prompt.
     """
 
-    return generate(model, tokenizer, prompt=prompt, **model_config)
+    return get_backend().generate(model, tokenizer, prompt, model_config)
 
 
-def generation(content: str, language: str, followings: str):
+def run_batch_inference(model, tokenizer, prompts, model_config):
     """
-    Generates a quiz based on the provided content, language, and specified themes.
+    Runs inference using the provided language model and tokenizer on several prompts at once.
 
     Args:
-        content (str): The content for which the quiz is generated.
-        language (str): The language for the quiz.
-        followings (str): The identified themes for the quiz.
+        model: The language model.
+        tokenizer: The tokenizer.
+        prompts (list[str]): The prompts for inference.
+        model_config: Additional configuration for the model.
 
     Returns:
-        str: The generated quiz output.
+        list[str]: The generated outputs, in the same order as the prompts.
     """
 
-    model, tokenizer = load_model()
+    if not prompts:
+        return []
+    return get_backend().generate_batch(model, tokenizer, prompts, model_config)
 
-    model_config = {
-        "verbose": True,
-        "temp": 0.7,
-        "max_tokens": 4000,
-        "repetition_penalty": 1.1,
-    }
 
-    prompt = f"""
-     <BOS_TOKEN> <|START_OF_TURN_TOKEN|>
-<|SYSTEM_TOKEN|> # Safety Preamble
-The instructions in this section override those in the task description and style guide sections. Don't generate content that is harmful or immoral. Always base the information strictly on the provided corpus; never fabricate data, hallucinate information, or invent content not present in the corpus. If there is no relevant information in the corpus, you should return 'None'.
+def build_prompt(content: str, language: str, followings: str) -> str:
+    """
+    Builds the quiz generation prompt for a chunk of content.
 
-# System Preamble
-## Basic Rules
-You are a powerful conversational AI trained to help people by generating a well-structured set of significant and relevant questions and answers strictly based on a provided corpus. Your job is to use the output of these tools to best help the user. Always base the information strictly on the provided corpus; never fabricate data, hallucinate information, or invent content not present in the corpus. If there is no relevant information in the corpus, you should return 'None'.
+    Args:
+        content (str): The content for which the quiz is generated.
+        language (str): The language for the quiz.
+        followings (str): The identified themes for the quiz.
 
-# User Preamble
-## Task and Context
-You help people create flashcards by generating a set of questions and answers strictly based on a given corpus. You should prioritize the questions and answers according to their importance within the context of the corpus and the specified themes. The following themes have been identified: {followings.upper()}.
+    Returns:
+        str: The prompt passed to the language model.
+    """
+
+    return PROMPT_PREFIX + f""" {followings.upper()}.
 
 ## Style Guide
 Generate the output in JSON format, using the 'Quiz' and 'QuizCollection' classes as specified. Ensure that the output is in the same language as {language.upper()}. The content of the questions and answers must be strictly based on the provided corpus. If there is no relevant information in the corpus, return 'None' for the corresponding field.
@@ -106,5 +249,101 @@ Generate the output in the specified format, basing the output strictly on the p
 }}
 <|END_OF_TURN_TOKEN|>
      """
+
+
+def generation(content: str, language: str, followings: str):
+    """
+    Generates a quiz based on the provided content, language, and specified themes.
+
+    Args:
+        content (str): The content for which the quiz is generated.
+        language (str): The language for the quiz.
+        followings (str): The identified themes for the quiz.
+
+    Returns:
+        str: The generated quiz output.
+    """
+
+    model, tokenizer = load_model()
+    prompt = build_prompt(content, language, followings)
     median_logger.info(f"Generating quiz for: {content} ")
-    return run_inference(model, tokenizer, prompt, model_config)
+    return run_inference(
+        model, tokenizer, prompt, {**MODEL_CONFIG, "prompt_prefix": PROMPT_PREFIX}
+    )
+
+
+def batch_generation(
+    contents: list[str], language: str, followings: Union[str, list[str]]
+) -> list[str]:
+    """
+    Generates quizzes for several chunks of content in batches.
+
+    Args:
+        contents (list[str]): The chunks for which the quizzes are generated.
+        language (str): The language for the quizzes.
+        followings (Union[str, list[str]]): The identified themes, shared by every chunk or one entry per chunk.
+
+    Returns:
+        list[str]: The generated quiz outputs, one per chunk and in input order.
+    """
+
+    model, tokenizer = load_model()
+    if isinstance(followings, str):
+        followings = [followings] * len(contents)
+    prompts = [
+        build_prompt(content, language, themes)
+        for content, themes in zip(contents, followings)
+    ]
+    median_logger.info(f"Generating quizzes for {len(prompts)} chunks")
+    outputs = []
+    for start in range(0, len(prompts), MAX_BATCH_SIZE):
+        outputs.extend(
+            run_batch_inference(
+                model,
+                tokenizer,
+                prompts[start : start + MAX_BATCH_SIZE],
+                {**MODEL_CONFIG, "prompt_prefix": PROMPT_PREFIX},
+            )
+        )
+    return outputs
+
+
+def token_counter() -> Callable[[str], int]:
+    """
+    Returns a function counting tokens with the configured generation model's tokenizer.
+
+    Returns:
+        Callable[[str], int]: A function returning the number of tokens of a text.
+    """
+
+    backend = get_backend()
+    _, tokenizer = load_model()
+    return lambda text: backend.count_tokens(tokenizer, text)
+
+
+def chunk_token_budget(
+    language: str, followings: str, context_fraction: float = CONTEXT_FRACTION
+) -> int:
+    """
+    Computes how many tokens of content fit in one generation call.
+
+    The budget is the given fraction of the model's context window, minus the prompt
+    template and the max_tokens reserved for the output.
+
+    Args:
+        language (str): The language for the quiz.
+        followings (str): The identified themes for the quiz.
+        context_fraction (float): The share of the context window to fill (default is CONTEXT_FRACTION).
+
+    Returns:
+        int: The maximum number of content tokens per chunk, at least MIN_CHUNK_TOKENS.
+    """
+
+    prompt_tokens = token_counter()(build_prompt("", language, followings))
+    budget = (
+        int(get_backend().context_window * context_fraction)
+        - prompt_tokens
+        - MODEL_CONFIG["max_tokens"]
+    )
+    median_logger.info(f"Chunk budget: {budget} tokens ({prompt_tokens} in the prompt)")
+    return max(budget, MIN_CHUNK_TOKENS)
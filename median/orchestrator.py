@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import random
+from typing import AsyncIterator, List
+
+from median.generate_quizz import (
+    GENERATION_CACHE,
+    generation_cache_key,
+    prepare_chunks,
+)
+from median.inference_backends import get_backend
+from median.llm_provider import generation
+from median.utils import median_logger
+from median.validator import salvage_collection, validate_json_data
+
+CONCURRENCY_ENV_VAR = "MEDIAN_GENERATION_CONCURRENCY"
+# Seconds one generation call may take before it is retried
+GENERATION_TIMEOUT = 600
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+def generation_concurrency() -> int:
+    """
+    Returns how many chunks may be generated at the same time.
+
+    The MEDIAN_GENERATION_CONCURRENCY environment variable is capped at the selected
+    backend's max_concurrency, so in-process models are never called concurrently.
+
+    Returns:
+        int: The concurrency limit.
+    """
+
+    backend = get_backend()
+    requested = int(os.environ.get(CONCURRENCY_ENV_VAR, backend.max_concurrency))
+    return max(1, min(requested, backend.max_concurrency))
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Computes the exponential backoff before a retry, with jitter so concurrent retries spread out.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+
+    Returns:
+        float: The delay in seconds.
+    """
+
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt) * random.uniform(0.5, 1.0)
+
+
+async def generate_chunk(
+    doc: str,
+    lang: str,
+    topics: List[str],
+    semaphore: asyncio.Semaphore,
+    use_cache: bool = True,
+    timeout: float = GENERATION_TIMEOUT,
+    max_attempts: int = MAX_ATTEMPTS,
+) -> dict:
+    """
+    Generates and validates the quiz of one chunk, retrying failures with exponential backoff.
+
+    Generation runs in a worker thread while holding the semaphore, and validation runs
+    in the loop's default executor, so the event loop only schedules work. A timed-out
+    call cannot be interrupted: it keeps its semaphore slot until its thread finishes,
+    so the backend never runs more calls than allowed, but its result is discarded.
+    If every attempt fails, the valid cards salvaged from the outputs are returned uncached.
+
+    Args:
+        doc (str): The chunk for which the quiz is generated.
+        lang (str): The language for the quiz.
+        topics (List[str]): The topics to include in the quiz.
+        semaphore (asyncio.Semaphore): Bounds the generations running at the same time.
+        use_cache (bool): Whether to reuse a cached quiz; a new quiz is cached either way (default is True).
+        timeout (float): The seconds one generation call may take (default is GENERATION_TIMEOUT).
+        max_attempts (int): The number of generations tried before giving up (default is MAX_ATTEMPTS).
+
+    Returns:
+        dict: The generated quiz data in JSON format.
+
+    Raises:
+        ValueError: If no valid card can be generated after max_attempts attempts.
+    """
+
+    cache_key = generation_cache_key(doc, lang, topics)
+    if use_cache:
+        cached = await asyncio.to_thread(GENERATION_CACHE.get, cache_key)
+        if cached is not None:
+            return json.loads(cached)
+
+    loop = asyncio.get_running_loop()
+    outputs = []
+    for attempt in range(max_attempts):
+        try:
+            await semaphore.acquire()
+            call = asyncio.ensure_future(
+                asyncio.to_thread(generation, doc, lang, " ,".join(topics))
+            )
+            call.add_done_callback(lambda _: semaphore.release())
+            # Shielded so that a timeout or cancellation never detaches the slot from the thread
+            output = await asyncio.wait_for(asyncio.shield(call), timeout)
+            valid, quiz_json, error = await loop.run_in_executor(
+                None, validate_json_data, output
+            )
+            outputs.append(output)
+        except asyncio.TimeoutError:
+            valid, error = False, f"Generation timed out after {timeout}s"
+        except Exception as e:
+            valid, error = False, f"Generation failed: {e}"
+        if valid:
+            await asyncio.to_thread(GENERATION_CACHE.set, cache_key, json.dumps(quiz_json))
+            return quiz_json
+        median_logger.error(f"Attempt {attempt + 1}: {error}")
+        if attempt + 1 < max_attempts:
+            await asyncio.sleep(retry_delay(attempt))
+    salvaged = await loop.run_in_executor(None, salvage_collection, outputs)
+    if salvaged is not None:
+        return salvaged
+    raise ValueError(f"Failed to generate valid quiz after {max_attempts} attempts.")
+
+
+async def aiter_quiz(
+    content: str,
+    use_cache: bool = True,
+    chunk_mode: str = "context",
+    topic_mode: str = "section",
+    concurrency: int = None,
+    timeout: float = GENERATION_TIMEOUT,
+) -> AsyncIterator[tuple]:
+    """
+    Generates the quizzes of every chunk concurrently, yielding each chunk's cards as soon as they validate.
+
+    Closing the iterator, or cancelling the task consuming it, cancels the chunks still
+    pending, for instance when the user leaves the page. A chunk that cannot be generated
+    is yielded with its error, so the other chunks are not lost.
+
+    Args:
+        content (str): The content for which quizzes are generated.
+        use_cache (bool): Whether to reuse quizzes cached for identical chunks (default is True).
+        chunk_mode (str): "context" or "fixed", see generate_quizz.prepare_chunks() (default is "context").
+        topic_mode (str): "section" or "global", see generate_quizz.prepare_chunks() (default is "section").
+        concurrency (int): The maximum number of concurrent generations (default is generation_concurrency()).
+        timeout (float): The seconds one generation call may take (default is GENERATION_TIMEOUT).
+
+    Yields:
+        tuple: The chunk index, the number of chunks, the chunk's quizzes, the topics extracted from
+            the content and the chunk's error message, or None if it was generated, in completion order.
+    """
+
+    lang, chunks, topics, chunk_topics = await asyncio.to_thread(
+        prepare_chunks, content, chunk_mode, topic_mode
+    )
+    semaphore = asyncio.Semaphore(concurrency or generation_concurrency())
+    tasks = {
+        asyncio.create_task(
+            generate_chunk(chunk, lang, themes, semaphore, use_cache, timeout)
+        ): index
+        for index, (chunk, themes) in enumerate(zip(chunks, chunk_topics))
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    cards, error = task.result()["collection"], None
+                except Exception as e:
+                    cards, error = [], str(e)
+                yield tasks[task], len(chunks), cards, topics, error
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
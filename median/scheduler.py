@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from median.database import update_flashcard_review
+from median.spaced_repetition import update_model
+from median.utils import median_logger
+
+
+def record_review(card: tuple, result: int) -> tuple:
+    """
+    Updates the recall model of a reviewed card and reschedules only that card.
+
+    Args:
+        card (tuple): The reviewed card, shaped like select_next_due_flashcards() rows.
+        result (int): The review result: 0 for again, 1 for good, 2 for easy.
+
+    Returns:
+        tuple: The updated (alpha, beta, t) model of the card.
+    """
+
+    total = card[8] + 1
+    new_model = update_model(
+        model=(card[4], card[5], card[6]),
+        result=result,
+        total=total,
+        last_test=card[7],
+    )
+    update_flashcard_review(card[0], new_model, datetime.now(), total)
+    median_logger.info(f"Recorded review {result} for flashcard {card[0]}")
+    return new_model
+
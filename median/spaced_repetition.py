@@ -1,7 +1,16 @@
+import time
 from datetime import timedelta, datetime
+from typing import Optional
 
 import ebisu
+import numpy as np
+from scipy.special import gammaln
 
+from median.database import (
+    due_timestamp,
+    select_next_due_flashcards,
+    update_flashcard_reviews_bulk,
+)
 from median.utils import median_logger
 
 
@@ -35,32 +44,94 @@ def hours_since(date_last_test):
     return (datetime.now() - date_last_test) / one_hour
 
 
+def hours_since_epoch(last_test: float) -> float:
+    """
+    Calculates the number of hours since an epoch timestamp.
+
+    Args:
+        last_test (float): The epoch timestamp to calculate the hours since.
+
+    Returns:
+        float: The number of hours elapsed since the given timestamp.
+    """
+
+    return (datetime.now().timestamp() - last_test) / 3600
+
+
+def predict_log_recall(alpha, beta, t, elapsed) -> np.ndarray:
+    """
+    Predicts the log-recall of many ebisu models at once.
+
+    This is ebisu.predictRecall vectorized: log B(alpha + elapsed / t, beta) - log B(alpha, beta),
+    written with log-gamma functions so it stays finite for large elapsed times.
+
+    Args:
+        alpha: The alpha parameter of each model.
+        beta: The beta parameter of each model.
+        t: The half-life parameter of each model, in hours.
+        elapsed: The hours elapsed since each fact was last tested.
+
+    Returns:
+        np.ndarray: The log of the predicted recall probability of each model.
+    """
+
+    alpha, beta, t, elapsed = (np.asarray(x, dtype=float) for x in (alpha, beta, t, elapsed))
+    shifted = alpha + elapsed / t
+    return (
+        gammaln(shifted)
+        - gammaln(shifted + beta)
+        - gammaln(alpha)
+        + gammaln(alpha + beta)
+    )
+
+
+def lowest_recall(fact_ids, models, last_tests, k: int = 1) -> list[dict]:
+    """
+    Returns the k facts with the lowest predicted recall without sorting the whole deck.
+
+    Args:
+        fact_ids: The ID of each fact.
+        models: The (alpha, beta, t) model of each fact, as an (n, 3) array.
+        last_tests: The epoch timestamp of the last test of each fact.
+        k (int): The number of facts to return (default is 1).
+
+    Returns:
+        list[dict]: Dictionaries with 'factID' and 'recall' values, sorted by 'recall' in ascending order.
+    """
+
+    fact_ids = np.asarray(fact_ids)
+    if fact_ids.size == 0:
+        return []
+    models = np.asarray(models, dtype=float).reshape(-1, 3)
+    elapsed = (datetime.now().timestamp() - np.asarray(last_tests, dtype=float)) / 3600
+    log_recall = predict_log_recall(models[:, 0], models[:, 1], models[:, 2], elapsed)
+    k = min(k, fact_ids.size)
+    candidates = np.argpartition(log_recall, k - 1)[:k]
+    candidates = candidates[np.argsort(log_recall[candidates])]
+    return [
+        {"factID": fact_ids[i].item(), "recall": float(np.exp(log_recall[i]))}
+        for i in candidates
+    ]
+
+
 def recall_prediction(database):
     """
     Predicts recall for each factID based on the database information.
 
     Args:
-        database: The database containing information for each factID.
+        database: The database containing the 'factID', (alpha, beta, t) 'model' and epoch 'lastTest' of each fact.
 
     Returns:
         list: A list of dictionaries with 'factID' and 'recall' values, sorted by 'recall' in ascending order.
     """
 
     median_logger.info("Recall prediction for each factID")
-    recall_list = [
-        {
-            "factID": row["factID"],
-            "recall": ebisu.predictRecall(
-                row["model"],
-                hours_since(convert_to_datetime(row["lastTest"])),
-                exact=True,
-            ),
-        }
-        for row in database
-    ]
-    # Sort the recall_list by 'recall' value in ascending order outside the loop
-    recall_list.sort(key=lambda x: x["recall"])
-    return recall_list
+    return lowest_recall(
+        [row["factID"] for row in database],
+        [row["model"] for row in database],
+        [row["lastTest"] for row in database],
+        k=len(database),
+    )
 
 
 def update_model(model, result, total, last_test):
@@ -68,24 +139,152 @@ def update_model(model, result, total, last_test):
     Updates a model based on the result, total, and last test information.
 
     Args:
-        model: The current model to update.
+        model: The current (alpha, beta, t) model to update.
         result: The result of the update.
         total: The total number of updates.
-        last_test: The date of the last test.
+        last_test: The epoch timestamp of the last test.
 
     Returns:
-        str: The updated model after the modifications.
+        tuple: The updated (alpha, beta, t) model after the modifications.
     """
 
     median_logger.info("Update model based on the result")
+    elapsed = hours_since_epoch(last_test)
     try:
-        new_model = ebisu.updateRecall(
-            model, result, total, hours_since(convert_to_datetime(last_test))
-        )
+        new_model = ebisu.updateRecall(model, result, total, elapsed)
     except Exception:
-        new_model = ebisu.updateRecall(
-            model, 1, total, hours_since(convert_to_datetime(last_test))
-        )
+        new_model = ebisu.updateRecall(model, 1, total, elapsed)
     if result == 2:
         new_model = ebisu.rescaleHalflife(new_model, 2.0)
-    return str(new_model)
+    return tuple(float(value) for value in new_model)
+
+
+def rank_by_recall(cards: list[tuple]) -> list[tuple]:
+    """
+    Orders cards from the lowest to the highest predicted recall.
+
+    Args:
+        cards (list[tuple]): Cards shaped like select_next_due_flashcards() rows.
+
+    Returns:
+        list[tuple]: The same cards, least likely to be recalled first.
+    """
+
+    by_id = {card[0]: card for card in cards}
+    ranked = lowest_recall(
+        list(by_id),
+        [card[4:7] for card in cards],
+        [card[7] for card in cards],
+        k=len(cards),
+    )
+    return [by_id[row["factID"]] for row in ranked]
+
+
+class ReviewSession:
+    """
+    A review session over one deck that prefetches due cards and buffers answers in memory.
+
+    The batch_size cards due first are fetched through the due index and served from the
+    lowest predicted recall. Answers update the card's model immediately; an answered card
+    stays in the batch when it falls due before the rest of it, so a card answered "again"
+    comes back without waiting for the batch to run out. Answers reach the database in one
+    transaction every flush_every answers or flush_interval seconds, when the batch runs
+    out, or on close(); at most that many answers are lost if the session ends unclosed.
+    """
+
+    def __init__(
+        self,
+        flashcard_name: str,
+        batch_size: int = 20,
+        flush_every: int = 10,
+        flush_interval: float = 60.0,
+    ):
+        """
+        Starts a review session.
+
+        Args:
+            flashcard_name (str): The name of the deck to review.
+            batch_size (int): The number of due cards fetched at once (default is 20).
+            flush_every (int): The number of answers buffered before they are written (default is 10).
+            flush_interval (float): The seconds after which buffered answers are written (default is 60.0).
+        """
+
+        self.flashcard_name = flashcard_name
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.queue = []
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def current(self) -> Optional[tuple]:
+        """
+        Returns the card to review, fetching the next due cards when the batch is empty.
+
+        Returns:
+            Optional[tuple]: The card, shaped like select_flashcard_by_name() rows, or None if the deck is empty.
+        """
+
+        if not self.queue:
+            self.flush()
+            self.queue = select_next_due_flashcards(self.flashcard_name, self.batch_size)
+        elif time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+        # Recall keeps falling while the session is open, so the batch is ranked on every call
+        self.queue = rank_by_recall(self.queue)
+        return self.queue[0] if self.queue else None
+
+    def answer(self, result: int) -> tuple:
+        """
+        Records the answer to the current card and moves to the next one.
+
+        Args:
+            result (int): The review result: 0 for again, 1 for good, 2 for easy.
+
+        Returns:
+            tuple: The updated (alpha, beta, t) model of the answered card.
+        """
+
+        card = self.queue.pop(0)
+        total = card[8] + 1
+        new_model = update_model(
+            model=(card[4], card[5], card[6]),
+            result=result,
+            total=total,
+            last_test=card[7],
+        )
+        reviewed_at = datetime.now()
+        self.pending[card[0]] = (card[0], new_model, reviewed_at, total)
+        due = due_timestamp(new_model, reviewed_at.timestamp())
+        if self.queue and due <= max(due_timestamp(c[4:7], c[7]) for c in self.queue):
+            self.queue.append((*card[:4], *new_model, reviewed_at.timestamp(), total))
+        if (
+            len(self.pending) >= self.flush_every
+            or time.monotonic() - self.flushed_at >= self.flush_interval
+        ):
+            self.flush()
+        return new_model
+
+    def flush(self):
+        """
+        Writes the buffered answers to the database in one transaction.
+
+        Returns:
+            None
+        """
+
+        if self.pending:
+            update_flashcard_reviews_bulk(list(self.pending.values()))
+            self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        """
+        Ends the session, writing any buffered answers.
+
+        Returns:
+            None
+        """
+
+        self.flush()
+        self.queue = []
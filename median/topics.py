@@ -0,0 +1,191 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from pke.unsupervised import TopicRank
+
+from median.cache import DiskCache
+from median.utils import median_logger, tag_sentences
+
+TOPIC_CANDIDATES_PER_SECTION = 15
+PARALLEL_MIN_SECTIONS = 4
+TOPIC_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+TOPICS_CACHE = DiskCache("topics", max_bytes=64 * 1024 * 1024, max_age=90 * 24 * 60 * 60)
+
+_EXECUTOR = None
+
+
+def get_topics(
+    content: str, language: str, spacy_model: Optional[str] = "en_core_web_sm"
+) -> List[str]:
+    """
+    Extracts key topics from the provided content using the specified language and SpaCy model.
+
+    Args:
+        content (str): The content from which to extract key topics.
+        language (str): The language of the content.
+        spacy_model (Optional[str]): The SpaCy model to use for topic extraction (default is "en_core_web_sm").
+
+    Returns:
+        List[str]: A list of key topics extracted from the content.
+    """
+
+    sentences = tag_sentences([content], spacy_model)[0]
+    if not sentences:
+        return []
+    extractor = TopicRank()
+    extractor.load_document(sentences, language=language, normalization="stemming")
+    extractor.candidate_selection()
+    extractor.candidate_weighting()
+    key_phrases = extractor.get_n_best(n=5, stemming=False)
+    median_logger.info(f"Extracted key phrases: {key_phrases}")
+    return [candidate for (candidate, _) in key_phrases]
+
+
+def _section_key_phrases(
+    sentences: List[List[Tuple[str, str]]], language: str, n: int
+) -> List[Tuple[str, float]]:
+    """
+    Runs TopicRank on a single tagged section; runs in a worker process.
+
+    Args:
+        sentences (List[List[Tuple[str, str]]]): The sentences of the section, see utils.tag_sentences().
+        language (str): The language of the section.
+        n (int): The number of key phrases to return.
+
+    Returns:
+        List[Tuple[str, float]]: The best key phrases of the section with their TopicRank scores.
+    """
+
+    if not sentences:
+        return []
+    extractor = TopicRank()
+    extractor.load_document(sentences, language=language, normalization="stemming")
+    extractor.candidate_selection()
+    if not extractor.candidates:
+        return []
+    extractor.candidate_weighting()
+    return extractor.get_n_best(n=n, stemming=False)
+
+
+def _section_cache_key(section: str, language: str, spacy_model: str) -> str:
+    """
+    Computes the cache key of a section's key phrases.
+
+    Args:
+        section (str): The text of the section.
+        language (str): The language of the section.
+        spacy_model (str): The SpaCy model used for candidate selection.
+
+    Returns:
+        str: The SHA-256 hex digest identifying the extraction.
+    """
+
+    payload = json.dumps(
+        [section, language, spacy_model, TOPIC_CANDIDATES_PER_SECTION]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by every topic extraction of this process.
+
+    Returns:
+        ProcessPoolExecutor: The process pool.
+    """
+
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        # Spawned rather than forked: the parent holds threads and model runtimes
+        # that are not fork-safe
+        _EXECUTOR = ProcessPoolExecutor(
+            max_workers=TOPIC_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _EXECUTOR
+
+
+def section_key_phrases(
+    sections: List[str], language: str, spacy_model: Optional[str] = "en_core_web_sm"
+) -> List[List[Tuple[str, float]]]:
+    """
+    Extracts the scored key phrases of each section, in parallel and with a content-hash cache.
+
+    Uncached sections are tagged together in one nlp.pipe pass, then TopicRank runs
+    on each section's tagged sentences.
+
+    Args:
+        sections (List[str]): The texts of the sections.
+        language (str): The language of the sections.
+        spacy_model (Optional[str]): The SpaCy model to use (default is "en_core_web_sm").
+
+    Returns:
+        List[List[Tuple[str, float]]]: The scored key phrases of each section, in order.
+    """
+
+    keys = [_section_cache_key(s, language, spacy_model) for s in sections]
+    results = [None] * len(sections)
+    missing = []
+    for index, key in enumerate(keys):
+        cached = TOPICS_CACHE.get(key)
+        if cached is None:
+            missing.append(index)
+        else:
+            results[index] = [tuple(phrase) for phrase in json.loads(cached)]
+
+    tagged = tag_sentences([sections[i] for i in missing], spacy_model) if missing else []
+    args = [(sentences, language, TOPIC_CANDIDATES_PER_SECTION) for sentences in tagged]
+    if len(missing) >= PARALLEL_MIN_SECTIONS:
+        extracted = list(_get_executor().map(_section_key_phrases, *zip(*args)))
+    else:
+        extracted = [_section_key_phrases(*a) for a in args]
+    for index, phrases in zip(missing, extracted):
+        results[index] = phrases
+        TOPICS_CACHE.set(keys[index], json.dumps(phrases))
+    median_logger.info(
+        f"Extracted key phrases of {len(missing)} sections, {len(sections) - len(missing)} cached"
+    )
+    return results
+
+
+def get_topics_by_section(
+    sections: List[str],
+    language: str,
+    spacy_model: Optional[str] = "en_core_web_sm",
+    n: int = 5,
+) -> Tuple[List[str], List[List[str]]]:
+    """
+    Extracts the key topics of a long document section by section.
+
+    TopicRank runs on each section independently, which keeps its candidate graphs small.
+    The per-section scores are then merged, weighted by section length, into global topics.
+
+    Args:
+        sections (List[str]): The texts of the sections, such as the chunks sent to generation.
+        language (str): The language of the document.
+        spacy_model (Optional[str]): The SpaCy model to use (default is "en_core_web_sm").
+        n (int): The number of topics to return, globally and per section (default is 5).
+
+    Returns:
+        Tuple[List[str], List[List[str]]]: The global topics and the topics of each section.
+    """
+
+    scored = section_key_phrases(sections, language, spacy_model)
+    total_length = sum(len(s) for s in sections) or 1
+    merged, display = {}, {}
+    for section, phrases in zip(sections, scored):
+        weight = len(section) / total_length
+        for phrase, score in phrases:
+            key = phrase.lower()
+            merged[key] = merged.get(key, 0.0) + weight * score
+            display.setdefault(key, phrase)
+
+    global_topics = [
+        display[key] for key in sorted(merged, key=merged.get, reverse=True)[:n]
+    ]
+    per_section = [[phrase for phrase, _ in phrases[:n]] or global_topics for phrases in scored]
+    median_logger.info(f"Extracted global key phrases: {global_topics}")
+    return global_topics, per_section
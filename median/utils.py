@@ -1,15 +1,26 @@
 import datetime
 import logging
 import os
+import zlib
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 
+import numpy as np
 import spacy
 from langchain.docstore.document import Document as LangchainDocument
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langdetect import detect
-from pke.unsupervised import TopicRank
+from spacy.lang.char_classes import (
+    ALPHA,
+    ALPHA_LOWER,
+    ALPHA_UPPER,
+    CONCAT_QUOTES,
+    LIST_ELLIPSES,
+    LIST_ICONS,
+)
 from spacy.language import Language
+from spacy.util import compile_infix_regex
 from transformers import AutoTokenizer
 
 # Constants
@@ -26,6 +37,30 @@ MARKDOWN_SEPARATORS = [
     "",
 ]
 SPACY_MODELS = {}
+SPACY_MODELS_ENV_VAR = "MEDIAN_SPACY_MODELS"
+DEFAULT_SPACY_MODELS = "en_core_web_sm,fr_core_news_sm"
+# TopicRank only needs tokens, sentences and parts of speech
+SPACY_EXCLUDED_COMPONENTS = ["ner", "parser", "lemmatizer"]
+SPACY_INFIXES = compile_infix_regex(
+    LIST_ELLIPSES
+    + LIST_ICONS
+    + [
+        r"(?<=[0-9])[+\-\*^](?=[0-9-])",
+        r"(?<=[{al}{q}])\.(?=[{au}{q}])".format(
+            al=ALPHA_LOWER, au=ALPHA_UPPER, q=CONCAT_QUOTES
+        ),
+        r"(?<=[{a}]),(?=[{a}])".format(a=ALPHA),
+        r"(?<=[{a}0-9])[:<>=/](?=[{a}])".format(a=ALPHA),
+    ]
+)
+NLP_PROCESSES_ENV_VAR = "MEDIAN_NLP_PROCESSES"
+NLP_SEGMENT_CHARS = 100_000
+NLP_BATCH_SIZE = 16
+LENGTH_CACHE_SIZE = 65536
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# Largest prime below 2**32, so a * hash + b never overflows 64 bits
+MINHASH_PRIME = 4294967291
+TOKENIZER_PATHS = {}
 
 
 # Logging setup
@@ -74,6 +109,10 @@ def load_spacy_model(spacy_model: str) -> Language:
     """
     Loads a SpaCy language model and caches it for future use.
 
+    Only the components needed for part-of-speech tagging are kept: SPACY_EXCLUDED_COMPONENTS
+    are not loaded, and sentence boundaries come from the senter component, or a
+    rule-based sentencizer when the model has none.
+
     Args:
         spacy_model (str): The name of the SpaCy model to load.
 
@@ -83,17 +122,117 @@ def load_spacy_model(spacy_model: str) -> Language:
 
     if spacy_model not in SPACY_MODELS:
         try:
-            SPACY_MODELS[spacy_model] = spacy.load(spacy_model)
-            median_logger.info(f"Loaded SpaCy model: {spacy_model}")
+            nlp = spacy.load(spacy_model, exclude=SPACY_EXCLUDED_COMPONENTS)
         except Exception as e:
             median_logger.error(
                 f"Error loading SpaCy model: {e}. Attempting to download."
             )
             spacy.cli.download(spacy_model)
-            SPACY_MODELS[spacy_model] = spacy.load(spacy_model)
+            nlp = spacy.load(spacy_model, exclude=SPACY_EXCLUDED_COMPONENTS)
+        if "senter" in nlp.disabled:
+            nlp.enable_pipe("senter")
+        elif "senter" not in nlp.pipe_names:
+            nlp.add_pipe("sentencizer")
+        # Keep hyphenated words in one token, as pke does for raw text
+        nlp.tokenizer.infix_finditer = SPACY_INFIXES.finditer
+        SPACY_MODELS[spacy_model] = nlp
+        median_logger.info(f"Loaded SpaCy model: {spacy_model} {nlp.pipe_names}")
     return SPACY_MODELS[spacy_model]
 
 
+def preload_spacy_models(spacy_models: Optional[List[str]] = None):
+    """
+    Loads SpaCy models ahead of the first request.
+
+    Args:
+        spacy_models (Optional[List[str]]): The models to load (default is the comma-separated
+            SPACY_MODELS_ENV_VAR, or DEFAULT_SPACY_MODELS).
+
+    Returns:
+        None
+    """
+
+    if spacy_models is None:
+        spacy_models = os.environ.get(SPACY_MODELS_ENV_VAR, DEFAULT_SPACY_MODELS).split(",")
+    for spacy_model in spacy_models:
+        if spacy_model.strip():
+            load_spacy_model(spacy_model.strip())
+
+
+def segment_text(text: str, max_chars: int = NLP_SEGMENT_CHARS) -> List[str]:
+    """
+    Cuts a text into segments short enough for a SpaCy pipeline.
+
+    Segments end at the last paragraph break, then sentence end, then space before
+    max_chars, so sentences are rarely cut in two.
+
+    Args:
+        text (str): The text to segment.
+        max_chars (int): The maximum length of a segment (default is NLP_SEGMENT_CHARS).
+
+    Returns:
+        List[str]: The segments, in text order.
+    """
+
+    segments = []
+    while len(text) > max_chars:
+        window = text[:max_chars]
+        cut = max_chars
+        for separator in ("\n\n", ". ", " "):
+            position = window.rfind(separator)
+            if position > 0:
+                cut = position + len(separator)
+                break
+        segments.append(text[:cut])
+        text = text[cut:]
+    if text.strip():
+        segments.append(text)
+    return segments
+
+
+def tag_sentences(
+    texts: List[str],
+    spacy_model: Optional[str] = "en_core_web_sm",
+    n_process: Optional[int] = None,
+    batch_size: int = NLP_BATCH_SIZE,
+) -> List[List[List[Tuple[str, str]]]]:
+    """
+    Splits texts into part-of-speech tagged sentences, in batches with nlp.pipe.
+
+    The output is the pre-tokenized input accepted by pke's load_document().
+
+    Args:
+        texts (List[str]): The texts to tag.
+        spacy_model (Optional[str]): The SpaCy model to use (default is "en_core_web_sm").
+        n_process (Optional[int]): The number of processes for nlp.pipe (default is NLP_PROCESSES_ENV_VAR, or 1).
+        batch_size (int): The number of segments per nlp.pipe batch (default is NLP_BATCH_SIZE).
+
+    Returns:
+        List[List[List[Tuple[str, str]]]]: For each text, its sentences as lists of (word, part of speech).
+    """
+
+    nlp = load_spacy_model(spacy_model)
+    n_process = n_process or int(os.environ.get(NLP_PROCESSES_ENV_VAR, 1))
+    segments, owners = [], []
+    for index, text in enumerate(texts):
+        for segment in segment_text(text, min(NLP_SEGMENT_CHARS, nlp.max_length)):
+            segments.append(segment)
+            owners.append(index)
+
+    tagged = [[] for _ in texts]
+    docs = nlp.pipe(segments, batch_size=batch_size, n_process=n_process)
+    for owner, doc in zip(owners, docs):
+        for sentence in doc.sents:
+            words = [
+                (token.text, token.pos_ or token.tag_)
+                for token in sentence
+                if not token.is_space
+            ]
+            if words:
+                tagged[owner].append(words)
+    return tagged
+
+
 def language_detection(content: str) -> str:
     """
     Detects the language of the provided content.
@@ -108,31 +247,99 @@ def language_detection(content: str) -> str:
     return detect(content)
 
 
-def get_topics(
-    content: str, language: str, spacy_model: Optional[str] = "en_core_web_sm"
-) -> List[str]:
+def preload_tokenizer(
+    tokenizer_name: Optional[str] = EMBEDDING_MODEL_NAME, local_path: Optional[str] = None
+):
     """
-    Extracts key topics from the provided content using the specified language and SpaCy model.
+    Loads a tokenizer ahead of the first request, optionally from a local directory.
+
+    When a local path is given, every later use of tokenizer_name loads from it without
+    touching the network.
 
     Args:
-        content (str): The content from which to extract key topics.
-        language (str): The language of the content.
-        spacy_model (Optional[str]): The SpaCy model to use for topic extraction (default is "en_core_web_sm").
+        tokenizer_name (Optional[str]): The name of the tokenizer (default is EMBEDDING_MODEL_NAME).
+        local_path (Optional[str]): A directory holding the saved tokenizer files.
 
     Returns:
-        List[str]: A list of key topics extracted from the content.
+        None
     """
 
-    nlp = load_spacy_model(spacy_model)
-    extractor = TopicRank()
-    extractor.load_document(
-        content, language=language, spacy_model=nlp, normalization="stemming"
+    if local_path:
+        TOKENIZER_PATHS[tokenizer_name] = local_path
+        get_tokenizer.cache_clear()
+        get_text_splitter.cache_clear()
+    get_tokenizer(tokenizer_name)
+    median_logger.info(f"Preloaded tokenizer: {tokenizer_name}")
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(tokenizer_name: Optional[str] = EMBEDDING_MODEL_NAME):
+    """
+    Loads a HuggingFace tokenizer once per process.
+
+    Args:
+        tokenizer_name (Optional[str]): The name of the tokenizer (default is EMBEDDING_MODEL_NAME).
+
+    Returns:
+        PreTrainedTokenizerBase: The loaded tokenizer.
+    """
+
+    local_path = TOKENIZER_PATHS.get(tokenizer_name)
+    tokenizer = AutoTokenizer.from_pretrained(
+        local_path or tokenizer_name, local_files_only=bool(local_path), use_fast=True
+    )
+    median_logger.info(f"Loaded tokenizer: {tokenizer_name}")
+    return tokenizer
+
+
+def token_lengths(
+    texts: List[str], tokenizer_name: Optional[str] = EMBEDDING_MODEL_NAME
+) -> List[int]:
+    """
+    Counts the tokens of several texts in one batched call to the fast tokenizer.
+
+    Args:
+        texts (List[str]): The texts to measure.
+        tokenizer_name (Optional[str]): The name of the tokenizer (default is EMBEDDING_MODEL_NAME).
+
+    Returns:
+        List[int]: The number of tokens of each text, special tokens included.
+    """
+
+    if not texts:
+        return []
+    encoded = get_tokenizer(tokenizer_name)(texts, add_special_tokens=True)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter(
+    tokenizer_name: str, chunk_size: int, chunk_overlap: int
+) -> RecursiveCharacterTextSplitter:
+    """
+    Builds a text splitter once per tokenizer, chunk size and overlap.
+
+    The splitter outlives every call, so its length function does not memoize token
+    counts, which would keep pieces of every document split by the process.
+
+    Args:
+        tokenizer_name (str): The name of the tokenizer measuring chunk sizes.
+        chunk_size (int): The maximum number of tokens in a chunk.
+        chunk_overlap (int): The number of tokens shared by consecutive chunks.
+
+    Returns:
+        RecursiveCharacterTextSplitter: The text splitter.
+    """
+
+    tokenizer = get_tokenizer(tokenizer_name)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=lambda text: len(tokenizer.encode(text)),
+        add_start_index=True,
+        strip_whitespace=True,
+        separators=MARKDOWN_SEPARATORS,
     )
-    extractor.candidate_selection()
-    extractor.candidate_weighting()
-    key_phrases = extractor.get_n_best(n=5, stemming=False)
-    median_logger.info(f"Extracted key phrases: {key_phrases}")
-    return [candidate for (candidate, _) in key_phrases]
 
 
 def split_documents(
@@ -152,24 +359,153 @@ def split_documents(
         List[LangchainDocument]: The list of unique documents after splitting and deduplication.
     """
 
-    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-        AutoTokenizer.from_pretrained(tokenizer_name),
+    text_splitter = get_text_splitter(tokenizer_name, chunk_size, chunk_size // 10)
+    return deduplicate_documents(text_splitter.split_documents(knowledge_base))
+
+
+def split_documents_by_length(
+    chunk_size: int,
+    knowledge_base: List[LangchainDocument],
+    length_function: Callable[[str], int],
+) -> List[LangchainDocument]:
+    """
+    Splits and deduplicates documents with a custom length function, such as the generation model's token count.
+
+    The splitter measures most pieces more than once, so lengths are memoized for the
+    duration of this call only; no text outlives it.
+
+    Args:
+        chunk_size (int): The maximum length of each chunk, as measured by length_function.
+        knowledge_base (List[LangchainDocument]): The list of documents to split.
+        length_function (Callable[[str], int]): The function measuring the length of a text.
+
+    Returns:
+        List[LangchainDocument]: The list of unique documents after splitting and deduplication.
+    """
+
+    text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_size // 10,
+        length_function=lru_cache(maxsize=LENGTH_CACHE_SIZE)(length_function),
         add_start_index=True,
         strip_whitespace=True,
         separators=MARKDOWN_SEPARATORS,
     )
+    return deduplicate_documents(text_splitter.split_documents(knowledge_base))
+
+
+def deduplicate_documents(docs: List[LangchainDocument]) -> List[LangchainDocument]:
+    """
+    Drops documents whose text is identical to an earlier one.
+
+    Args:
+        docs (List[LangchainDocument]): The documents to deduplicate.
+
+    Returns:
+        List[LangchainDocument]: The unique documents, in order.
+    """
 
-    # Split and deduplicate documents
-    docs_processed = text_splitter.split_documents(knowledge_base)
     unique_texts = set()
     docs_unique = [
         doc
-        for doc in docs_processed
+        for doc in docs
         if not (doc.page_content in unique_texts or unique_texts.add(doc.page_content))
     ]
     median_logger.info(
         f"Processed and deduplicated documents. Total unique chunks: {len(docs_unique)}."
     )
     return docs_unique
+
+
+def _minhash_signature(text: str, shingle_size: int, coefficients: np.ndarray) -> np.ndarray:
+    """
+    Computes the MinHash signature of a text over its word shingles.
+
+    Args:
+        text (str): The text to sign.
+        shingle_size (int): The number of consecutive words in a shingle.
+        coefficients (np.ndarray): The (2, num_perm) a and b coefficients of the hash permutations.
+
+    Returns:
+        np.ndarray: The num_perm minimum hash values of the text.
+    """
+
+    words = text.lower().split()
+    shingles = {
+        " ".join(words[i : i + shingle_size])
+        for i in range(max(1, len(words) - shingle_size + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    a, b = coefficients
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+
+def _lsh_bands(num_perm: int, threshold: float) -> int:
+    """
+    Picks the number of LSH bands with the highest detection threshold not above the target similarity.
+
+    Staying below the target keeps pairs at the target similarity likely to share a bucket;
+    false candidates are rejected by the signature comparison.
+
+    Args:
+        num_perm (int): The length of the MinHash signatures.
+        threshold (float): The target Jaccard similarity.
+
+    Returns:
+        int: The number of bands, a divisor of num_perm.
+    """
+
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [b for b in divisors if (1 / b) ** (b / num_perm) <= threshold] or [num_perm]
+    return min(below, key=lambda b: threshold - (1 / b) ** (b / num_perm))
+
+
+def remove_near_duplicates(
+    docs: List[LangchainDocument],
+    threshold: float = NEAR_DUPLICATE_THRESHOLD,
+    shingle_size: int = 5,
+    num_perm: int = 128,
+) -> List[LangchainDocument]:
+    """
+    Drops documents that are near-duplicates of an earlier one, using MinHash and LSH.
+
+    Each document is signed once and only compared with the earlier documents sharing an LSH
+    bucket, so the cost grows linearly with the total text size.
+
+    Args:
+        docs (List[LangchainDocument]): The documents to filter.
+        threshold (float): The estimated Jaccard similarity of word shingles above which a
+            document is dropped (default is NEAR_DUPLICATE_THRESHOLD).
+        shingle_size (int): The number of consecutive words in a shingle (default is 5).
+        num_perm (int): The number of hash permutations in a signature (default is 128).
+
+    Returns:
+        List[LangchainDocument]: The documents that are not near-duplicates, in order.
+    """
+
+    rng = np.random.default_rng(0)
+    coefficients = rng.integers(1, MINHASH_PRIME, size=(2, num_perm), dtype=np.uint64)
+    bands = _lsh_bands(num_perm, threshold)
+    rows = num_perm // bands
+
+    buckets = {}
+    kept, signatures = [], []
+    for doc in docs:
+        signature = _minhash_signature(doc.page_content, shingle_size, coefficients)
+        keys = [
+            (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(bands)
+        ]
+        candidates = {buckets[key] for key in keys if key in buckets}
+        if any(np.mean(signatures[c] == signature) >= threshold for c in candidates):
+            continue
+        for key in keys:
+            buckets.setdefault(key, len(kept))
+        kept.append(doc)
+        signatures.append(signature)
+    median_logger.info(f"Removed {len(docs) - len(kept)} near-duplicate chunks")
+    return kept
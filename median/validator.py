@@ -1,10 +1,8 @@
 import ast
 import json
-import re
-from typing import List
+from typing import Any, Iterator, List, Optional, Tuple
 
-from jsonschema import validate
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 from median.utils import median_logger
 
@@ -27,14 +25,75 @@ class QuizCollection(BaseModel):
 
 
 # serialize pydantic model into json schema
-pydantic_schema = QuizCollection.schema_json()
-json_schema = json.loads(pydantic_schema)
-median_logger.info(f"JSON schema: {json_schema}")
+json_schema = QuizCollection.model_json_schema()
+median_logger.debug(f"JSON schema: {json_schema}")
 
+# Validators compiled once by pydantic-core and reused for every output
+QUIZ_ADAPTER = TypeAdapter(Quiz)
+QUIZ_COLLECTION_ADAPTER = TypeAdapter(QuizCollection)
 
-def extract_json_from_markdown(text):
+
+def iter_json_objects(text: str) -> Iterator[Tuple[int, int, int]]:
+    """
+    Finds every balanced {...} span of a text in a single pass.
+
+    Braces inside double-quoted strings, including escaped quotes, are ignored, so
+    nested objects and answers containing braces are located correctly. Quotes are only
+    tracked inside an object, so an unbalanced quote in the surrounding prose does not
+    hide the objects after it. Spans are yielded as they close, so inner objects come
+    before the object containing them.
+
+    Args:
+        text (str): The text to scan, such as a model output wrapped in prose or markdown.
+
+    Yields:
+        Tuple[int, int, int]: The start and end offsets of each object and its nesting depth.
+    """
+
+    starts = []
+    in_string = False
+    escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"' and starts:
+            in_string = True
+        elif char == "{":
+            starts.append(position)
+        elif char == "}" and starts:
+            start = starts.pop()
+            yield start, position + 1, len(starts)
+
+
+def parse_object(text: str) -> Optional[Any]:
+    """
+    Parses a JSON object, or the Python dict literal some models produce instead.
+
+    Args:
+        text (str): The text of the object.
+
+    Returns:
+        Optional[Any]: The parsed value, or None if the text is neither.
     """
-    Extracts JSON-like dictionaries from a given text using regular expressions.
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        return None
+
+
+def extract_json_from_markdown(text: str) -> List[dict]:
+    """
+    Extracts the outermost JSON-like dictionaries from a given text.
 
     Args:
         text (str): The text to extract JSON-like dictionaries from.
@@ -43,31 +102,71 @@ def extract_json_from_markdown(text):
         List[dict]: A list of extracted dictionaries from the text.
     """
 
-    # Regular expression pattern to match simple dictionary-like structures
-    dict_pattern = r"\{[^\{\}]*\}"
+    extracted_dicts = []
+    for start, end, depth in iter_json_objects(text):
+        if depth == 0:
+            candidate = parse_object(text[start:end])
+            if isinstance(candidate, dict):
+                extracted_dicts.append(candidate)
+    return extracted_dicts
 
-    # Find all substrings that look like dictionaries
-    potential_dicts = re.findall(dict_pattern, text)
 
-    extracted_dicts = []
-    for d_str in potential_dicts:
-        # Convert the string representation of dictionary to actual dictionary
+def salvage_quizzes(text: str) -> List[dict]:
+    """
+    Recovers the valid cards of an output that does not validate as a whole.
+
+    Every complete object that validates as a Quiz is kept, in text order, so a
+    truncated collection or a single malformed card does not discard the others.
+    Salvaged cards are a last resort once retries are exhausted, and are never cached.
+
+    Args:
+        text (str): The model output.
+
+    Returns:
+        List[dict]: The valid cards.
+    """
+
+    cards = []
+    for start, end, _ in iter_json_objects(text):
+        candidate = parse_object(text[start:end])
+        if not isinstance(candidate, dict) or "collection" in candidate:
+            continue
         try:
-            # Safe literal evaluation of dict string
-            d = ast.literal_eval(d_str)
-            if isinstance(d, dict):  # Ensure it is a dictionary
-                extracted_dicts.append(d)
-                median_logger.info(f"Extracted dictionary: {d}")
-        except (ValueError, SyntaxError):
-            # Skip if conversion fails
-            median_logger.error(f"Failed to convert {d_str} to dictionary")
+            cards.append((start, QUIZ_ADAPTER.validate_python(candidate).model_dump()))
+        except ValidationError:
+            continue
+    return [card for _, card in sorted(cards, key=lambda item: item[0])]
 
-    return extracted_dicts
+
+def salvage_collection(outputs: List[str]) -> Optional[dict]:
+    """
+    Builds a QuizCollection from the failed output with the most salvageable cards.
+
+    Args:
+        outputs (List[str]): The outputs of every failed attempt for one document.
+
+    Returns:
+        Optional[dict]: The salvaged quiz data in JSON format, or None if no card is valid.
+    """
+
+    cards = max(
+        (salvage_quizzes(output) for output in outputs if isinstance(output, str)),
+        key=len,
+        default=[],
+    )
+    if not cards:
+        return None
+    median_logger.warning(f"Salvaged {len(cards)} valid cards from malformed output")
+    return {"collection": cards}
 
 
 def validate_json_data(json_object):
     """
-    Validates JSON data by attempting to load it using json.loads, ast.literal_eval, or extracting JSON-like structures.
+    Validates the output of a generation against the QuizCollection schema.
+
+    Well-formed output is parsed and validated in one step by pydantic-core. Otherwise
+    the first balanced object that validates as a QuizCollection is used. Output that
+    only holds some valid cards fails validation; see salvage_quizzes().
 
     Args:
         json_object: The JSON object to validate.
@@ -76,69 +175,30 @@ def validate_json_data(json_object):
         tuple: A tuple containing a boolean indicating validation success, the parsed JSON object, and an error message if validation fails.
     """
 
-    valid = False
-    error_message = None
-    result_json = None
+    if not isinstance(json_object, str):
+        try:
+            quiz = QUIZ_COLLECTION_ADAPTER.validate_python(json_object)
+            return True, quiz.model_dump(), None
+        except ValidationError as e:
+            error_message = f"Validation failed: {e}"
+            median_logger.error(error_message)
+            return False, json_object, error_message
 
     try:
-        # Attempt to load JSON using json.loads
+        quiz = QUIZ_COLLECTION_ADAPTER.validate_json(json_object)
+        return True, quiz.model_dump(), None
+    except ValidationError as e:
+        median_logger.debug(f"Fast path failed: {e}")
+
+    for candidate in extract_json_from_markdown(json_object):
         try:
-            result_json = json.loads(json_object)
-            median_logger.info(f"JSON data: {result_json} using json.loads")
-        except json.decoder.JSONDecodeError:
-            # If json.loads fails, try ast.literal_eval
-            median_logger.error("Failed to load JSON data using json.loads")
-            try:
-                result_json = ast.literal_eval(json_object)
-                median_logger.info(f"JSON data: {result_json} using ast.literal_eval")
-            except (SyntaxError, ValueError):
-                # If both json.loads and ast.literal_eval fail, try extracting JSON-like structures
-                median_logger.error("Failed to load JSON data using ast.literal_eval")
-                try:
-                    result_json = extract_json_from_markdown(json_object)
-                except Exception as e:
-                    error_message = f"JSON decoding error: {e}"
-                    median_logger.error(error_message)
-                    return valid, result_json, error_message
-
-        # Return early if both json.loads and ast.literal_eval fail
-        if result_json is None:
-            error_message = "Failed to decode JSON data"
-            median_logger.error(error_message)
-            return valid, result_json, error_message
-        else:
-            median_logger.info(f"JSON data: {result_json}")
-        # Validate each item in the list against schema if it's a list
-        if isinstance(result_json, list):
-            median_logger.info("List found, validating each item")
-            for index, item in enumerate(result_json):
-                try:
-                    validate(instance=item, schema=json_schema)
-                    median_logger.info(f"Validation successful for item {index + 1}")
-                except ValidationError as e:
-                    error_message = f"""Validation failed for item {
-                    index + 1
-                    }: {e}"""
-                    median_logger.error(error_message)
-                    break
-        else:
-            # Default to validation without list
-            median_logger.info("No list found, validating without list")
-            try:
-                validate(instance=result_json, schema=json_schema)
-                median_logger.info("Validation successful")
-            except ValidationError as e:
-                error_message = f"Validation failed: {e}"
-                median_logger.error(error_message)
-
-    except Exception as e:
-        error_message = f"Error occurred: {e}"
-        median_logger.error(error_message)
-
-    if error_message is None:
-        valid = True
-        median_logger.info("Validation successful")
-    else:
-        median_logger.error("Validation failed")
-
-    return valid, result_json, error_message
+            quiz = QUIZ_COLLECTION_ADAPTER.validate_python(candidate)
+            median_logger.debug(f"JSON data extracted from the output: {candidate}")
+            return True, quiz.model_dump(), None
+        except ValidationError:
+            continue
+
+    error_message = "Failed to decode a valid QuizCollection"
+    median_logger.error(error_message)
+    median_logger.debug(f"Rejected output: {json_object}")
+    return False, None, error_message
@@ -1,10 +1,19 @@
+import time
 from datetime import datetime
 
 import streamlit as st
 
-from median.database import insert_flashcard_data
-from median.file_reader import main as read_file
-from median.generate_quizz import quiz
+from median.database import DEFAULT_MODEL, insert_flashcards_bulk
+from median.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    cancel_job,
+    get_job,
+    start_workers,
+    submit_job,
+)
 
 st.set_page_config(
     page_title="Add New Flashcard - Median",
@@ -13,7 +22,11 @@ st.set_page_config(
 )
 
 
+JOB_POLL_SECONDS = 1.0
+
 # Initialization
+start_workers()
+
 if "flashcard_data" not in st.session_state:
     st.session_state["flashcard_data"] = []
 
@@ -25,13 +38,16 @@ if "rerun" not in st.session_state:
 
 
 st.title("Create New Flashcard")
-topics = None
-quiz_collection = None
 rerun = False
 with st.form("my_form"):
     flashcard_name = st.text_input("Flashcard Name")
 
     data = st.file_uploader("Upload data file", type=["pdf", "docx", "md", "txt"])
+    use_cache = st.checkbox(
+        "Reuse cards already generated for this content",
+        value=True,
+        help="Uncheck to sample new cards instead of reusing cached ones.",
+    )
     col1, col2 = st.columns(2)
     with col1:
         submit = st.form_submit_button("Generate Cards")
@@ -46,17 +62,78 @@ with st.form("my_form"):
         if st.session_state["rerun"]:
             rerun = st.form_submit_button("Regenerate Cards")
 
+
+def show_job(job_id: int):
+    """
+    Shows the progress of a generation job and the cards generated so far.
+
+    The page reruns every JOB_POLL_SECONDS while the job is queued or running, and
+    moves the cards of a finished job, or those a failed job generated, into the session.
+
+    Args:
+        job_id (int): The ID of the job.
+
+    Returns:
+        None
+    """
+
+    job = get_job(job_id)
+    if job is None or job["status"] == CANCELLED:
+        del st.session_state["job_id"]
+        return
+    if job["status"] in (DONE, FAILED):
+        if job["cards"] or job["status"] == DONE:
+            if not st.session_state.pop("job_keep_existing", False):
+                st.session_state["flashcard_data"] = []
+            st.session_state["flashcard_data"].extend(job["cards"])
+            st.session_state["topics"] = job["topics"]
+        if job["status"] == FAILED:
+            st.session_state["job_error"] = f"Card generation failed: {job['error']}"
+        elif job["chunk_errors"]:
+            st.session_state["job_warning"] = (
+                f"Cards could not be generated for {len(job['chunk_errors'])} of "
+                f"{job['chunk_count']} sections; regenerate to try them again."
+            )
+        del st.session_state["job_id"]
+        st.rerun()
+
+    if job["status"] == QUEUED:
+        st.progress(0.0, text="Waiting for a free worker...")
+    elif job["chunk_count"] == 0:
+        st.progress(0.0, text="Extracting topics...")
+    else:
+        st.progress(
+            job["chunks_done"] / job["chunk_count"],
+            text=f"Generated cards for {job['chunks_done']}/{job['chunk_count']} sections",
+        )
+    if st.button("Cancel generation"):
+        cancel_job(job_id)
+        del st.session_state["job_id"]
+        st.rerun()
+    for card in job["cards"]:
+        st.divider()
+        st.write(f"**{card['question']}**")
+        st.write(card["answer"])
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
+
+
 if submit & (data is not None) & (flashcard_name != ""):
-    content = read_file(data, data.type)
-    quiz_collection, topics = quiz(content)
-    st.session_state["topics"] = topics
-    st.session_state["flashcard_data"] = quiz_collection
+    st.session_state["job_id"] = submit_job(flashcard_name, data, data.type, use_cache)
+    st.session_state["job_keep_existing"] = False
 
 if rerun and (data is not None) and (flashcard_name != ""):
-    content = read_file(data, data.type)
-    quiz_collection, topics = quiz(content)
-    st.session_state["topics"] = topics
-    st.session_state["flashcard_data"].extend(quiz_collection)
+    # New cards are appended to the current ones, so they are never taken from the cache
+    st.session_state["job_id"] = submit_job(flashcard_name, data, data.type, use_cache=False)
+    st.session_state["job_keep_existing"] = True
+
+if "job_id" in st.session_state:
+    show_job(st.session_state["job_id"])
+
+if "job_error" in st.session_state:
+    st.error(st.session_state.pop("job_error"))
+if "job_warning" in st.session_state:
+    st.warning(st.session_state.pop("job_warning"))
 
 
 if st.session_state["flashcard_data"] and st.session_state["topics"]:
@@ -130,12 +207,10 @@ if st.session_state["flashcard_data"]:
 
     st.divider()
     if st.button("Create Flashcards", use_container_width=True, type="primary"):
-        for flashcard_quiz in st.session_state["flashcard_data"]:
-            insert_flashcard_data(
-                question=flashcard_quiz["question"],
-                answer=flashcard_quiz["answer"],
-                model=str((4.0, 4.0, 24.0)),
-                last_test=datetime.now(),
-                total=0,
-                flashcard_name=flashcard_name,
-            )
+        insert_flashcards_bulk(
+            st.session_state["flashcard_data"],
+            model=DEFAULT_MODEL,
+            last_test=datetime.now(),
+            total=0,
+            flashcard_name=flashcard_name,
+        )
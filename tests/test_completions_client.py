@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from median import inference_backends
+from median.inference_backends import CompletionsClient
+
+
+class CompletionsHandler(BaseHTTPRequestHandler):
+    """
+    Serves /v1/completions, echoing each prompt back in two pieces.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.payloads.append(body)
+            server.running += 1
+            server.peak = max(server.peak, server.running)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        with server.lock:
+            server.running -= 1
+        if status != 200:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        prompts = body["prompt"]
+        if not body["stream"]:
+            choices = [{"index": i, "text": f"<{p}>"} for i, p in enumerate(prompts)]
+            data = json.dumps({"choices": choices}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        # Interleave the prompts, last prompt first, as a batching server would
+        events = [(i, f"<{p}") for i, p in reversed(list(enumerate(prompts)))]
+        events += [(i, ">") for i in range(len(prompts))]
+        for index, text in events:
+            event = json.dumps({"choices": [{"index": index, "text": text}]})
+            self.wfile.write(f"data: {event}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionsHandler)
+    server.lock = threading.Lock()
+    server.payloads, server.statuses = [], []
+    server.running = server.peak = 0
+    server.delay = 0.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs) -> CompletionsClient:
+    return CompletionsClient(f"http://127.0.0.1:{server.server_port}/v1", "model", **kwargs)
+
+
+OPTIONS = {"max_tokens": 16, "temp": 0.0, "repetition_penalty": 1.1, "constrained": True}
+
+
+def test_streamed_pieces_are_collected_per_prompt(server):
+    assert client(server).stream_text(["a", "b", "c"], OPTIONS) == ["<a>", "<b>", "<c>"]
+    assert server.payloads[0]["stream"] is True
+
+
+def test_complete_returns_choices_in_prompt_order(server):
+    assert client(server).complete(["a", "b"], OPTIONS) == ["<a>", "<b>"]
+
+
+def test_unavailable_server_is_retried(server):
+    server.statuses = [503, 502]
+    assert client(server).complete(["a"], OPTIONS) == ["<a>"]
+    assert len(server.payloads) == 3
+
+
+def test_read_timeouts_are_not_retried(server, monkeypatch):
+    monkeypatch.setattr(inference_backends, "API_TIMEOUT", (5, 0.2))
+    server.delay = 0.5
+    with pytest.raises(requests.exceptions.RequestException):
+        client(server).complete(["a"], OPTIONS)
+    time.sleep(0.5)
+    assert len(server.payloads) == 1
+
+
+def test_in_flight_requests_are_bounded(server):
+    server.delay = 0.05
+    completions = client(server, max_in_flight=2)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda p: completions.stream_text([p], OPTIONS), "abcdef"))
+    assert results == [[f"<{p}>"] for p in "abcdef"]
+    assert server.peak == 2
+
+
+def test_server_specific_fields(server):
+    client(server, guided_field="json_schema", penalty_field="repeat_penalty").complete(["a"], OPTIONS)
+    client(server, guided_field=None, penalty_field=None).complete(["a"], OPTIONS)
+    llama_cpp, plain = server.payloads
+    assert llama_cpp["repeat_penalty"] == 1.1 and "repetition_penalty" not in llama_cpp
+    assert llama_cpp["json_schema"] == inference_backends.json_schema
+    assert not {"repeat_penalty", "repetition_penalty", "json_schema", "guided_json"} & set(plain)
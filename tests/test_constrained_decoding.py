@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from median.constrained_decoding import (
+    QuizJSONConstraint,
+    join_pieces,
+    token_pieces,
+)
+
+COLLECTION = {
+    "collection": [
+        {"question": "What is a \"closure\"?", "answer": "A function with its scope {env}."},
+        {"question": "Quoi ?", "answer": "Une réponse écrite en français"},
+    ]
+}
+
+
+def accepts(text: str) -> bool:
+    return QuizJSONConstraint.advance_text((0, 0, 0), text) is not None
+
+
+def completes(text: str) -> bool:
+    state = QuizJSONConstraint.advance_text((0, 0, 0), text)
+    return state is not None and QuizJSONConstraint.is_complete(state)
+
+
+@pytest.mark.parametrize("indent", [None, 2, 4, "\t"])
+def test_serialized_collections_are_complete(indent):
+    assert completes(json.dumps(COLLECTION, indent=indent))
+
+
+def test_empty_collection_is_complete():
+    assert completes('{"collection": []}')
+
+
+def test_unicode_escapes_are_accepted():
+    assert completes('{"collection": [{"question": "\\u00e9?", "answer": "\\n"}]}')
+
+
+def test_prefixes_are_accepted_but_incomplete():
+    text = json.dumps(COLLECTION)
+    for end in range(len(text)):
+        assert accepts(text[:end])
+        assert not completes(text[:end])
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"cards"',
+        '{"collection": {',
+        '{"collection": [{"answer"',
+        '{"collection": [{"question": 1',
+        '{"collection": [{"question": "a\nb"',
+        '{"collection": [{"question": "\\x"',
+        '{"collection": [{"question": "\\u00g"',
+        '{"collection": [],',
+        '{"collection": [{"question": "q", "answer": "a"},]',
+        '{"collection": []} trailing',
+        "{" + " " * 100,
+    ],
+)
+def test_invalid_text_is_rejected(text):
+    assert not accepts(text)
+
+
+def byte_pieces(text: str) -> list:
+    return [chr(0xDC00 + byte) for byte in text.encode("utf-8")]
+
+
+def test_utf8_byte_sequences_are_accepted_inside_strings():
+    prefix = '{"collection": [{"question": "'
+    state = QuizJSONConstraint.advance_text((0, 0, 0), prefix)
+    pieces = byte_pieces("é€😀")
+    for piece in pieces:
+        state = QuizJSONConstraint.step(state, piece)
+        assert state is not None
+    assert QuizJSONConstraint.step(state, '"') is not None
+    assert join_pieces([prefix, *pieces]) == prefix + "é€😀"
+
+
+@pytest.mark.parametrize(
+    "pieces",
+    [
+        [chr(0xDC80)],  # continuation byte without a lead byte
+        [chr(0xDCC3), "a"],  # lead byte followed by ASCII
+        [chr(0xDCC3), '"'],  # string closed inside a sequence
+        [chr(0xDCF8)],  # not a UTF-8 lead byte
+    ],
+)
+def test_broken_utf8_byte_sequences_are_rejected(pieces):
+    state = QuizJSONConstraint.advance_text((0, 0, 0), '{"collection": [{"question": "')
+    assert QuizJSONConstraint.advance_text(state, "".join(pieces)) is None
+
+
+def test_raw_bytes_are_rejected_outside_strings():
+    assert not accepts("{" + chr(0xDCC3))
+
+
+class ByteFallbackTokenizer:
+    """
+    A SentencePiece-like vocabulary with byte-fallback tokens.
+    """
+
+    tokens = ["<s>", "</s>", "▁the", "{", "<0x0A>", "<0xC3>", "<0xA9>"]
+    all_special_ids = [0, 1]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.tokens[i] for i in ids]
+
+    def convert_tokens_to_string(self, tokens):
+        return "".join(tokens)
+
+
+def test_token_pieces_map_byte_fallback_tokens():
+    pieces = token_pieces(ByteFallbackTokenizer())
+    assert pieces[:5] == [None, None, " the", "{", "\n"]
+    assert join_pieces(pieces[5:]) == "é"
@@ -0,0 +1,105 @@
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from median import database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "flashcards.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    return path
+
+
+def test_bulk_insert_returns_consecutive_ids(db_path):
+    cards = [{"question": f"q{i}", "answer": f"a{i}"} for i in range(3)]
+    ids = database.insert_flashcards_bulk(
+        cards, database.DEFAULT_MODEL, datetime(2024, 1, 1), 0, "deck"
+    )
+    rows = database.select_flashcard_by_name("deck")
+    assert [row[0] for row in rows] == ids == [ids[0], ids[0] + 1, ids[0] + 2]
+    assert [(row[2], row[3]) for row in rows] == [("q0", "a0"), ("q1", "a1"), ("q2", "a2")]
+
+
+def test_bulk_insert_rolls_back_the_whole_deck(db_path):
+    cards = [{"question": "q0", "answer": "a0"}, {"question": object(), "answer": "a1"}]
+    with pytest.raises(sqlite3.Error):
+        database.insert_flashcards_bulk(
+            cards, database.DEFAULT_MODEL, datetime(2024, 1, 1), 0, "deck"
+        )
+    assert database.select_flashcard_by_name("deck") == []
+    assert database.select_all_unique_flashcard_names() == []
+
+
+LEGACY_SCHEMAS = [
+    "CREATE TABLE flashcards (id INTEGER PRIMARY KEY, question TEXT, answer TEXT, model TEXT, lastTest TEXT, total INTEGER, flashcardName TEXT)",
+    "CREATE TABLE flashcards (id INTEGER PRIMARY KEY, flashcardName TEXT, question TEXT, answer TEXT, model TEXT, lastTest TEXT, total INTEGER)",
+]
+
+
+@pytest.mark.parametrize("schema", LEGACY_SCHEMAS)
+def test_version_0_database_is_migrated_to_the_current_schema(db_path, schema):
+    conn = sqlite3.connect(db_path)
+    conn.execute(schema)
+    conn.executemany(
+        "INSERT INTO flashcards(id, flashcardName, question, answer, model, lastTest, total) VALUES (?,?,?,?,?,?,?)",
+        [
+            (3, "deck", "q3", "a3", "(3.0, 5.0, 12.0)", "2024-01-02 03:04:05.678000", 2),
+            (7, "deck", "q7", "a7", "not a model", "not a date", 0),
+            (9, "other", "q9", "a9", "(4.0, 4.0, 24.0)", "2024-01-01 00:00:00", 1),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    rows = database.select_flashcard_by_name("deck")
+    assert database.select_all_unique_flashcard_names() == ["deck", "other"]
+
+    first, garbled = rows
+    last_test = datetime(2024, 1, 2, 3, 4, 5, 678000).timestamp()
+    assert first == (3, "deck", "q3", "a3", 3.0, 5.0, 12.0, last_test, 2)
+    assert garbled[0] == 7 and garbled[4:7] == database.DEFAULT_MODEL
+
+    with database.get_db_connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+        due = conn.execute("SELECT due FROM flashcards WHERE id = 3").fetchone()[0]
+        assert due == database.due_timestamp((3.0, 5.0, 12.0), last_test)
+        assert conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "flashcards_v0" not in tables
+
+
+class RacingConnection:
+    """
+    Lets another connection migrate the database right after the schema version is first read.
+    """
+
+    def __init__(self, conn, rival):
+        self.conn, self.rival = conn, rival
+
+    def execute(self, sql, *args):
+        cursor = self.conn.execute(sql, *args)
+        if sql != "PRAGMA user_version" or self.rival is None:
+            return cursor
+        row = cursor.fetchone()
+        cursor.close()
+        rival, self.rival = self.rival, None
+        database.migrate(rival)
+        return SimpleNamespace(fetchone=lambda: row)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+def test_concurrent_migrations_apply_each_version_once(db_path):
+    first, second = sqlite3.connect(db_path), sqlite3.connect(db_path)
+    database.migrate(RacingConnection(first, second))
+    assert first.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+    first.close()
+    second.close()
@@ -0,0 +1,80 @@
+import io
+
+import pypdf
+import pytest
+from docx import Document
+
+from median import cache, file_reader
+
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+@pytest.fixture(autouse=True)
+def extraction_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    extraction = cache.DiskCache("extraction", max_bytes=1024 * 1024, max_age=60)
+    monkeypatch.setattr(file_reader, "EXTRACTION_CACHE", extraction)
+    return extraction
+
+
+@pytest.fixture
+def docx_path(tmp_path):
+    doc = Document()
+    for text in ("First paragraph", "Deuxième paragraphe"):
+        doc.add_paragraph(text)
+    path = tmp_path / "upload.docx"
+    doc.save(path)
+    return str(path)
+
+
+def blank_pdf(path, pages: int) -> str:
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def test_docx_is_read_from_a_path(docx_path):
+    assert file_reader.read_docx(docx_path) == "First paragraph\nDeuxième paragraphe"
+
+
+def test_docx_is_read_from_an_upload(docx_path):
+    with open(docx_path, "rb") as f:
+        upload = io.BytesIO(f.read())
+    assert file_reader.read_docx(upload) == "First paragraph\nDeuxième paragraphe"
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_main_reads_docx_paths(docx_path, use_cache):
+    assert file_reader.main(docx_path, DOCX, use_cache) == "First paragraph\nDeuxième paragraphe"
+
+
+def test_text_is_read_from_a_path(tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("# Titre\n\nÉtude", encoding="utf-8")
+    assert file_reader.main(str(path), "text/markdown") == "# Titre\n\nÉtude"
+    (tmp_path / "empty.txt").touch()
+    assert file_reader.main(str(tmp_path / "empty.txt"), "text/plain") == ""
+
+
+def test_pdf_pages_are_read_from_a_path(tmp_path):
+    assert file_reader.read_pdf_pages(blank_pdf(tmp_path / "blank.pdf", 3)) == ["", "", ""]
+
+
+def test_extractions_with_failed_pages_are_not_cached(tmp_path, monkeypatch):
+    path = blank_pdf(tmp_path / "slow.pdf", 3)
+    timed_out = {1}
+    pages = iter(range(6))
+
+    def extract_page(page, page_timeout):
+        index = next(pages) % 3
+        return None if index in timed_out else f"page {index}. "
+
+    monkeypatch.setattr(file_reader, "_extract_page", extract_page)
+    assert file_reader.main(path, "application/pdf") == "page 0. page 2. "
+    timed_out.clear()
+    assert file_reader.main(path, "application/pdf") == "page 0. page 1. page 2. "
+    monkeypatch.setattr(file_reader, "_extract_page", None)
+    assert file_reader.main(path, "application/pdf") == "page 0. page 1. page 2. "
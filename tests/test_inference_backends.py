@@ -0,0 +1,152 @@
+import gc
+
+import pytest
+
+mx = pytest.importorskip("mlx.core")
+llama = pytest.importorskip("mlx_lm.models.llama")
+from mlx.utils import tree_map
+
+from median import inference_backends, llm_provider
+from median.inference_backends import BACKENDS, MLXBackend, _speculative_decode
+
+VOCAB_SIZE = 64
+
+
+class CharTokenizer:
+    """
+    A tokenizer mapping every character to one token id, enough to drive MLXBackend.
+    """
+
+    eos_token_id = VOCAB_SIZE - 1
+    pad_token_id = 0
+
+    def encode(self, text):
+        return [1] + [2 + ord(char) % (VOCAB_SIZE - 3) for char in text]
+
+    def decode(self, tokens):
+        return " ".join(str(token) for token in tokens)
+
+
+def tiny_model(dtype, seed=0):
+    mx.random.seed(seed)
+    args = llama.ModelArgs(
+        model_type="llama",
+        hidden_size=32,
+        num_hidden_layers=2,
+        intermediate_size=64,
+        num_attention_heads=4,
+        rms_norm_eps=1e-5,
+        vocab_size=VOCAB_SIZE,
+        num_key_value_heads=2,
+    )
+    model = llama.Model(args)
+    model.update(tree_map(lambda p: p.astype(dtype), model.parameters()))
+    return model
+
+
+GREEDY = {"temp": 0.0, "max_tokens": 12, "constrained": False}
+PROMPTS = ["a short prompt", "a noticeably longer prompt than the first one"]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_batched_output_matches_unbatched_output(dtype):
+    model = tiny_model(getattr(mx, dtype))
+    backend, tokenizer = MLXBackend(), CharTokenizer()
+    batched = backend.generate_batch(model, tokenizer, PROMPTS, GREEDY)
+    # A batch of identical prompts needs no padding
+    unbatched = [
+        backend.generate_batch(model, tokenizer, [prompt, prompt], GREEDY)[0]
+        for prompt in PROMPTS
+    ]
+    assert batched == unbatched
+
+
+@pytest.mark.parametrize("penalty", [None, 1.3])
+def test_speculative_decoding_matches_greedy_decoding(penalty):
+    model, draft = tiny_model(mx.float32), tiny_model(mx.float32, seed=1)
+    backend, tokenizer = MLXBackend(), CharTokenizer()
+    config = {**GREEDY, "max_tokens": 24, "repetition_penalty": penalty}
+    for prompt in PROMPTS:
+        greedy = backend.generate_batch(model, tokenizer, [prompt, prompt], config)[0]
+        speculative = _speculative_decode(
+            model,
+            draft,
+            tokenizer.encode(prompt),
+            config["max_tokens"],
+            tokenizer.eos_token_id,
+            penalty=penalty,
+        )
+        assert tokenizer.decode(speculative) == greedy
+
+
+PREFIX = "a shared prompt prefix, "
+
+
+@pytest.mark.parametrize(
+    "rests", [["same length", "equal sized"], ["short", "a much longer rest of the prompt"]]
+)
+def test_prompt_prefix_reuse_does_not_change_the_output(rests):
+    model = tiny_model(mx.float32)
+    tokenizer = CharTokenizer()
+    prompts = [PREFIX + rest for rest in rests]
+    reference = MLXBackend().generate_batch(model, tokenizer, prompts, GREEDY)
+    backend = MLXBackend()
+    config = {**GREEDY, "prompt_prefix": PREFIX}
+    assert backend.generate_batch(model, tokenizer, prompts, config) == reference
+    assert backend.generate_batch(model, tokenizer, prompts, config) == reference
+
+
+def test_prefix_cache_is_not_shared_between_models():
+    backend, tokenizer = MLXBackend(), CharTokenizer()
+    tokens = [tokenizer.encode(PREFIX + "rest")]
+    first, second = tiny_model(mx.float32, seed=0), tiny_model(mx.float32, seed=1)
+    cache, length = backend.prefix_cache(first, tokenizer, tokens, PREFIX)
+    assert length == len(tokenizer.encode(PREFIX))
+    assert backend.prefix_cache(first, tokenizer, tokens, PREFIX)[0] is cache
+    assert backend.prefix_cache(second, tokenizer, tokens, PREFIX)[0] is not cache
+
+
+def test_evicted_models_release_their_prefix_cache(monkeypatch):
+    backend, tokenizer = BACKENDS["mlx"], CharTokenizer()
+    model = tiny_model(mx.float32)
+    backend.prefix_cache(model, tokenizer, [tokenizer.encode(PREFIX + "rest")], PREFIX)
+    monkeypatch.setitem(llm_provider.MODEL_REGISTRY, ("mlx", "tiny", "4bit"), (model, tokenizer))
+    assert llm_provider.evict_model("tiny") == 1
+    assert backend._prefix_cache is None
+
+
+class PieceTokenizer(CharTokenizer):
+    """
+    A CharTokenizer exposing the vocabulary methods token_pieces() reads.
+    """
+
+    all_special_ids = [CharTokenizer.eos_token_id]
+
+    def __len__(self):
+        return VOCAB_SIZE
+
+    def convert_ids_to_tokens(self, ids):
+        return [f"t{i}" for i in ids]
+
+    def convert_tokens_to_string(self, tokens):
+        return "".join(tokens)
+
+
+def test_token_pieces_are_computed_once_and_dropped_with_their_tokenizer():
+    cached = len(inference_backends.TOKEN_PIECES)
+    tokenizer = PieceTokenizer()
+    pieces = inference_backends._token_pieces(tokenizer)
+    assert pieces[1] == "t1" and pieces[CharTokenizer.eos_token_id] is None
+    assert inference_backends._token_pieces(tokenizer) is pieces
+    del tokenizer
+    gc.collect()
+    assert len(inference_backends.TOKEN_PIECES) == cached
+
+
+def test_evicted_tokenizers_release_their_token_pieces(monkeypatch):
+    tokenizer = PieceTokenizer()
+    inference_backends._token_pieces(tokenizer)
+    model = tiny_model(mx.float32)
+    monkeypatch.setitem(llm_provider.MODEL_REGISTRY, ("mlx", "tiny", "4bit"), (model, tokenizer))
+    llm_provider.evict_model("tiny")
+    assert tokenizer not in inference_backends.TOKEN_PIECES
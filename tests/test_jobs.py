@@ -0,0 +1,149 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip("pke")
+
+from median import database, jobs
+
+
+@pytest.fixture(autouse=True)
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "flashcards.db"))
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+
+
+def submit(name="deck"):
+    return jobs.submit_job(name, io.BytesIO(b"Some text."), "text/plain")
+
+
+def test_jobs_are_claimed_once_and_in_order():
+    first, second = submit("first"), submit("second")
+    claimed = jobs._claim_job()
+    assert claimed["id"] == first and jobs.get_job(first)["status"] == jobs.RUNNING
+    assert jobs._claim_job()["id"] == second
+    assert jobs._claim_job() is None
+    assert os.path.exists(claimed["file_path"])
+
+
+def test_cancelled_jobs_are_not_claimed():
+    cancelled, queued = submit(), submit()
+    jobs.cancel_job(cancelled)
+    assert jobs.get_job(cancelled)["status"] == jobs.CANCELLED
+    assert jobs._claim_job()["id"] == queued
+
+
+def test_cancelling_a_running_job_stops_its_progress():
+    submit()
+    job = jobs._claim_job()
+    assert jobs._record_chunk(job, 0, 2, [{"question": "q", "answer": "a"}], ["t"], None)
+    jobs.cancel_job(job["id"])
+    assert not jobs._record_chunk(job, 1, 2, [], ["t"], None)
+    stored = jobs.get_job(job["id"])
+    assert stored["status"] == jobs.CANCELLED and stored["chunks_done"] == 1
+
+
+def test_finished_jobs_cannot_be_cancelled():
+    submit()
+    job = jobs._claim_job()
+    jobs._finish_job(job["id"], jobs.DONE)
+    jobs.cancel_job(job["id"])
+    assert jobs.get_job(job["id"])["status"] == jobs.DONE
+
+
+def run(monkeypatch, chunks, use_cache=True):
+    def iter_quiz(content, use_cache=True):
+        assert use_cache == job["use_cache"]
+        for chunk in chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def read_file(file, file_type, use_cache=True):
+        assert use_cache, "extraction is always cached"
+        return "Some text."
+
+    monkeypatch.setattr(jobs, "read_file", read_file)
+    monkeypatch.setattr(jobs, "generation_concurrency", lambda: 1)
+    monkeypatch.setattr(jobs, "iter_quiz", iter_quiz)
+    jobs.submit_job("deck", io.BytesIO(b"Some text."), "text/plain", use_cache)
+    job = jobs._claim_job()
+    jobs.run_job(job)
+    assert not os.path.exists(job["file_path"])
+    return jobs.get_job(job["id"])
+
+
+CARD = {"question": "q", "answer": "a"}
+
+
+def test_failed_chunks_are_reported_and_the_others_kept(monkeypatch):
+    job = run(monkeypatch, [(0, 2, [CARD], ["t"], None), (1, 2, [], ["t"], "no valid card")])
+    assert job["status"] == jobs.DONE
+    assert job["cards"] == [CARD]
+    assert job["chunk_errors"] == [{"chunk": 1, "error": "no valid card"}]
+
+
+def test_job_fails_when_no_chunk_is_generated(monkeypatch):
+    job = run(monkeypatch, [(0, 1, [], ["t"], "no valid card")])
+    assert job["status"] == jobs.FAILED and job["error"] == "no valid card"
+
+
+def test_failed_job_keeps_the_cards_generated_before_the_error(monkeypatch):
+    job = run(monkeypatch, [(0, 2, [CARD], ["t"], None), RuntimeError("model crashed")])
+    assert job["status"] == jobs.FAILED and job["error"] == "model crashed"
+    assert job["cards"] == [CARD]
+
+
+def test_jobs_of_dead_workers_are_requeued_from_the_start():
+    submit()
+    job = jobs._claim_job()
+    jobs._record_chunk(job, 0, 2, [CARD], ["t"], "partial")
+    with database.get_db_connection() as conn:
+        # Above the largest Linux PID, so no process has it
+        conn.execute("UPDATE jobs SET worker_pid = ? WHERE id = ?", (2**22 + 1, job["id"]))
+        conn.commit()
+    assert jobs.requeue_stale_jobs() == 1
+    requeued = jobs.get_job(job["id"])
+    assert requeued["status"] == jobs.QUEUED
+    assert requeued["chunks_done"] == 0 and requeued["cards"] == [] and requeued["chunk_errors"] == []
+
+
+def test_chunks_finishing_out_of_order_are_recorded_in_chunk_order():
+    submit()
+    job = jobs._claim_job()
+    cards = [{"question": f"q{i}", "answer": f"a{i}"} for i in range(3)]
+    for index in (2, 0, 1):
+        error = "no valid card" if index == 1 else None
+        jobs._record_chunk(job, index, 3, [] if error else [cards[index]], ["t"], error)
+    stored = jobs.get_job(job["id"])
+    assert stored["cards"] == [cards[0], cards[2]]
+    assert stored["chunks_done"] == 3
+
+
+def test_regenerating_reuses_the_extraction_cache(monkeypatch):
+    job = run(monkeypatch, [(0, 1, [CARD], ["t"], None)], use_cache=False)
+    assert job["status"] == jobs.DONE and job["use_cache"] is False
+
+
+def test_cancelling_a_queued_job_deletes_its_file():
+    job = jobs.get_job(submit())
+    jobs.cancel_job(job["id"])
+    assert not os.path.exists(job["file_path"])
+
+
+def test_worker_that_cannot_load_the_model_fails_queued_jobs(monkeypatch):
+    def warmup_model():
+        raise OSError("model not found")
+
+    parent = os.getppid()
+    polls = iter([parent, parent, parent + 1])
+    monkeypatch.setattr(jobs, "warmup_model", warmup_model)
+    monkeypatch.setattr(jobs.os, "getppid", lambda: next(polls))
+    monkeypatch.setattr(jobs, "WORKER_POLL_SECONDS", 0)
+    job = jobs.get_job(submit())
+
+    jobs.worker_loop(parent)
+    failed = jobs.get_job(job["id"])
+    assert failed["status"] == jobs.FAILED and "model not found" in failed["error"]
+    assert not os.path.exists(job["file_path"])
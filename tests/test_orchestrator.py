@@ -0,0 +1,66 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pke")
+
+from median import orchestrator
+
+QUIZ = json.dumps({"collection": [{"question": "q", "answer": "a"}]})
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    state = {"running": 0, "peak": 0, "count": 0}
+    lock = threading.Lock()
+
+    def generation(doc, lang, topics):
+        with lock:
+            state["running"] += 1
+            state["count"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        # The first call of each chunk outlives its timeout
+        time.sleep(0.3 if doc.endswith("slow") and state["count"] <= 2 else 0.01)
+        with lock:
+            state["running"] -= 1
+        return QUIZ
+
+    monkeypatch.setattr(orchestrator, "generation", generation)
+    monkeypatch.setattr(orchestrator, "retry_delay", lambda attempt: 0)
+    return state
+
+
+def test_timed_out_calls_keep_their_slot_until_their_thread_finishes(calls):
+    async def main():
+        semaphore = asyncio.Semaphore(1)
+        return await asyncio.gather(
+            *(
+                orchestrator.generate_chunk(doc, "en", ["t"], semaphore, False, timeout=0.1)
+                for doc in ("first slow", "second")
+            )
+        )
+
+    results = asyncio.run(main())
+    assert all(result["collection"] for result in results)
+    assert calls["peak"] == 1
+
+
+def test_chunks_are_yielded_with_their_index_and_error(monkeypatch, calls):
+    monkeypatch.setattr(
+        orchestrator,
+        "prepare_chunks",
+        lambda content, chunk_mode, topic_mode: ("en", ["a", "b"], ["t"], [["t"], ["t"]]),
+    )
+    monkeypatch.setattr(
+        orchestrator, "generation", lambda doc, lang, topics: QUIZ if doc == "a" else "no json"
+    )
+
+    async def main():
+        return [chunk async for chunk in orchestrator.aiter_quiz("text", False, concurrency=2)]
+
+    chunks = sorted(asyncio.run(main()))
+    assert chunks[0] == (0, 2, [{"question": "q", "answer": "a"}], ["t"], None)
+    assert chunks[1][:4] == (1, 2, [], ["t"]) and chunks[1][4]
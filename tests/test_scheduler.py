@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from median import database
+from median.scheduler import record_review
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "flashcards.db"))
+    cards = [{"question": f"q{i}", "answer": f"a{i}"} for i in range(3)]
+    last_test = datetime.now() - timedelta(days=1)
+    return database.insert_flashcards_bulk(cards, database.DEFAULT_MODEL, last_test, 0, "deck")
+
+
+def test_review_is_written_and_only_that_card_is_rescheduled(deck):
+    card, *others = database.select_next_due_flashcards("deck", 3)
+    model = record_review(card, 1)
+
+    stored = {row[0]: row for row in database.select_flashcard_by_name("deck")}
+    assert stored[card[0]][8] == 1
+    assert stored[card[0]][4:7] == pytest.approx(model)
+    assert stored[card[0]][7] > card[7]
+    assert [stored[other[0]] for other in others] == others
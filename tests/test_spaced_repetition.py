@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+import ebisu
+import numpy as np
+import pytest
+
+from median import database, spaced_repetition
+from median.spaced_repetition import (
+    ReviewSession,
+    lowest_recall,
+    predict_log_recall,
+    recall_prediction,
+)
+
+MODELS = [(4.0, 4.0, 24.0), (3.0, 5.0, 2.0), (10.0, 2.0, 100.0), (2.5, 2.5, 0.5)]
+ELAPSED = [1.0, 30.0, 500.0, 0.1]
+
+
+def test_log_recall_matches_ebisu():
+    alpha, beta, t = np.array(MODELS).T
+    expected = [
+        ebisu.predictRecall(model, elapsed, exact=False)
+        for model, elapsed in zip(MODELS, ELAPSED)
+    ]
+    assert predict_log_recall(alpha, beta, t, ELAPSED) == pytest.approx(expected)
+
+
+def test_log_recall_stays_finite_long_after_the_last_test():
+    log_recall = predict_log_recall([4.0], [4.0], [1.0], [1e7])
+    assert np.isfinite(log_recall).all() and log_recall[0] < -50
+
+
+def test_lowest_recall_returns_the_k_least_recalled_facts_in_order():
+    now = datetime.now().timestamp()
+    last_tests = [now - hours * 3600 for hours in ELAPSED]
+    recalls = [ebisu.predictRecall(m, e, exact=True) for m, e in zip(MODELS, ELAPSED)]
+    order = [["a", "b", "c", "d"][i] for i in np.argsort(recalls)]
+
+    lowest = lowest_recall(["a", "b", "c", "d"], MODELS, last_tests, k=2)
+    assert [row["factID"] for row in lowest] == order[:2]
+    assert [row["recall"] for row in lowest] == pytest.approx(sorted(recalls)[:2], rel=1e-3)
+    assert lowest_recall([], [], [], k=3) == []
+
+
+def test_recall_prediction_sorts_the_whole_deck():
+    now = datetime.now().timestamp()
+    database = [
+        {"factID": i, "model": model, "lastTest": now - elapsed * 3600}
+        for i, (model, elapsed) in enumerate(zip(MODELS, ELAPSED))
+    ]
+    recalls = [row["recall"] for row in recall_prediction(database)]
+    assert len(recalls) == len(MODELS) and recalls == sorted(recalls)
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "flashcards.db"))
+    cards = [{"question": f"q{i}", "answer": f"a{i}"} for i in range(3)]
+    last_test = datetime.now() - timedelta(days=1)
+    return database.insert_flashcards_bulk(cards, database.DEFAULT_MODEL, last_test, 0, "deck")
+
+
+def stored(card_id):
+    return {row[0]: row for row in database.select_flashcard_by_name("deck")}[card_id]
+
+
+def test_answers_are_buffered_until_flushed_in_one_transaction(deck, monkeypatch):
+    writes = []
+    bulk = spaced_repetition.update_flashcard_reviews_bulk
+    monkeypatch.setattr(
+        spaced_repetition,
+        "update_flashcard_reviews_bulk",
+        lambda reviews: writes.append(len(reviews)) or bulk(reviews),
+    )
+    session = ReviewSession("deck", flush_every=2)
+    first = session.current()
+    model = session.answer(2)
+    assert stored(first[0])[8] == 0 and writes == []
+
+    session.current()
+    session.answer(2)
+    assert writes == [2]
+    assert stored(first[0])[4:7] == pytest.approx(model)
+    assert stored(first[0])[8] == 1
+
+
+def test_buffered_answers_are_flushed_after_the_interval_and_on_close(deck, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(spaced_repetition.time, "monotonic", lambda: clock[0])
+    session = ReviewSession("deck", flush_interval=60)
+    first = session.current()
+    session.answer(1)
+    clock[0] = 61
+    session.current()
+    assert stored(first[0])[8] == 1
+
+    second = session.current()
+    session.answer(1)
+    assert stored(second[0])[8] == 0
+    session.close()
+    assert stored(second[0])[8] == 1
+
+
+def test_card_answered_again_stays_in_the_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "flashcards.db"))
+    now = datetime.now()
+    database.insert_flashcard_data("new", "a", database.DEFAULT_MODEL, now - timedelta(hours=30), 0, "deck")
+    # Due in three weeks, but inside the batch since the deck is small
+    for i in range(2):
+        database.insert_flashcard_data(f"known{i}", "a", (4.0, 4.0, 720.0), now - timedelta(days=9), 5, "deck")
+
+    session = ReviewSession("deck")
+    assert session.current()[2] == "new"
+    session.answer(0)
+    assert [card[2] for card in session.queue].count("new") == 1
+    assert next(card for card in session.queue if card[2] == "new")[8] == 1
+
+    session.current()
+    session.answer(2)
+    assert [card[2] for card in session.queue].count("new") == 1
+    assert len(session.queue) == 2
+
+
+def test_session_fetches_more_cards_when_the_batch_runs_out(deck):
+    session = ReviewSession("deck", batch_size=2)
+    reviewed = []
+    for _ in range(3):
+        reviewed.append(session.current()[0])
+        session.answer(2)
+    assert sorted(reviewed) == sorted(deck)
+    session.close()
+    assert all(stored(card_id)[8] == 1 for card_id in deck)
+
+
+def test_prefetched_cards_are_served_from_the_lowest_recall(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "flashcards.db"))
+    now = datetime.now()
+    # Due first, half an hour past its half-life
+    database.insert_flashcard_data("sure", "a", (40.0, 40.0, 1.0), now - timedelta(hours=1.5), 3, "deck")
+    # Due later, but alpha < beta puts its recall at t far below one half
+    database.insert_flashcard_data("vague", "a", (2.0, 10.0, 100.0), now - timedelta(hours=90), 1, "deck")
+
+    assert database.select_next_due_flashcards("deck", 2)[0][2] == "sure"
+    assert ReviewSession("deck").current()[2] == "vague"
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+from langchain.docstore.document import Document
+
+from median import utils
+from median.utils import remove_near_duplicates
+
+
+def text(seed: int, words: int = 200) -> str:
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randrange(5000)}" for _ in range(words))
+
+
+def edited(source: str, changes: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = source.split()
+    for index in rng.sample(range(len(words)), changes):
+        words[index] = "edited"
+    return " ".join(words)
+
+
+def contents(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_near_duplicates_are_dropped_in_favour_of_the_first_occurrence():
+    first, other = text(1), text(2)
+    docs = [Document(page_content=t) for t in (first, other, edited(first, 2), first)]
+    assert contents(remove_near_duplicates(docs)) == [first, other]
+
+
+def test_distinct_and_loosely_related_documents_are_kept():
+    first = text(1)
+    texts = [first, text(2), text(3), edited(first, 60)]
+    docs = [Document(page_content=t) for t in texts]
+    assert contents(remove_near_duplicates(docs)) == texts
+
+
+def test_documents_shorter_than_a_shingle_are_compared():
+    docs = [Document(page_content=t) for t in ("a b", "a b", "c d")]
+    assert contents(remove_near_duplicates(docs)) == ["a b", "c d"]
+
+
+def test_empty_input():
+    assert remove_near_duplicates([]) == []
+
+
+@pytest.fixture
+def saved_tokenizer(tmp_path, monkeypatch):
+    tokenizers = pytest.importorskip("tokenizers")
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"[UNK]": 0, **{f"w{i}": i + 1 for i in range(5000)}}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]").save_pretrained(tmp_path)
+    monkeypatch.setattr(utils, "TOKENIZER_PATHS", {})
+    yield str(tmp_path)
+    utils.get_tokenizer.cache_clear()
+    utils.get_text_splitter.cache_clear()
+
+
+def test_tokenizer_is_preloaded_from_a_local_directory(saved_tokenizer):
+    utils.preload_tokenizer("offline/tokenizer", local_path=saved_tokenizer)
+    assert utils.token_lengths(["w1 w2 w3", "w4", ""], "offline/tokenizer") == [3, 1, 0]
+    assert utils.get_tokenizer("offline/tokenizer") is utils.get_tokenizer("offline/tokenizer")
+
+
+def test_split_documents_reuses_one_splitter(saved_tokenizer):
+    utils.preload_tokenizer("offline/tokenizer", local_path=saved_tokenizer)
+    docs = [Document(page_content=text(1, 500)), Document(page_content=text(1, 500))]
+    chunks = utils.split_documents(100, docs, "offline/tokenizer")
+    lengths = utils.token_lengths([chunk.page_content for chunk in chunks], "offline/tokenizer")
+    assert chunks and max(lengths) <= 100
+    assert len(chunks) == len({c.page_content for c in chunks})
+    utils.split_documents(100, docs, "offline/tokenizer")
+    assert utils.get_text_splitter.cache_info().hits == 1
@@ -0,0 +1,48 @@
+import json
+
+from median.validator import (
+    extract_json_from_markdown,
+    salvage_collection,
+    salvage_quizzes,
+    validate_json_data,
+)
+
+COLLECTION = {
+    "collection": [
+        {"question": "What does {} denote?", "answer": "An empty \"dict\"."},
+        {"question": "Q2", "answer": "A2"},
+    ]
+}
+
+
+def test_well_formed_output_is_valid():
+    assert validate_json_data(json.dumps(COLLECTION)) == (True, COLLECTION, None)
+
+
+def test_collection_is_found_in_markdown_and_prose():
+    output = f"Here is the quiz:\n```json\n{json.dumps(COLLECTION, indent=2)}\n```\nEnjoy!"
+    assert validate_json_data(output) == (True, COLLECTION, None)
+
+
+def test_unbalanced_quotes_in_prose_do_not_hide_the_collection():
+    output = f'Measured with a 12" ruler:\n{json.dumps(COLLECTION)}\nDone.'
+    assert extract_json_from_markdown(output) == [COLLECTION]
+    assert validate_json_data(output)[0]
+
+
+def test_python_dict_literal_is_accepted():
+    assert validate_json_data(repr(COLLECTION)) == (True, COLLECTION, None)
+
+
+def test_partial_output_is_invalid_but_salvageable():
+    truncated = json.dumps(COLLECTION)[:-20]
+    valid, _, error = validate_json_data(truncated)
+    assert not valid and error
+    assert salvage_quizzes(truncated) == COLLECTION["collection"][:1]
+
+
+def test_salvage_keeps_the_attempt_with_the_most_cards():
+    first = json.dumps(COLLECTION)[:-20]
+    second = json.dumps(COLLECTION)[:-2]
+    assert salvage_collection([first, second, None]) == COLLECTION
+    assert salvage_collection(["no cards here"]) is None